@@ -401,8 +401,72 @@ class CitationCodingEvaluation( object ):
         return status_OUT
 
     #-- END method process_citation_json() --#
-    
-    
+
+
+    def read_citation_json_file( self, json_file_path_IN ):
+
+        '''
+        Accepts path to a citation file, either a JSON list of citation
+            objects or JSON Lines (one citation object per line, file name
+            ending in ".jsonl").  Returns an iterable of the citation objects
+            that can be passed to process_citation_json().  JSON Lines files
+            are read a line at a time as they are iterated, not all at once.
+        '''
+
+        # return reference
+        value_OUT = None
+
+        # JSON Lines?
+        if ( json_file_path_IN.endswith( ".jsonl" ) == True ):
+
+            # yes - read lazily.
+            value_OUT = self.read_citation_json_lines( json_file_path_IN )
+
+        else:
+
+            # no - load the JSON list from the file.
+            with open( json_file_path_IN ) as json_file:
+
+                value_OUT = json.load( json_file )
+
+            #-- END with...as --#
+
+        #-- END check to see if JSON Lines --#
+
+        return value_OUT
+
+    #-- END method read_citation_json_file() --#
+
+
+    def read_citation_json_lines( self, json_lines_file_path_IN ):
+
+        '''
+        Accepts path to a JSON Lines citation file.  Yields the citation
+            object of each non-empty line.
+        '''
+
+        # declare variables
+        line = None
+
+        with open( json_lines_file_path_IN ) as json_lines_file:
+
+            # loop over lines
+            for line in json_lines_file:
+
+                # skip blank lines.
+                if ( line.strip() != "" ):
+
+                    yield json.loads( line )
+
+                #-- END check to see if blank line --#
+
+            #-- END loop over lines --#
+
+        #-- END with...as --#
+
+    #-- END method read_citation_json_lines() --#
+
+
     def set_baseline_list( self, instance_IN ):
         
         '''
@@ -21,6 +21,7 @@ import json
 import matplotlib
 import matplotlib.pyplot
 import numpy
+import os
 import pandas as pd
 import six
 
@@ -360,6 +361,13 @@ from citation_coding_evaluation import CitationCodingEvaluation
 baseline_json_path = "./data_set_citations.json"
 derived_json_path = "../data/output/data_set_citations.json"
 
+# make_citation_output.py --output_format jsonl writes JSON Lines instead.
+if ( ( os.path.exists( derived_json_path ) == False ) and ( os.path.exists( derived_json_path + "l" ) == True ) ):
+
+    derived_json_path = derived_json_path + "l"
+
+#-- END check to see if JSON Lines output --#
+
 
 # In[ ]:
 
@@ -392,7 +400,6 @@ with open( baseline_json_path ) as baseline_json_file:
 
 
 # load the derived JSON
-derived_json_file = None
 derived_json = None
 
 # if output...
@@ -406,13 +413,8 @@ if ( output_to_file == True ):
     
 #-- END if output to file... --#
 
-# baseline
-with open( derived_json_path ) as derived_json_file:
-
-    # load the JSON from the file.
-    derived_json = json.load( derived_json_file )
-
-#-- END with...as --#
+# derived - JSON list or JSON Lines, the latter read as it is processed.
+derived_json = CitationCodingEvaluation().read_citation_json_file( derived_json_path )
 
 
 # In[ ]:
@@ -0,0 +1,423 @@
+import argparse
+import collections
+import itertools
+import json
+import logging
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import nltk
+import numpy as np
+
+from mention_index import FuzzyMentionIndex, MentionAutomaton
+from mention_records import MentionRecords
+from sentence_table import SentenceTable, write_table
+from test_parser import FIELDNAMES, patch_model_output, patch_table, read_data_sets, rescan_automata
+from tokenizer import word_tokenize, clear_cache
+from text_util import normalize_string, split_into_sentences, sentence_spans, encode_test, extract_formatted_data_test
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark preprocessing helpers against their reference implementations')
+    parser.add_argument('--target', type=str, default='normalize',
+                        help='what to benchmark: normalize, split, tokenize, mentions, rescan, rescan_outputs, fuzzy, imports, elmo '
+                             '(default: normalize)')
+    parser.add_argument('--publication_txt_path_prefix', type=str, default='../train-data/files/text/',
+                        help='publication text files path')
+    parser.add_argument('--publications_json_path', type=str, default='../train-data/publications.json',
+                        help='publications.json path')
+    parser.add_argument('--data_sets_json_path', type=str, default='./formatted-data/data_sets.json',
+                        help='data_sets.json path, for the mentions and rescan targets')
+    parser.add_argument('--mention_dictionary', type=str, default='./formatted-data/mention_dictionary.bin',
+                        help='compiled mention dictionary of data_sets.json, for the mentions and rescan targets')
+    parser.add_argument('--data_set_citations_json_path', type=str, default='../train-data/data_set_citations.json',
+                        help='data_set_citations.json path, the fuzzy target checks its matches against the citations')
+    parser.add_argument('--fuzzy_threshold', type=float, default=0.8,
+                        help='similarity threshold of the fuzzy target (default: 0.8)')
+    parser.add_argument('--pub_date', type=str, default='2019-01-01',
+                        help='publication date the mentions and rescan targets tag the texts as of (default: 2019-01-01)')
+    parser.add_argument('--elmo_options_path', type=str, default='./elmo/options.json',
+                        help='ELMo options, for the elmo target')
+    parser.add_argument('--elmo_weights_path', type=str, default='./elmo/weights.hdf5',
+                        help='ELMo weights, for the elmo target')
+    parser.add_argument('--elmo_batch_size', type=int, default=64,
+                        help='sentences ELMo embeds at a time in the batched path of the elmo target (default: 64)')
+    parser.add_argument('--cuda_device', type=int, default=-1,
+                        help='device ELMo runs on for the elmo target, -1 for the CPU (default: -1)')
+    parser.add_argument('--limit', type=int, default=0,
+                        help='number of publications to use, 0 for all (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed runs, the best one is reported (default: 3)')
+    args = parser.parse_args()
+    return args
+
+
+# reference implementations: the versions the fast paths in util.py replaced
+def reference_normalize_string(text):
+    text = re.sub("[^ ]+%", ' ', text)
+    text = re.sub('\\\\\\\"', ' ', text)
+    text = re.sub(r"[^a-zA-Z0-9()/;:#,.?!&=~\-@\"\' ]+", ' ', text)
+    text = re.sub("\s\s+", " ", text)
+    # remove hyphens
+    text = re.sub('\xad', '-', text)
+    text = re.sub('\u00ad', '-', text)
+    text = re.sub('\N{SOFT HYPHEN}', '-', text)
+    text = re.sub(r'([^\s])- ', "\\1", text)
+    text = re.sub(r'\-', ' ', text)
+    text = re.sub("\s\s+", " ", text)
+    # remove quotes
+    text = re.sub('\"', ' ', text)
+    text = re.sub("\s\s+", " ", text)
+    # etc
+    text = re.sub(r"(?!\([1-2][0-9][0-9][0-9] to [1-2][0-9][0-9][0-9]\))\([^\)a-zA-Z]+to[^\)a-zA-Z]+\)", ' ', text) #(241234 to 124323)
+    text = re.sub(r"\([0-9]+\.[0-9]+ in [0-9]+\.[0-9]+\)", ' ', text) #(4.3-1.2)
+    text = re.sub(r"(?!\([1-2][0-9][0-9][0-9]\))(?!\([1-2][0-9][0-9][0-9] [^\)]+\))\([0-9\.\,\+ ]+\)", ' ', text)
+    text = re.sub(r"(?! [1-2][0-9][0-9][0-9] ) [0-9][0-9\.\,]+[0-9] ", ' ', text)
+    text = re.sub(r" [0-9]+\.[0-9]+", ' ', text)
+    text = re.sub("\s\s+", " ", text)
+    return text
+
+
+def split_by_spans(text):
+    return [text[start:end] for start, end in sentence_spans(text)]
+
+
+def normalized(text):
+    return [normalize_string(text)]
+
+
+def normalized_sentences(text):
+    return split_by_spans(normalize_string(text))
+
+
+def tokenized_text(text):
+    # the raw text extract_formatted_data_test() tags, the tokens of all sentences joined by spaces
+    return [' '.join(word for sentence in normalized_sentences(text) for word in word_tokenize(sentence))]
+
+
+def encode_pub_date(pub_date):
+    # the date encoding of test_parser
+    return int(pub_date[:4]) * 12 * 31 + int(pub_date[5:7]) * 31 + int(pub_date[8:10])
+
+
+def mention_target(data_sets_json_path, dictionary_path, pub_date):
+    # only the data sets older than pub_date are tagged
+    pub_date = encode_pub_date(pub_date)
+    data_set_mention_info = read_data_sets(data_sets_json_path, dictionary_path)
+    mention_automaton = MentionAutomaton(data_set_mention_info)
+    return (lambda raw_text: mention_automaton.label_sequence(raw_text, pub_date),
+            lambda raw_text: encode_test(raw_text, data_set_mention_info, pub_date),
+            tokenized_text, None)
+
+
+# two undated data sets (test_parser dates them 1800-01-01) with the same mention, the second one new to the rescan
+RESCAN_DATA_SETS = [
+    [encode_pub_date('1800-01-01'), 900001, [[['National', 'Survey'], 'National Survey']]],
+    [encode_pub_date('1800-01-01'), 900002, [[['National', 'Survey'], 'National Survey']]],
+]
+
+
+def rescan_target(data_sets_json_path, dictionary_path, pub_date):
+    # every other data set and the second of RESCAN_DATA_SETS are new: the texts they occur in are tagged again,
+    # the others keep the labels of the data sets tagged before, all as a full run tags them
+    pub_date = encode_pub_date(pub_date)
+    data_sets = read_data_sets(data_sets_json_path, dictionary_path)
+    tagged_ids = set(data_set[1] for data_set in data_sets[::2]) | {RESCAN_DATA_SETS[0][1]}
+    data_set_mention_info = data_sets + RESCAN_DATA_SETS
+    scan_automaton, mention_automaton = rescan_automata(data_set_mention_info, tagged_ids)
+    tagged_automaton = MentionAutomaton([data_set for data_set in data_set_mention_info if data_set[1] in tagged_ids])
+
+    def rescanned(raw_text):
+        if scan_automaton.occurs(raw_text, pub_date):
+            return mention_automaton.label_sequence(raw_text, pub_date)
+        return tagged_automaton.label_sequence(raw_text, pub_date)
+    return (rescanned,
+            lambda raw_text: encode_test(raw_text, data_set_mention_info, pub_date),
+            tokenized_text, None)
+
+
+# sentences of publications tagged with RESCAN_OUTPUT_DATA_SETS[:1], then rescanned for the second one:
+# the sentence of publication 1 the labeling model found 'Health Study' in is labeled by the rescan
+RESCAN_OUTPUT_DATA_SETS = [
+    [encode_pub_date('2000-01-01'), 900001, [[['National', 'Survey'], 'National Survey']]],
+    [encode_pub_date('2000-01-01'), 900002, [[['Health', 'Study'], 'Health Study']]],
+]
+RESCAN_OUTPUT_PUBLICATIONS = [
+    (1, ['we use the Health Study data here', 'and the National Survey too']),
+    (2, ['the Health Study again', 'and the Other Panel too']),
+    (3, ['nothing but the Big Panel here']),
+]
+
+
+def stub_model_output(table_path, output_path):
+    # a deterministic stand-in of inference.py: in the unlabeled sentences, runs of capitalized words are mentions
+    rows = []
+    for row in SentenceTable(table_path):
+        if row['labeled'] == 'Y':
+            continue
+        for capitalized, words in itertools.groupby(row['sentence'], key=lambda word: word[:1].isupper()):
+            words = list(words)
+            if capitalized and len(words) > 1:
+                rows.append({'mention': words, 'publication_id': row['publication_id'], 'dataset_id': 0, 'score': 0.5})
+    write_table(output_path, ['mention', 'publication_id', 'dataset_id', 'score'], rows)
+
+
+def table_predictions(test_preprocessed, unordered_output_path):
+    # what make_citation_output.py adds to the results store, in a comparable order
+    return sorted(list(MentionRecords.from_labels(SentenceTable(test_preprocessed), inside_before_begin=True))
+                  + list(MentionRecords.from_output_table(SentenceTable(unordered_output_path))))
+
+
+def compare_rescan_outputs():
+    """
+    Predictions of a table and model output rescanned for a new data set against the ones of a full run,
+    with the model output of the sentences the rescan labels replaced as test_parser.py does.
+    :return: 1 if they differ, 0 otherwise
+    """
+    pub_dates = {publication_id: encode_pub_date('2019-01-01') for publication_id, _ in RESCAN_OUTPUT_PUBLICATIONS}
+    publications = [(publication_id, [[sentence.split() for sentence in sentences], ' '.join(sentences)])
+                    for publication_id, sentences in RESCAN_OUTPUT_PUBLICATIONS]
+    with tempfile.TemporaryDirectory() as path:
+        path += '/'
+        output, label_names = extract_formatted_data_test(publications, RESCAN_OUTPUT_DATA_SETS, pub_dates)
+        write_table(path + 'full.tbl', FIELDNAMES, output, names={'label_sequence': label_names})
+        stub_model_output(path + 'full.tbl', path + 'full_output.tbl')
+        output, label_names = extract_formatted_data_test(publications, RESCAN_OUTPUT_DATA_SETS[:1], pub_dates)
+        write_table(path + 'rescanned.tbl', FIELDNAMES, output, names={'label_sequence': label_names})
+        stub_model_output(path + 'rescanned.tbl', path + 'rescanned_output.tbl')
+        scan_automaton, mention_automaton = rescan_automata(RESCAN_OUTPUT_DATA_SETS, {RESCAN_OUTPUT_DATA_SETS[0][1]})
+        patched_publications = [publication for publication in publications
+                                if scan_automaton.occurs(publication[1][1], pub_dates[publication[0]])]
+        output, label_names = extract_formatted_data_test(patched_publications, RESCAN_OUTPUT_DATA_SETS, pub_dates,
+                                                          mention_automaton=mention_automaton)
+        patch_table(path + 'rescanned.tbl', output, label_names)
+        write_table(path + 'patched.tbl', FIELDNAMES, output, names={'label_sequence': label_names})
+        stub_model_output(path + 'patched.tbl', path + 'patched_output.tbl')
+        patch_model_output(path + 'rescanned_output.tbl', path + 'patched_output.tbl',
+                           set(publication_id for publication_id, _ in patched_publications))
+        full = table_predictions(path + 'full.tbl', path + 'full_output.tbl')
+        rescanned = table_predictions(path + 'rescanned.tbl', path + 'rescanned_output.tbl')
+    logging.info("rescan_outputs: {} predictions of a full run, {} of the rescan, {}".format(
+        len(full), len(rescanned), 'the same' if rescanned == full else 'different'))
+    if rescanned != full:
+        logging.info("full run: {}, rescan: {}".format(full, rescanned))
+    return int(rescanned != full)
+
+
+# hand-picked strings for the rules that rarely show up in real publications
+EDGE_CASES = [
+    '',
+    ' ',
+    '12.5% of 30%% and %x a%b%c',
+    'a \\"quoted\\" word, "quoted" - dash-\n split- word a- - b x-- y',
+    'soft\xadhyphen \u00e9t\u00e9 \u2013 \u201cquotes\u201d\tand\nnew\x1clines\u3000',
+    '(1990 to 2000) (1990 to 20001) (12 to 34) (a to b) ((1 to 2) (1 (2 to 3) 4)',
+    '(1.2 in 3.4) (1 (1.2 in 3.4) 2) (1990) (1990 a) (1990 1) (1, 2.5 + 3) ()',
+    'x 1.2 3.4 y 1999 2,000 3.5, 10.25 (3) 1.5(3) 12 1 22',
+    'Mr. Smith met Dr. Jones at Acme Inc. He said U.S. data and A.B.C.D. This was it. Ph.D. work on x.com.',
+    'a.b.c.d.e. f.g. 1.2.3.4 Co. Co. He Jr. It a. b. c. Ph.D.com Mrs.. e.g. i.e. well? yes! ok.',
+    "Really! ) '' he said ''so'' x '' y. ''a'' b ``c'' it's ( '' ) ''",
+    'data of the National Survey of Youth and the National Survey',
+]
+
+
+def load_publications(publication_txt_path_prefix, publications_json_path, limit):
+    with open(publications_json_path) as json_publication_file:
+        publication_list = json.load(json_publication_file)
+    if limit > 0:
+        publication_list = publication_list[:limit]
+    publications = []
+    for publication_info in publication_list:
+        with open(publication_txt_path_prefix + publication_info.get("text_file_name", None)) as txt_file:
+            text = ''.join(' ' + line.strip() + ('<stop>' if len(line.split()) <= 5 else '') for line in txt_file)
+        publications.append((publication_info, text))
+    return publications
+
+
+def load_texts(publication_txt_path_prefix, publications_json_path, limit):
+    return [text for _, text in load_publications(publication_txt_path_prefix, publications_json_path, limit)]
+
+
+def best_time(function, texts, repeat, reset=None):
+    best = None
+    for _ in range(repeat):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def compare(name, fast, reference, texts, repeat, reset=None):
+    """
+    :return: the number of texts fast and reference disagree on, the target fails unless it is 0
+    """
+    logging.info("Checking {} output against the reference on {} texts...".format(name, len(texts)))
+    num_outputs = 0
+    num_disagreements = 0
+    for text in texts:
+        output = reference(text)
+        num_outputs += len(output)
+        if fast(text) != output:
+            num_disagreements += 1
+            if num_disagreements <= 5:
+                logging.info("{} differs from the reference on: {!r}".format(name, text[:200]))
+    logging.info("{}: agreement {}/{} ({:.4f})".format(
+        name, len(texts) - num_disagreements, len(texts), 1 - num_disagreements / max(len(texts), 1)))
+    num_chars = sum(len(text) for text in texts)
+    reference_time = best_time(reference, texts, repeat)
+    fast_time = best_time(fast, texts, repeat, reset)
+    logging.info("{}: reference {:.3f}s ({:.1f} MB/s, {:.0f} outputs/s), fast {:.3f}s ({:.1f} MB/s, {:.0f} outputs/s), "
+                 "speedup x{:.2f}".format(
+        name, reference_time, num_chars / reference_time / 1e6, num_outputs / reference_time,
+        fast_time, num_chars / fast_time / 1e6, num_outputs / fast_time, reference_time / fast_time))
+    return num_disagreements
+
+
+def evaluate_fuzzy(publications, data_sets_json_path, dictionary_path, data_set_citations_json_path, threshold):
+    """
+    How many of the sentences exact tagging leaves to the labeling model the fuzzy matches label instead,
+    how many of those matches are data sets the publication cites, and what they cost.
+    """
+    data_set_mention_info = read_data_sets(data_sets_json_path, dictionary_path)
+    with open(data_set_citations_json_path) as json_data_set_citations:
+        cited = collections.defaultdict(set)
+        for citation_info in json.load(json_data_set_citations):
+            cited[citation_info.get("publication_id", None)].add('B-' + str(citation_info.get("data_set_id", None)))
+    mention_automaton = MentionAutomaton(data_set_mention_info)
+    start = time.perf_counter()
+    fuzzy_index = FuzzyMentionIndex(data_set_mention_info, threshold)
+    logging.info("fuzzy index of {} mention strings built in {:.3f}s".format(len(fuzzy_index.string_features), time.perf_counter() - start))
+    num_sentences = num_exact = num_fuzzy = num_matches = num_cited = 0
+    exact_time = fuzzy_time = 0
+    for publication_info, text in publications:
+        pub_date = encode_pub_date(publication_info.get("pub_date", None) or '2019-01-01')
+        sentences = [words for words in (word_tokenize(sentence) for sentence in normalized_sentences(text)) if words]
+        start = time.perf_counter()
+        label_codes = mention_automaton.label_codes(' '.join(' '.join(words) for words in sentences), pub_date)
+        exact_time += time.perf_counter() - start
+        startidx = 0
+        for sentence in sentences:
+            sub_label_codes = label_codes[startidx:startidx + len(sentence)]
+            startidx += len(sentence)
+            num_sentences += 1
+            if (sub_label_codes > 1).any():
+                num_exact += 1
+                continue
+            start = time.perf_counter()
+            spans = fuzzy_index.find_spans(sentence, pub_date)
+            fuzzy_time += time.perf_counter() - start
+            if spans:
+                num_fuzzy += 1
+                num_matches += len(spans)
+                num_cited += sum(mention_automaton.label_names[begin_code] in cited[publication_info.get("publication_id", None)]
+                                 for _, _, begin_code in spans)
+    num_left = num_sentences - num_exact
+    logging.info("{} sentences, {} with exact mentions, {} of the other {} labeled by {} fuzzy matches ({:.2%}), "
+                 "{} of the matches on cited data sets ({:.2%})".format(
+        num_sentences, num_exact, num_fuzzy, num_left, num_matches, num_fuzzy / max(num_left, 1),
+        num_cited, num_cited / max(num_matches, 1)))
+    logging.info("exact tagging {:.3f}s, fuzzy matching {:.3f}s ({:.0f} sentences/s)".format(
+        exact_time, fuzzy_time, num_left / fuzzy_time if fuzzy_time else 0))
+
+
+def compare_elmo(texts, options_path, weights_path, batch_size, cuda_device, repeat):
+    """
+    Sentences per second of ELMo embedding the sentences of the texts one at a time, as embed_indexed_sequence() did,
+    and in batches of similar lengths (iter_elmo_vectors()), and how close their vectors are: ELMo is stateful,
+    they are not the same.
+    """
+    # torch and allennlp only for this target
+    from allennlp.commands.elmo import ElmoEmbedder
+    from util import iter_elmo_vectors
+    sentences = [words for text in texts for words in (word_tokenize(sentence) for sentence in normalized_sentences(text)) if words]
+    num_tokens = sum(len(words) for words in sentences)
+    logging.info("{} sentences, {} tokens".format(len(sentences), num_tokens))
+    elmo = ElmoEmbedder(options_path, weights_path, cuda_device)
+    per_sentence = [elmo.embed_sentence(words)[2] for words in sentences]
+    batched = list(iter_elmo_vectors(sentences, elmo, batch_size))
+    assert all(a.shape == b.shape for a, b in zip(per_sentence, batched))
+    similarities = np.concatenate([np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+                                   for a, b in zip(per_sentence, batched)]) if sentences else np.ones(1)
+    logging.info("cosine similarity of the vectors of the two paths: mean {:.6f}, lowest {:.6f}".format(
+        float(np.mean(similarities)), float(np.min(similarities))))
+    reference_time = best_time(elmo.embed_sentence, sentences, repeat)
+    batched_time = best_time(lambda sentences: list(iter_elmo_vectors(sentences, elmo, batch_size)), [sentences], repeat)
+    logging.info("elmo: one at a time {:.3f}s ({:.1f} sentences/s, {:.0f} tokens/s), batches of {} {:.3f}s "
+                 "({:.1f} sentences/s, {:.0f} tokens/s), speedup x{:.2f}".format(
+        reference_time, len(sentences) / reference_time, num_tokens / reference_time, batch_size,
+        batched_time, len(sentences) / batched_time, num_tokens / batched_time, reference_time / batched_time))
+
+
+# modules the text preprocessing stages import, and util, which pulls in torch, for reference
+IMPORT_MODULES = ['text_util', 'tokenizer', 'corpus_store', 'preprocess_cache', 'test_parser', 'parser', 'incremental', 'util']
+
+
+def import_time(module, repeat):
+    # a fresh interpreter per run, so nothing is imported already; the bare interpreter start is subtracted
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import ' + module], check=True)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def compare_import_times(repeat):
+    baseline = import_time('sys', repeat)
+    logging.info("python startup: {:.0f} ms".format(baseline * 1000))
+    for module in IMPORT_MODULES:
+        try:
+            logging.info("import {}: {:.0f} ms".format(module, (import_time(module, repeat) - baseline) * 1000))
+        except subprocess.CalledProcessError:
+            logging.info("import {}: failed".format(module))
+
+
+# target: (fast, reference, preprocessing turning every text into the compared inputs, cache reset before every fast run)
+# outputs/s counts characters for normalize, sentences for split and tokens for tokenize, mentions and rescan
+TARGETS = {
+    'normalize': (normalize_string, reference_normalize_string, None, None),
+    'split': (split_by_spans, split_into_sentences, normalized, None),
+    'tokenize': (word_tokenize, nltk.word_tokenize, normalized_sentences, clear_cache),
+}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    if args.target == 'imports':
+        compare_import_times(args.repeat)
+        sys.exit(0)
+    if args.target == 'fuzzy':
+        evaluate_fuzzy(load_publications(args.publication_txt_path_prefix, args.publications_json_path, args.limit),
+                       args.data_sets_json_path, args.mention_dictionary, args.data_set_citations_json_path, args.fuzzy_threshold)
+        sys.exit(0)
+    if args.target == 'rescan_outputs':
+        sys.exit(compare_rescan_outputs())
+    if args.target == 'elmo':
+        compare_elmo(load_texts(args.publication_txt_path_prefix, args.publications_json_path, args.limit),
+                     args.elmo_options_path, args.elmo_weights_path, args.elmo_batch_size, args.cuda_device, args.repeat)
+        sys.exit(0)
+    texts = EDGE_CASES + load_texts(args.publication_txt_path_prefix, args.publications_json_path, args.limit)
+    if args.target == 'mentions':
+        fast, reference, prepare, reset = mention_target(args.data_sets_json_path, args.mention_dictionary, args.pub_date)
+    elif args.target == 'rescan':
+        fast, reference, prepare, reset = rescan_target(args.data_sets_json_path, args.mention_dictionary, args.pub_date)
+    else:
+        fast, reference, prepare, reset = TARGETS[args.target]
+    if prepare is not None:
+        texts = [item for text in texts for item in prepare(text)]
+    if compare(args.target, fast, reference, texts, args.repeat, reset):
+        logging.error("{} disagrees with the reference".format(args.target))
+        sys.exit(1)
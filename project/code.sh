@@ -9,7 +9,10 @@ echo "LANG=en_US.UTF-8" > /etc/locale.conf
 locale-gen en_US.UTF-8
 export LC_ALL=en_US.UTF-8
 export LANG=en_US.UTF-8
-python3 ./test_parser.py
+# daily updates: python3 ./incremental.py --workers $(nproc) runs the steps below for new or changed publications only
+python3 ./mention_dictionary.py # compiles data_sets.json once
+python3 ./metadata_index.py # indexes the publication and data set dates once
+python3 ./test_parser.py --workers $(nproc)
 python3 ./make_abstract.py
 python3 ./field_method.py
 python3 ./inference.py # the classfier models are not trained enough.  
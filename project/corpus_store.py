@@ -0,0 +1,102 @@
+import argparse
+import array
+import functools
+import logging
+import mmap
+import os
+
+from json_stream import iter_json_array
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='pack the publication text files into one memory-mapped corpus store')
+    parser.add_argument('--publication_txt_path_prefix', type=str, default='../data/input/files/text/',
+                        help='publication text files path')
+    parser.add_argument('--publications_json_path', type=str, default='../data/input/publications.json',
+                        help='publications.json path')
+    parser.add_argument('--store_path', type=str, default='./formatted-data/corpus',
+                        help='corpus store path, <store_path>.blob and <store_path>.index are written')
+    args = parser.parse_args()
+    return args
+
+
+def write_store(store_path, documents):
+    """
+    Pack documents into <store_path>.blob, their contents back to back,
+    and <store_path>.index, int64 (publication_id, offset, length) triples.
+    :param documents: iterable of (publication_id, bytes)
+    """
+    index = array.array('q')
+    offset = 0
+    with open(store_path + '.blob.tmp', 'wb') as blob_file:
+        for publication_id, data in documents:
+            blob_file.write(data)
+            index.extend((publication_id, offset, len(data)))
+            offset += len(data)
+    with open(store_path + '.index.tmp', 'wb') as index_file:
+        index.tofile(index_file)
+    # the index goes last, a reader never sees an index pointing past the blob
+    os.replace(store_path + '.blob.tmp', store_path + '.blob')
+    os.replace(store_path + '.index.tmp', store_path + '.index')
+    return len(index) // 3
+
+
+def pack_publications(publication_list, publication_txt_path_prefix, store_path):
+    # tqdm is only needed by the packer, the readers of the store are imported by the text stages
+    from tqdm import tqdm
+
+    def documents():
+        for publication_info in tqdm(publication_list, unit='publications'):
+            publication_id = publication_info.get( "publication_id", None )
+            with open(publication_txt_path_prefix + publication_info.get( "text_file_name", None ), 'rb') as txt_file:
+                yield publication_id, txt_file.read()
+    return write_store(store_path, documents())
+
+
+class CorpusStore(object):
+    """
+    Read-only view of a packed corpus store.
+    The blob is memory-mapped, get_bytes() returns memoryview slices of it without copying.
+    """
+    def __init__(self, store_path):
+        index = array.array('q')
+        with open(store_path + '.index', 'rb') as index_file:
+            index.frombytes(index_file.read())
+        self.offsets = {index[i]: (index[i + 1], index[i + 2]) for i in range(0, len(index), 3)}
+        with open(store_path + '.blob', 'rb') as blob_file:
+            if os.fstat(blob_file.fileno()).st_size == 0:
+                self.blob = b''    # an empty file can not be mapped
+            else:
+                self.blob = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.blob)
+
+    def __contains__(self, publication_id):
+        return publication_id in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get_bytes(self, publication_id):
+        offset, length = self.offsets[publication_id]
+        return self.view[offset:offset + length]
+
+    def get_text(self, publication_id):
+        return str(self.get_bytes(publication_id), 'utf-8')
+
+
+@functools.lru_cache(maxsize=None)
+def open_store(store_path):
+    """
+    The CorpusStore of store_path, mapped once per process (and so once per pool worker).
+    """
+    return CorpusStore(store_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    logging.info("Packing the publication text files into {}...".format(args.store_path))
+    num_documents = pack_publications(iter_json_array(args.publications_json_path), args.publication_txt_path_prefix, args.store_path)
+    logging.info("Packed {} documents".format(num_documents))
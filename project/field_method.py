@@ -1,4 +1,5 @@
 import pke
+import argparse
 import json 
 from tqdm import tqdm
 from allennlp.commands.elmo import ElmoEmbedder
@@ -6,8 +7,16 @@ import scipy
 import nltk
 import logging
 import torch
+from corpus_store import open_store
+from json_output import OUTPUT_FORMATS
+from json_stream import iter_json_array
+from results_store import FIELD_METHOD_TABLES, ResultsStore
+from util import ELMO_BATCH_SIZE, iter_elmo_vectors
 
-nltk.download('stopwords')
+try:
+	nltk.data.find('corpora/stopwords')
+except LookupError:
+	nltk.download('stopwords')
 
 PUB_PATH = '../data/input/'
 JSON_PATH = './formatted-data/'
@@ -16,10 +25,34 @@ ELMO_PATH = './elmo/'
 JSON_WRITE_PATH = '../data/output/'
 
 
-def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
-	with open(PUB_PATH + 'publications.json') as json_publication_file, open(JSON_PATH + 'sage_research_fields.json') as json_field_file, open(JSON_PATH + 'sage_research_methods.json') as json_method_file, open(JSON_WRITE_PATH + 'research_fields.json', 'w') as field_outfile, open(JSON_WRITE_PATH + 'methods.json', 'w') as method_outfile:
+def get_args():
+	parser = argparse.ArgumentParser(description='extract the research fields and methods of the publications')
+	parser.add_argument('--publications_json_path', type=str, default=PUB_PATH + 'publications.json',
+						help='publications.json path')
+	parser.add_argument('--output_path', type=str, default=JSON_WRITE_PATH,
+						help='directory research_fields.json and methods.json are written to')
+	parser.add_argument('--abstract_store', type=str, default='',
+						help='corpus store make_abstract.py packed the abstracts into, instead of the abstract files')
+	parser.add_argument('--output_format', type=str, default='json', choices=OUTPUT_FORMATS,
+						help='json writes JSON arrays, jsonl JSON Lines files with a .jsonl extension (default: json)')
+	parser.add_argument('--compact', action='store_true',
+						help='write the outputs without indentation')
+	parser.add_argument('--results_store', type=str, default=JSON_PATH + 'results.sqlite',
+						help='results store the fields and methods are put in and the outputs exported from')
+	parser.add_argument('--update', action='store_true',
+						help='keep the results of the publications not in publications.json in the store')
+	args = parser.parse_args()
+	return args
+
+
+def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH, publications_json_path=PUB_PATH + 'publications.json', json_write_path=JSON_WRITE_PATH, abstract_store='', output_format='json', compact=False, results_store=JSON_PATH + 'results.sqlite', update=False):
+	# every publication's field and method are stored as soon as they are found, the outputs exported from the store
+	with open(JSON_PATH + 'sage_research_fields.json') as json_field_file, open(JSON_PATH + 'sage_research_methods.json') as json_method_file, ResultsStore(results_store) as store:
 		
-		publication_list = json.load(json_publication_file)
+		if not update:
+			store.clear(FIELD_METHOD_TABLES)
+		# publications.json is read as the publications are processed
+		publication_list = iter_json_array(publications_json_path)
 		field_list = json.load(json_field_file)
 		method_list = json.load(json_method_file)
 		using_GPU = torch.cuda.is_available()
@@ -28,11 +61,8 @@ def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
 		else:
 			elmo = ElmoEmbedder(ELMO_PATH + 'options.json', ELMO_PATH + 'weights.hdf5', -1)
 		
-		field_json_list = []
-		method_json_list = []
-
 		logging.info("Extract research_fields and methods...")
-		for publication_info in tqdm(publication_list, total=len(publication_list)):
+		for publication_info in tqdm(publication_list, unit='publications'):
 			field_result = dict()
 			method_result = dict()
 			publication_id = publication_info.get("publication_id", None)
@@ -41,7 +71,11 @@ def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
 			#print("LOAD : %s\n" % text_file_name)
 			extractor = pke.unsupervised.TopicRank()
 
-			extractor.load_document(input= ABSTRACT_DATA_PATH + text_file_name, language='en')
+			if abstract_store:
+				# pke takes a string that is not a file path as the document text itself
+				extractor.load_document(input=open_store(abstract_store).get_text(publication_id), language='en')
+			else:
+				extractor.load_document(input= ABSTRACT_DATA_PATH + text_file_name, language='en')
 
 			extractor.candidate_selection()
 
@@ -49,19 +83,13 @@ def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
 
 			keyphrases = extractor.get_n_best(n=20)
 			
-			embed_key = []
-			for key in keyphrases:
-				#print(key)
-				tokens = key[0].split(' ')
-				vectors = elmo.embed_sentence(tokens)
-				embed_key.append(vectors[2])
+			# the ELMo vectors are embedded in batches
+			embed_key = list(iter_elmo_vectors((key[0].split(' ') for key in keyphrases), elmo))
 
 				
 			field_info_min = 1000
 			field_info_index = ''
-			for field_info in field_list:
-				tokens = field_info.split(' ')
-				vectors = elmo.embed_sentence(tokens)[2]
+			for field_info, vectors in zip(field_list, iter_elmo_vectors((field_info.split(' ') for field_info in field_list), elmo)):
 				for key in embed_key:
 					for token_key in key:
 						for word in vectors:
@@ -74,9 +102,8 @@ def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
 
 			detail_info_min = 1000
 			detail_info_index = ''
-			for detail_info in field_list[field_info_index]:
-				tokens = detail_info.split(' ')
-				vectors = elmo.embed_sentence(tokens)[2]
+			detail_list = field_list[field_info_index]
+			for detail_info, vectors in zip(detail_list, iter_elmo_vectors((detail_info.split(' ') for detail_info in detail_list), elmo)):
 				for key in embed_key:
 					for token_key in key:
 						for word in vectors:
@@ -90,9 +117,8 @@ def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
 
 			ddetail_info_min = 1000
 			ddetail_info_index = ''
-			for ddetail_info in field_list[field_info_index][detail_info_index]:
-				tokens = ddetail_info['fieldAltLabel'].split(' ')
-				vectors = elmo.embed_sentence(tokens)[2]
+			ddetail_list = field_list[field_info_index][detail_info_index]
+			for ddetail_info, vectors in zip(ddetail_list, iter_elmo_vectors((ddetail_info['fieldAltLabel'].split(' ') for ddetail_info in ddetail_list), elmo)):
 				for key in embed_key:
 					for token_key in key:
 						for word in vectors:
@@ -105,8 +131,7 @@ def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
 			field_result["publication_id"] = publication_id
 			field_result["research_field"] = ddetail_info_index
 			field_result["score"] = round(1 - (field_info_min + detail_info_min + ddetail_info_min)/3, 3)
-			field_json_list.append(field_result)
-			#print(field_json_list)
+			store.set_field(field_result["publication_id"], field_result["research_field"], field_result["score"])
 			#print(field_result)	
 			#print("FIELDS : %s\n" % ddetail_info_index)	
 
@@ -114,37 +139,30 @@ def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
 
 			keyphrases = extractor.get_n_best(n=5)
 			
-			embed_key = []
-			for key in keyphrases:
-				#print(key)
-				tokens = key[0].split(' ')
-				vectors = elmo.embed_sentence(tokens)
-				embed_key.append(vectors[2])
+			# the ELMo vectors are embedded in batches
+			embed_key = list(iter_elmo_vectors((key[0].split(' ') for key in keyphrases), elmo))
 
 
 
 			method_info_min = 1000
 			method_info_index = ''
 			count = 0
-			for method_info in method_list['@graph']:
-				if method_info['@id'] == "_:N872c4d9408ca446eb0e1391e1bfbddcb":
-					continue
+			method_infos = [method_info for method_info in method_list['@graph'] if method_info['@id'] != "_:N872c4d9408ca446eb0e1391e1bfbddcb"]
+			# the loop stops early, the labels are embedded a batch at a time only as far as it goes
+			method_vectors = iter_elmo_vectors((method_info['skos:prefLabel']['@value'].split(' ') for method_info in method_infos), elmo, bucket_size=ELMO_BATCH_SIZE)
+			for method_info, vectors in zip(method_infos, method_vectors):
+				if count == 150:
+					#print("COUNT_CUT!!\n")
+					count = 0
+					break;
 				else:
-					if count == 150:
-						#print("COUNT_CUT!!\n")
-						count = 0
-						break;
-					else:
-						tokens = method_info['skos:prefLabel']['@value'].split(' ')
-						#print(tokens)
-						vectors = elmo.embed_sentence(tokens)[2]
-						for key in embed_key:
-							for token_key in key:
-								for word in vectors:
-									temp = scipy.spatial.distance.cosine(word, token_key)
-									if method_info_min > temp:
-										method_info_min = temp
-										method_info_index = method_info['skos:prefLabel']['@value']
+					for key in embed_key:
+						for token_key in key:
+							for word in vectors:
+								temp = scipy.spatial.distance.cosine(word, token_key)
+								if method_info_min > temp:
+									method_info_min = temp
+									method_info_index = method_info['skos:prefLabel']['@value']
 				
 				if method_info_index != method_info['skos:prefLabel']['@value']:
 					count += 1
@@ -153,16 +171,19 @@ def find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH):
 			method_result["publication_id"] = publication_id
 			method_result["method"] = method_info_index
 			method_result["score"] = round(1- method_info_min, 3)
-			method_json_list.append(method_result)
+			store.set_method(method_result["publication_id"], method_result["method"], method_result["score"])
 			#print(method_result)
 			#print("METHODS : %s\n" % method_info_index)
-		json.dump(field_json_list, field_outfile, indent =4)
-		json.dump(method_json_list, method_outfile, indent =4)
+
+		store.export('fields', json_write_path + 'research_fields.json', output_format, compact)
+		store.export('methods', json_write_path + 'methods.json', output_format, compact)
 
 
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(message)s', datefmt='%m-%d %H:%M')
-find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH)
+args = get_args()
+find_field(JSON_PATH, ABSTRACT_DATA_PATH, ELMO_PATH, args.publications_json_path, args.output_path, args.abstract_store,
+		   args.output_format, args.compact, args.results_store, args.update)
 
 
 
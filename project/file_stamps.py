@@ -0,0 +1,11 @@
+import json
+import os
+
+
+def source_stamps(source_paths):
+    # size and modification time, a changed source file is detected without hashing gigabytes of it
+    stamps = []
+    for path in source_paths:
+        stat = os.stat(path)
+        stamps.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    return json.dumps(stamps)
@@ -32,9 +32,9 @@ def get_args():
     parser.add_argument('--rnn_model_path', type=str, default='./checkpoint/rcc_labeler.pkl',
                         help='file path for torch model states (default: ./checkpoint/rcc_labeler.pkl)')
     parser.add_argument('--cnn_model_path', type=str, default='./checkpoint/rcc_classifier_cnn.pkl')
-    parser.add_argument('--test_preprocessed', type=str, default='./formatted-data/rcc_corpus_test.csv',
+    parser.add_argument('--test_preprocessed', type=str, default='./formatted-data/rcc_corpus_test.tbl',
                         help='processed test data path')
-    parser.add_argument('--not_found_test_path', type=str, default='./formatted-data/rcc_test.csv',
+    parser.add_argument('--not_found_test_path', type=str, default='./formatted-data/rcc_test.tbl',
                         help='processed test data path, extracted only the unlabeled lines')
     parser.add_argument('--tag_file_path', type=str, default='./formatted-data/datsetIds', 
     										help='tagfile path (default: ./formatted-data/datsetIds)')
@@ -44,7 +44,7 @@ def get_args():
                         help='number of each kind of kernel (default: 100)')
     parser.add_argument('--batch_size', type=int, default=128,
                         help='batch size (default: 128)')
-    parser.add_argument('--unordered_output_path', type=str, default='./formatted-data/model_output_mentions.csv')
+    parser.add_argument('--unordered_output_path', type=str, default='./formatted-data/model_output_mentions.tbl')
     parser.add_argument('--vocab_info_path', type=str, default='./formatted-data/vocabInfo.data', 
                         help='load word2idx, idx2word from dump')
     parser.add_argument('--data_sets_json_path', type=str, default='./formatted-data/data_sets.json')
@@ -0,0 +1,196 @@
+import argparse
+import array
+import json
+import logging
+import mmap
+import os
+import zlib
+
+import numpy as np
+from tqdm import tqdm
+
+from file_stamps import source_stamps
+
+
+# bump whenever the file layout or the conversion change, it invalidates the converted stores
+STORE_VERSION = 1
+MAGIC = b'RCCGLOVE'
+EMBEDDING_DIM = 300
+# MAGIC, the int64 header length and the json header, padded; the header is written last, once the counts are known
+HEADER_SPACE = 4096
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='convert the GloVe text file into the memory-mapped store get_embedding_matrix() reads')
+    parser.add_argument('--glove_path', type=str, default='./glove/glove840B300d.txt',
+                        help='glove path (default: ./glove/glove840B300d.txt)')
+    parser.add_argument('--glove_store', type=str, default='./glove/glove840B300d.bin',
+                        help='converted glove store path (default: ./glove/glove840B300d.bin)')
+    args = parser.parse_args()
+    return args
+
+
+def word_hash(word_bytes):
+    # stable across runs, unlike hash()
+    return zlib.crc32(word_bytes)
+
+
+def write_store(glove_path, store_path, embedding_dim=EMBEDDING_DIM):
+    """
+    Layout: the header space (MAGIC, the int64 header length and the json header: versions, counts, source stamps),
+    the float32 vectors, a row a word, then the word index: int32 rows of an open addressing hash table
+    of the words (crc32, linear probing, -1 for empty slots), the int64 offsets of the words and the words, utf-8.
+    The words and their vectors are the ones get_embedding_matrix() took from the text file: lines of an other
+    number of fields are skipped, a word repeated keeps the row of its first line and the vector of its last.
+    """
+    row_ids = dict()
+    with open(store_path + '.tmp', 'wb') as store_file:
+        store_file.write(b'\0' * HEADER_SPACE)
+        with open(glove_path) as glove_file:
+            for line in tqdm(glove_file, unit=' lines'):
+                split_line = line.rstrip().split()
+                if len(split_line) != (embedding_dim + 1):
+                    continue
+                word = split_line[0]
+                vector = np.array(split_line[1:], dtype=np.float64).astype(np.float32)
+                row = row_ids.get(word, None)
+                if row is None:
+                    row_ids[word] = len(row_ids)
+                    store_file.write(vector.tobytes())
+                else:
+                    store_file.seek(HEADER_SPACE + row * embedding_dim * 4)
+                    store_file.write(vector.tobytes())
+                    store_file.seek(0, os.SEEK_END)
+        store_file.write(b'\0' * (-store_file.tell() % 8))
+        num_slots = 1
+        while num_slots < 2 * len(row_ids):
+            num_slots *= 2
+        slots = array.array('i', [-1]) * num_slots
+        word_offsets = array.array('q', [0])
+        blob = bytearray()
+        for word, row in row_ids.items():
+            word_bytes = word.encode('utf-8')
+            slot = word_hash(word_bytes) & (num_slots - 1)
+            while slots[slot] != -1:
+                slot = (slot + 1) & (num_slots - 1)
+            slots[slot] = row
+            blob += word_bytes
+            word_offsets.append(len(blob))
+        slots.tofile(store_file)
+        store_file.write(b'\0' * (-len(slots) * slots.itemsize % 8))
+        word_offsets.tofile(store_file)
+        store_file.write(blob)
+        header = json.dumps({
+            'store_version': STORE_VERSION,
+            'embedding_dim': embedding_dim,
+            'num_words': len(row_ids),
+            'num_slots': num_slots,
+            'sources': source_stamps([glove_path]),
+        }).encode('utf-8')
+        if 16 + len(header) > HEADER_SPACE:
+            raise ValueError("the header of {} does not fit in {} bytes".format(store_path, HEADER_SPACE))
+        store_file.seek(0)
+        store_file.write(MAGIC)
+        array.array('q', [len(header)]).tofile(store_file)
+        store_file.write(header)
+    # write then rename, a stage loading the store never sees a partial one
+    os.replace(store_path + '.tmp', store_path)
+
+
+class GloveStore(object):
+    """
+    Read-only view of a converted GloVe store, memory-mapped: opening it reads the header only,
+    the vectors of the words looked up are the only ones read from the disk.
+    """
+    def __init__(self, store_path):
+        with open(store_path, 'rb') as store_file:
+            self.data = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a glove store".format(store_path))
+        view = memoryview(self.data)
+        header_length = view[8:16].cast('q')[0]
+        self.header = json.loads(str(view[16:16 + header_length], 'utf-8'))
+        if self.header.get('store_version', None) != STORE_VERSION:
+            raise ValueError("{} is a glove store of another version, convert it again".format(store_path))
+        self.embedding_dim = self.header['embedding_dim']
+        self.num_words = self.header['num_words']
+        self.num_slots = self.header['num_slots']
+        start = HEADER_SPACE
+        self.vectors = np.frombuffer(self.data, dtype=np.float32, count=self.num_words * self.embedding_dim,
+                                     offset=start).reshape(self.num_words, self.embedding_dim)
+        start += self.vectors.nbytes
+        start += -start % 8
+        self.slots = view[start:start + 4 * self.num_slots].cast('i')
+        start += 4 * self.num_slots
+        start += -start % 8
+        self.word_offsets = view[start:start + 8 * (self.num_words + 1)].cast('q')
+        self.blob = view[start + 8 * (self.num_words + 1):]
+
+    def is_current(self, glove_path):
+        return self.header.get('sources', None) == source_stamps([glove_path])
+
+    def __len__(self):
+        return self.num_words
+
+    def row(self, word):
+        """
+        :return: the row of the vector of word, -1 if it has none
+        """
+        word_bytes = word.encode('utf-8')
+        slots, word_offsets, blob = self.slots, self.word_offsets, self.blob
+        mask = self.num_slots - 1
+        slot = word_hash(word_bytes) & mask
+        while True:
+            row = slots[slot]
+            if row == -1 or blob[word_offsets[row]:word_offsets[row + 1]] == word_bytes:
+                return row
+            slot = (slot + 1) & mask
+
+    def rows(self, words):
+        """
+        :return: int64 array of the rows of the words, -1 for the ones without a vector
+        """
+        return np.array([self.row(word) for word in words], dtype=np.int64)
+
+    def __contains__(self, word):
+        return self.row(word) != -1
+
+    def __getitem__(self, word):
+        row = self.row(word)
+        if row == -1:
+            raise KeyError(word)
+        return self.vectors[row]
+
+
+def convert_glove(glove_path, store_path):
+    logging.info("Converting {} into {}...".format(glove_path, store_path))
+    write_store(glove_path, store_path)
+    return GloveStore(store_path)
+
+
+def open_glove_store(glove_path, store_path):
+    """
+    The store of glove_path, converted first if it is missing or was converted from another or a changed text file.
+    A valid store is used as it is once the text file is deleted.
+    """
+    if os.path.exists(store_path):
+        try:
+            glove_store = GloveStore(store_path)
+        except ValueError:
+            glove_store = None
+        if glove_store is not None:
+            if not os.path.exists(glove_path):
+                logging.info("{} is missing, using the vectors converted into {}".format(glove_path, store_path))
+                return glove_store
+            if glove_store.is_current(glove_path):
+                return glove_store
+    return convert_glove(glove_path, store_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    glove_store = convert_glove(args.glove_path, args.glove_store)
+    logging.info("Converted {} word vectors".format(len(glove_store)))
@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from json_output import JsonWriter
+from json_stream import iter_json_array
+from results_store import CITATION_TABLES, FIELD_METHOD_TABLES, OUTPUT_FILE_NAMES, STORE_VERSION, ResultsStore
+from tokenizer import TOKENIZER_VERSION
+from text_util import NORMALIZE_VERSION, read_publication_bytes
+
+
+DELTA_PATH = './formatted-data/delta/'
+DELTA_RESULTS_STORE = DELTA_PATH + 'results.sqlite'
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='run the pipeline only for new or changed publications and merge the results into the outputs')
+    parser.add_argument('--publication_txt_path_prefix', type=str, default='../data/input/files/text/',
+                        help='publication text files path')
+    parser.add_argument('--corpus_store', type=str, default='',
+                        help='packed corpus store (see corpus_store.py) to read the texts from, the ones added since it was packed from their text files')
+    parser.add_argument('--publications_json_path', type=str, default='../data/input/publications.json',
+                        help='publications.json path')
+    parser.add_argument('--output_path', type=str, default='../data/output/',
+                        help='directory of the four output json files')
+    parser.add_argument('--results_store', type=str, default='./formatted-data/results.sqlite',
+                        help='results store of the whole corpus, the results of the delta are merged into')
+    parser.add_argument('--manifest_path', type=str, default='./formatted-data/processed.json',
+                        help='record of the processed publications and the versions they were processed with')
+    parser.add_argument('--dictionary_paths', type=str,
+                        default='./formatted-data/data_sets.json,./formatted-data/sage_research_fields.json,./formatted-data/sage_research_methods.json',
+                        help='comma-separated data set / field / method dictionaries, a change reprocesses everything')
+    parser.add_argument('--model_paths', type=str,
+                        default='./checkpoint/rcc_labeler.pkl,./checkpoint/rcc_classifier_cnn.pkl,./formatted-data/datsetIds,./elmo/options.json,./elmo/weights.hdf5',
+                        help='comma-separated model files, a change reprocesses everything')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes tokenizing publications (default: 1)')
+    args = parser.parse_args()
+    return args
+
+
+def content_version(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(path.encode('utf-8'))
+        if not os.path.exists(path):
+            digest.update(b'missing')
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def stat_version(paths):
+    # model files are large and only ever replaced as a whole, their size and modification time identify them
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(path.encode('utf-8'))
+        if not os.path.exists(path):
+            digest.update(b'missing')
+            continue
+        stat = os.stat(path)
+        digest.update('{} {}'.format(stat.st_size, stat.st_mtime_ns).encode('ascii'))
+    return digest.hexdigest()
+
+
+def publication_fingerprint(publication_info, publication_txt_path_prefix, store_path=None):
+    # the text is read as the stages read it, from the corpus store if one is given
+    digest = hashlib.sha1(json.dumps(publication_info, sort_keys=True).encode('utf-8'))
+    digest.update(read_publication_bytes(publication_info.get( "publication_id", None ),
+                                         publication_txt_path_prefix + publication_info.get( "text_file_name", None ),
+                                         store_path))
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {'versions': {}, 'publications': {}}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_json(obj, path):
+    # write then rename, so an interrupted run leaves the previous file in place
+    with open(path + '.tmp', 'w') as outfile:
+        json.dump(obj, outfile, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def run_stages(args, delta_publications_json_path):
+    """
+    Run the code.sh stages on the delta publications, writing their intermediate files and outputs under DELTA_PATH.
+    """
+    delta_output_path = DELTA_PATH + 'output/'
+    os.makedirs(delta_output_path, exist_ok=True)
+    test_preprocessed = DELTA_PATH + 'rcc_corpus_test.tbl'
+    unordered_output_path = DELTA_PATH + 'model_output_mentions.tbl'
+    # indexed from and stored for the delta publications, the store is merged into the one of the whole corpus afterwards
+    metadata_index_path = DELTA_PATH + 'metadata.sqlite'
+    stages = [
+        ['test_parser.py', '--publication_txt_path_prefix', args.publication_txt_path_prefix,
+         '--publications_json_path', delta_publications_json_path,
+         '--output_filename', 'delta/rcc_corpus_test.tbl', '--workers', str(args.workers),  # under ./formatted-data/
+         '--metadata_index', metadata_index_path, '--corpus_store', args.corpus_store],
+        ['make_abstract.py', '--test_preprocessed', test_preprocessed],
+        ['field_method.py', '--publications_json_path', delta_publications_json_path, '--output_path', delta_output_path,
+         '--results_store', DELTA_RESULTS_STORE],
+        ['inference.py', '--pub_info_path', delta_publications_json_path, '--metadata_index', metadata_index_path,
+         '--test_preprocessed', test_preprocessed,
+         '--not_found_test_path', DELTA_PATH + 'rcc_test.tbl', '--unordered_output_path', unordered_output_path],
+        ['make_citation_output.py', '--test_preprocessed', test_preprocessed, '--unordered_output_path', unordered_output_path,
+         '--dataset_citations_path', delta_output_path + 'data_set_citations.json',
+         '--data_set_mentions_path', delta_output_path + 'data_set_mentions.json', '--results_store', DELTA_RESULTS_STORE],
+    ]
+    for stage in stages:
+        logging.info("Running {} on the delta...".format(stage[0]))
+        subprocess.run([sys.executable, './' + stage[0]] + stage[1:], check=True)
+    return delta_output_path
+
+
+def merge_results_store(results_store_path, delta_results_store_path, replaced_ids, keep_existing=True):
+    """
+    Replace the results of the replaced publications in the store of the whole corpus with the ones of the delta store.
+    """
+    if not keep_existing and os.path.exists(results_store_path):
+        # possibly of another store version
+        os.remove(results_store_path)
+    with ResultsStore(results_store_path) as store:
+        if delta_results_store_path is None:
+            store.delete_publications(replaced_ids, CITATION_TABLES + FIELD_METHOD_TABLES)
+        else:
+            store.replace_publications(delta_results_store_path, replaced_ids)
+    logging.info("Merged the results into {}".format(results_store_path))
+
+
+def export_outputs(results_store_path, output_path):
+    """
+    Write the output files from the store of the whole corpus, the model scores normalized over all of it as a full run does.
+    """
+    with ResultsStore(results_store_path) as store:
+        for table, output_file_name in OUTPUT_FILE_NAMES.items():
+            store.export(table, output_path + output_file_name)
+
+
+def incremental_update(args):
+    manifest = load_manifest(args.manifest_path)
+    versions = {
+        'preprocess': 'normalize-{} tokenize-{}'.format(NORMALIZE_VERSION, TOKENIZER_VERSION),
+        'dictionary': content_version(args.dictionary_paths.split(',')),
+        'model': stat_version(args.model_paths.split(',')),
+        'results': STORE_VERSION,
+    }
+    # the outputs of a first run or of other versions can not be reused, nor the ones of a missing results store
+    reprocess_all = manifest['versions'] != versions or not os.path.exists(args.results_store)
+    if reprocess_all:
+        logging.info("No processed publications with the current model, dictionary, preprocessing and results store versions, reprocessing everything")
+    # publications.json is read a publication at a time, the delta written out as it is found
+    fingerprints = dict()
+    replaced_ids = set()
+    os.makedirs(DELTA_PATH, exist_ok=True)
+    delta_publications_json_path = DELTA_PATH + 'publications.json'
+    with JsonWriter(delta_publications_json_path) as delta_publications:
+        for publication_info in iter_json_array(args.publications_json_path):
+            publication_id = str(publication_info.get( "publication_id", None ))
+            fingerprints[publication_id] = publication_fingerprint(publication_info, args.publication_txt_path_prefix, args.corpus_store)
+            if reprocess_all or manifest['publications'].get(publication_id, None) != fingerprints[publication_id]:
+                delta_publications.write(publication_info)
+                replaced_ids.add(publication_info.get( "publication_id", None ))
+    # the records of removed publications are dropped too, the ones of unchanged publications are kept as they are
+    removed_ids = set(manifest['publications']) - set(fingerprints)
+    logging.info("{} publications, {} new or changed, {} removed".format(
+        len(fingerprints), delta_publications.num_records, len(removed_ids)))
+    replaced_ids.update(int(publication_id) for publication_id in removed_ids)
+    delta_output_path = None
+    if delta_publications.num_records:
+        delta_output_path = run_stages(args, delta_publications_json_path)
+    merge_results_store(args.results_store, DELTA_RESULTS_STORE if delta_output_path is not None else None,
+                        replaced_ids, keep_existing=not reprocess_all)
+    export_outputs(args.results_store, args.output_path)
+    # only recorded once the outputs are merged, a failed stage is retried by the next run
+    write_json({'versions': versions, 'publications': fingerprints}, args.manifest_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    incremental_update(args)
@@ -1,9 +1,13 @@
-from util import get_vocab, embed_indexed_sequence, \
+from util import get_vocab, embed_indexed_sequence, iter_embedded_sequences, \
     get_word2idx_idx2word, get_embedding_matrix, read_pub_json_files, write_predictions
 from util import TextDatasetWithGloveElmoSuffix_ForTest as RNN_Testset
 from util import TextDatasetForClassfier_CNN_ForTest as CNN_Testset
 from util import evaluate
 from models import RNNSequenceModel, CNN_Text
+from mention_records import MentionRecords
+from metadata_index import open_metadata_index
+from sentence_table import SentenceTable, write_table
+from token_sequences import TokenSequences, Vocabulary
 from util import list_to_string
 import torch.nn.functional as F
 
@@ -20,6 +24,7 @@ import csv
 import ast
 import json
 import h5py
+import numpy as np
 from tqdm import tqdm
 from allennlp.commands.elmo import ElmoEmbedder
 from sklearn.model_selection import train_test_split
@@ -32,9 +37,9 @@ def get_args():
     parser.add_argument('--rnn_model_path', type=str, default='./checkpoint/rcc_labeler.pkl',
                         help='file path for torch model states (default: ./checkpoint/rcc_labeler.pkl)')
     parser.add_argument('--cnn_model_path', type=str, default='./checkpoint/rcc_classifier_cnn.pkl')
-    parser.add_argument('--test_preprocessed', type=str, default='./formatted-data/rcc_corpus_test.csv',
+    parser.add_argument('--test_preprocessed', type=str, default='./formatted-data/rcc_corpus_test.tbl',
                         help='processed test data path')
-    parser.add_argument('--not_found_test_path', type=str, default='./formatted-data/rcc_test.csv',
+    parser.add_argument('--not_found_test_path', type=str, default='./formatted-data/rcc_test.tbl',
                         help='processed test data path, extracted only the unlabeled lines')
     parser.add_argument('--tag_file_path', type=str, default='./formatted-data/datsetIds', 
     										help='tagfile path (default: ./formatted-data/datsetIds)')
@@ -44,12 +49,16 @@ def get_args():
                         help='number of each kind of kernel (default: 100)')
     parser.add_argument('--batch_size', type=int, default=128,
                         help='batch size (default: 1)')
-    parser.add_argument('--unordered_output_path', type=str, default='./formatted-data/model_output_mentions.csv')
+    parser.add_argument('--unordered_output_path', type=str, default='./formatted-data/model_output_mentions.tbl')
     parser.add_argument('--vocab_info_path', type=str, default='./formatted-data/vocabInfo.data', 
                         help='load word2idx, idx2word from dump')
     parser.add_argument('--data_sets_json_path', type=str, default='./formatted-data/data_sets.json')
+    parser.add_argument('--metadata_index', type=str, default='./formatted-data/metadata.sqlite',
+                        help='publication and data set metadata index of publications.json and data_sets.json')
     parser.add_argument('--glove_path', type=str, default='./glove/glove840B300d.txt',
                         help='glove path (default: ./glove/glove840B300d.txt)')
+    parser.add_argument('--glove_store', type=str, default='./glove/glove840B300d.bin',
+                        help='glove store path, converted from glove_path when missing or stale (default: ./glove/glove840B300d.bin)')
     args = parser.parse_args()
     return args
 
@@ -62,49 +71,36 @@ using_GPU = torch.cuda.is_available()
 args = get_args()
 
 logging.info("Loading parsed test data from {}".format(args.test_preprocessed))
-raw_test_rcc = []
-test_annotated = []
-with open(args.test_preprocessed) as f:
-	lines = csv.reader(f)
-	next(lines)
-	for line in lines:
-		publication_id = int(line[0])
-		word_seq = ast.literal_eval(line[1])
-		label_seq = ast.literal_eval(line[2])
-		label_seq = [0 if l=='_' else 2 if 'B' in l else 1 for l in label_seq] 
-		labeled = line[3]
-		assert (len(word_seq) == len(label_seq))
-		if labeled == 'N':
-			raw_test_rcc.append([word_seq, publication_id])
-		else:
-			test_annotated.append([word_seq, label_seq, publication_id])
+# the sentences are int32 word ids of vocabulary, decoded only when they are embedded
+test_table = SentenceTable(args.test_preprocessed)
+vocabulary = Vocabulary()
+test_sentences = TokenSequences.from_table(test_table, 'sentence', vocabulary)
+assert (np.array_equal(test_sentences.lengths(), np.diff(test_table.offsets['label_sequence'])))
+labeled = np.array(test_table.column('labeled')) == 'Y'
+raw_test_rows = np.flatnonzero(~labeled)
+raw_test_rcc = test_sentences.take(raw_test_rows)
+raw_test_pub_ids = test_table.column('publication_id')[raw_test_rows].tolist()
+num_test_annotated = int(np.count_nonzero(labeled))
 
 logging.info("Write other sentences to {}".format(args.not_found_test_path))
-with open(args.not_found_test_path, 'w') as csvfile:
-  fieldnames = [
-      'publication_id',
-      'sentence']
-  writer = csv.DictWriter(
-      csvfile,
-      fieldnames=fieldnames,
-      quoting=csv.QUOTE_ALL)
-  writer.writeheader()
-  output = []
-  for word_seq, publication_id in raw_test_rcc:
-  	output.append({'publication_id': publication_id,
-  								 'sentence': word_seq})
-  logging.info("Writing on new csv file...")
-  writer.writerows(output)
+fieldnames = [
+    'publication_id',
+    'sentence']
+output = ({'publication_id': publication_id, 'sentence': vocabulary.decode(word_ids)}
+          for publication_id, word_ids in zip(raw_test_pub_ids, raw_test_rcc))
+logging.info("Writing on new table...")
+write_table(args.not_found_test_path, fieldnames, output)
 
 logging.info('size of test set: {}, annotated by brute-force test set: {}, to-be-found test set: {}'.format(
-                len(raw_test_rcc) + len(test_annotated), len(test_annotated), len(raw_test_rcc)))
+                len(test_sentences), num_test_annotated, len(raw_test_rcc)))
+logging.info("{} tokens in {} MB of word ids".format(len(test_sentences.ids), test_sentences.nbytes() // 1024 ** 2))
 
 # logging.info("Read vocabulary info from {}".format(args.vocab_info_path))
 # with open(args.vocab_info_path, "rb+") as infile:
 #   word2idx, idx2word = pickle.load(infile)
 
-vocab = get_vocab(raw_test_rcc + test_annotated)
-word2idx, idx2word = get_word2idx_idx2word(vocab)
+vocab = get_vocab(test_sentences)
+word2idx, idx2word = get_word2idx_idx2word(vocab, vocabulary)
 logging.info("Loading glove embeddings")
 glove_embeddings = get_embedding_matrix(word2idx, idx2word, args, normalization=False)
 
@@ -118,8 +114,10 @@ else:
 ############
 embedded_test_rcc = []
 logging.info("embedd test data with glove and elmo vectors")
-for example in tqdm(raw_test_rcc, total=len(raw_test_rcc)):
-	embedded_test_rcc.append([example[1], embed_indexed_sequence(example[0], word2idx, glove_embeddings, elmo)])
+# ELMo embeds the sentences in batches of similar lengths
+embedded_sentences = iter_embedded_sequences((vocabulary.decode(word_ids) for word_ids in raw_test_rcc), word2idx, glove_embeddings, elmo)
+for publication_id, embedded_sentence in tqdm(zip(raw_test_pub_ids, embedded_sentences), total=len(raw_test_rcc)):
+	embedded_test_rcc.append([publication_id, embedded_sentence])
 
 # pickle.dump(embedded_test_rcc, open('./labeler_embedd_temp.data', "wb+"), protocol=-1)
 # with open('./labeler_embedd_temp.data', "rb+") as infile:
@@ -150,10 +148,7 @@ for k, v in state_dict.items():
 RNNseq_model.load_state_dict(new_state_dict)
 result = write_predictions(raw_test_rcc, test_dataloader_rcc, RNNseq_model, using_GPU, args.not_found_test_path)
 logging.info("Write predictions to {}".format(args.not_found_test_path))
-f = open(args.not_found_test_path, 'w')
-writer = csv.writer(f)
-writer.writerows(result)
-f.close()
+write_table(args.not_found_test_path, ['publication_id', 'sentence', 'label_sequence'], result)
 logging.info("*" * 25 + " Mention Labeling By LSTM tagging model " + "*" * 25)
 
 
@@ -169,18 +164,9 @@ with open(args.tag_file_path, 'r') as f:
   for (n, i) in enumerate(f): #idx, label
     class_to_idx[i.strip()] = n
     idx_to_class[n] = i.strip()
-dataset_id_to_date = {}
-logging.info("Loading data_sets.json file for dataset info")
-with open(args.data_sets_json_path) as json_data_sets:
-    data_sets = json.load(json_data_sets)
-    for data_set_info in data_sets:
-        data_set_id = data_set_info.get( "data_set_id", None )
-        date = data_set_info.get( "date", None )
-        date.encode('ascii','ignore')
-        if 'None' in date:
-            date = '1800-01-01'
-        date = date[:4]
-        dataset_id_to_date[data_set_id] = date
+logging.info("Loading metadata index for dataset info")
+metadata_index = open_metadata_index(args.pub_info_path, args.data_sets_json_path, args.metadata_index)
+dataset_id_to_date = metadata_index.data_set_years()
 CNN_Text = CNN_Text(args.kernel_num, args.kernel_sizes, len(class_to_idx), 300 + 1024 + 4)
 loss_criterion = nn.NLLLoss()
 if using_GPU:
@@ -196,62 +182,28 @@ for k, v in state_dict.items():
     name = k[7:] # remove `module.`
     new_state_dict[name] = v
 CNN_Text.load_state_dict(new_state_dict)
-pub_date_dict = {}
-with open(args.pub_info_path) as json_publication_file:
-  publication_list = json.load(json_publication_file)
-  for publication_info in publication_list:
-    publication_id = publication_info.get( "publication_id", None )
-    unique_identifier = publication_info.get( "unique_identifier", None ) # id가 bbk로 시작하면 pub_date은 None임
-    if 'bbk' not in unique_identifier:
-      pub_date = publication_info.get( "pub_date", None )
-    else:
-      pub_date = '2019-00-00'
-    pub_date.encode('ascii', 'ignore')
-    pub_date = int(pub_date[:4])
-    pub_date_dict[publication_id] = pub_date
-found_mentions = []
-with open(args.not_found_test_path) as f:
-  lines = csv.reader(f)
-  next(lines)
-  for line in lines:
-    publication_id = int(line[0])
-    word_seq = ast.literal_eval(line[1])
-    label_seq = ast.literal_eval(line[2])
-    assert (len(word_seq) == len(label_seq))
-    found = False
-    mentions_words = []
-    for w, l in zip(word_seq, label_seq):
-      if l == 2:
-        mentions_words.append(w)
-        found = True
-      elif l == 1 and found:
-        mentions_words.append(w)
-      else:
-        if found:
-          found_mentions.append([mentions_words, publication_id, pub_date_dict[publication_id]])
-          mentions_words = []
-          found = False
-    if found:
-      found_mentions.append([mentions_words, publication_id, pub_date_dict[publication_id]])
+# the mentions found as spans of the word codes of the table, their data sets and scores filled in as they are classified
+found_mentions = MentionRecords.from_labels(SentenceTable(args.not_found_test_path))
+found_pub_years = found_mentions.publication_years(metadata_index)
+logging.info("{} mentions found, {} KB of records".format(len(found_mentions), found_mentions.nbytes() // 1024))
 logging.info("embedd test data with glove and elmo vectors")
 embedded_test_rcc = []
-for example in tqdm(found_mentions, total=len(found_mentions)):
-  embedded_test_rcc.append([embed_indexed_sequence(example[0], word2idx, glove_embeddings, elmo), example[1], example[2], example[0]])
+mention_words = (found_mentions.mention_words(i) for i in range(len(found_mentions)))
+for embedded_mention in tqdm(iter_embedded_sequences(mention_words, word2idx, glove_embeddings, elmo), total=len(found_mentions)):
+  embedded_test_rcc.append(embedded_mention)
 
 #pickle.dump(embedded_test_rcc, open('./clf_embedd_temp.data', "wb+"), protocol=-1)
 
-test_dataset_rcc = CNN_Testset([example[0] for example in embedded_test_rcc], # embedded sentence
-                               [example[1] for example in embedded_test_rcc], # pub_id
-                               [example[2] for example in embedded_test_rcc], # pub_date
-                               [example[3] for example in embedded_test_rcc]  # word_seq
+test_dataset_rcc = CNN_Testset(embedded_test_rcc, # embedded sentence
+                               found_mentions.publication_ids.tolist(), # pub_id
+                               found_pub_years.tolist(), # pub_date
+                               np.arange(len(found_mentions)) # index of the record, in place of its word_seq
                                )
 test_dataloader_rcc = DataLoader(dataset=test_dataset_rcc, batch_size=args.batch_size,
                                  collate_fn=CNN_Testset.collate_fn)
-output = []
 CNN_Text.eval()
-max_score = 0
 logging.info("Classify datasets from captured mentions...")
-for example_text, pub_ids, pub_dates, word_seqs in tqdm(test_dataloader_rcc):
+for example_text, pub_ids, pub_dates, record_indexes in tqdm(test_dataloader_rcc):
   example_text = Variable(example_text)
   if using_GPU:
     example_text = example_text.cuda()
@@ -277,31 +229,10 @@ for example_text, pub_ids, pub_dates, word_seqs in tqdm(test_dataloader_rcc):
       else:
         score += max_probs10[i][j].item()
     dataset_id = idx_to_class[prediction.item()]
-    if score > max_score:
-      max_score = score
-    output.append([word_seqs[i], pub_ids[i], dataset_id, score])
-output_normalized = []
-for example in output:
-  normalizer = 1/float(max_score)
-  output_normalized.append([example[0], example[1], example[2], normalizer * example[3]])
+    found_mentions.data_set_ids[record_indexes[i]] = int(dataset_id)
+    found_mentions.scores[record_indexes[i]] = score
+# raw scores, the results store divides them by the best one of the whole corpus when the outputs are exported
 
-with open(args.unordered_output_path, 'w') as csvfile:
-  fieldnames = [
-      'mention',
-      'publication_id',
-      'dataset_id',
-      'score']
-  writer = csv.DictWriter(
-      csvfile,
-      fieldnames=fieldnames,
-      quoting=csv.QUOTE_ALL)
-  writer.writeheader()
-  output = []
-  for m, p, d, s in output_normalized:
-    output.append({'mention': m,
-                   'publication_id': p,
-                   'dataset_id': d,
-                   'score': s})
-  logging.info("Writing on new csv file...")
-  writer.writerows(output)
+logging.info("Writing on new table...")
+write_table(args.unordered_output_path, ['mention', 'publication_id', 'dataset_id', 'score'], found_mentions.rows())
 logging.info("*" * 25 + " Dataset Recognition By CNN Text Classifier " + "*" * 25)
@@ -0,0 +1,81 @@
+import json
+import os
+
+from json_stream import JsonArrayReader
+
+
+OUTPUT_FORMATS = ['json', 'jsonl']
+
+
+def output_file_path(path, output_format='json'):
+    """
+    The path an output file is written to in output_format: JSON Lines files get a .jsonl extension.
+    """
+    if output_format == 'jsonl' and path.endswith('.json'):
+        return path + 'l'
+    return path
+
+
+class JsonWriter(object):
+    """
+    Streams records (dicts) into an output file as they are made, without holding them.
+    By default the file is a JSON array indented as json.dump(records, f, indent=4) writes it, byte for byte;
+    compact leaves out the indentation and the spaces, output_format 'jsonl' writes one record per line.
+    The records are written into <path>.tmp, renamed to path on close(), so an interrupted run never leaves
+    a truncated output file behind.
+    """
+    def __init__(self, path, output_format='json', compact=False, indent=4):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("unknown output format {}, one of {}".format(output_format, OUTPUT_FORMATS))
+        self.path = path
+        self.lines = output_format == 'jsonl'
+        self.indent = None if compact or self.lines else indent
+        self.separators = (',', ':') if compact else None
+        self.num_records = 0
+        self.file = open(path + '.tmp', 'w')
+        if not self.lines:
+            self.file.write('[')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def write(self, record):
+        data = json.dumps(record, indent=self.indent, separators=self.separators)
+        if self.lines:
+            self.file.write(data + '\n')
+        elif self.indent is None:
+            self.file.write((',' if self.num_records else '') + data)
+        else:
+            # one level deeper than the record alone
+            padding = '\n' + ' ' * self.indent
+            self.file.write((',' if self.num_records else '') + padding + data.replace('\n', padding))
+        self.num_records += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        if not self.lines:
+            self.file.write('\n]' if self.num_records and self.indent is not None else ']')
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+def iter_records(path):
+    """
+    The records of an output file, a JSON array or JSON Lines (.jsonl), one at a time as they are read.
+    """
+    with open(path) as json_file:
+        if path.endswith('.jsonl'):
+            for line in json_file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from JsonArrayReader(json_file)
@@ -0,0 +1,79 @@
+import json
+import re
+
+
+# characters read from the file at a time
+CHUNK_SIZE = 1 << 20
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class JsonArrayReader(object):
+    """
+    Iterates the items of the JSON array in json_file (publications.json, data_set_citations.json, ...) one at a time
+    while the file is read, in chunks: at most the chunk and the item being decoded are held, never the whole document.
+    An item longer than a chunk is decoded once enough of the file is buffered, the buffer doubles until it is.
+    """
+    def __init__(self, json_file, chunk_size=CHUNK_SIZE):
+        self.file = json_file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+
+    def _fill(self, size):
+        # drop what was decoded, append the next size characters; False at the end of the file
+        chunk = self.file.read(size)
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return len(chunk) > 0
+
+    def _peek(self):
+        # the next character that is not whitespace, '' at the end of the file
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill(self.chunk_size):
+                return ''
+
+    def _expect(self, characters):
+        character = self._peek()
+        if not character or character not in characters:
+            raise ValueError("expected one of {!r} in {}, found {!r}".format(
+                characters, getattr(self.file, 'name', 'the JSON file'), character or 'the end of the file'))
+        self.position += 1
+        return character
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # the item goes on past the buffer, or is not valid JSON once the whole file is read
+                if not self._fill(max(self.chunk_size, len(self.buffer))):
+                    raise
+                continue
+            # a number cut by the end of the buffer decodes too (2 of 2.5), the ',' or ']' after the item must be read
+            following = WHITESPACE.match(self.buffer, end).end()
+            if (following == len(self.buffer) or self.buffer[following] not in ',]') and self._fill(self.chunk_size):
+                continue
+            self.position = end
+            return item
+
+    def __iter__(self):
+        self._expect('[')
+        if self._peek() == ']':
+            return
+        while True:
+            yield self._decode()
+            if self._expect(',]') == ']':
+                return
+
+
+def iter_json_array(path, chunk_size=CHUNK_SIZE):
+    """
+    The items of the JSON array in the file at path, one at a time as they are read.
+    """
+    with open(path) as json_file:
+        yield from JsonArrayReader(json_file, chunk_size)
@@ -1,7 +1,10 @@
 #import split as sp
+import argparse
 import csv
 import ast
 from tqdm import tqdm
+from corpus_store import write_store
+from sentence_table import SentenceTable
 
 
 FORMATTED_DATA_PATH = './formatted-data/'
@@ -18,33 +21,34 @@ def list_to_string(list_tokens):
         res += tok
     return res
 
-with open(FORMATTED_DATA_PATH + 'rcc_corpus_test.csv') as f:
-    lines = csv.reader(f)
-    next(lines)
-    
-    write_dict =dict()
-    write_count = dict()
-    for line in lines:
-        word_id = int(line[0])        # list of tokens(words)
+def get_args():
+    parser = argparse.ArgumentParser(description='write the first sentences of every publication as its abstract')
+    parser.add_argument('--test_preprocessed', type=str, default=FORMATTED_DATA_PATH + 'rcc_corpus_test.tbl',
+                        help='processed test data path')
+    parser.add_argument('--abstract_store', type=str, default='',
+                        help='pack the abstracts into this corpus store instead of writing one file per publication')
+    args = parser.parse_args()
+    return args
+
+args = get_args()
+write_dict =dict()
+write_count = dict()
+for row in SentenceTable(args.test_preprocessed):
+    word_id = row['publication_id']
+    if word_id not in write_dict:
         write_dict[word_id] = ''
         write_count[word_id] = 0
-    f.close()
-
-with open(FORMATTED_DATA_PATH + 'rcc_corpus_test.csv') as f1:
-    lines1 = csv.reader(f1)
-    next(lines1)
-
-    for line in lines1:
-        word_id = int(line[0])
-        list_ = ast.literal_eval(line[1])
-        string = list_to_string(list_)
-        if write_count[word_id] == 40:
-            continue
-        else:
-            write_dict[word_id] = write_dict[word_id] + ' ' + string
-            write_count[word_id] = write_count[word_id] + 1
-    f1.close()
+    list_ = row['sentence']
+    string = list_to_string(list_)
+    if write_count[word_id] == 40:
+        continue
+    else:
+        write_dict[word_id] = write_dict[word_id] + ' ' + string
+        write_count[word_id] = write_count[word_id] + 1
 
-for key, value in write_dict.items():
-    f2 = open(ABSTRACT_DATA_PATH + str(key) + '.txt', 'w')
-    f2.write(value)
+if args.abstract_store:
+    write_store(args.abstract_store, ((key, value.encode('utf-8')) for key, value in write_dict.items()))
+else:
+    for key, value in write_dict.items():
+        f2 = open(ABSTRACT_DATA_PATH + str(key) + '.txt', 'w')
+        f2.write(value)
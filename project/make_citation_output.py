@@ -8,125 +8,45 @@ import csv
 import ast
 import json
 
-def list_to_string(list_tokens):
-    res = ''
-    first = True
-    for tok in list_tokens:
-        if first:
-            first = False
-        else:
-            res += ' '
-        res += tok
-    return res
-
+from json_output import OUTPUT_FORMATS
+from mention_records import MentionRecords
+from results_store import CITATION_TABLES, ResultsStore
+from sentence_table import SentenceTable
 
 def get_args():
     parser = argparse.ArgumentParser(description='rcc-09')
-    parser.add_argument('--test_preprocessed', type=str, default='./formatted-data/rcc_corpus_test.csv',
+    parser.add_argument('--test_preprocessed', type=str, default='./formatted-data/rcc_corpus_test.tbl',
                         help='processed test data path')
-    parser.add_argument('--unordered_output_path', type=str, default='./formatted-data/model_output_mentions.csv')
+    parser.add_argument('--unordered_output_path', type=str, default='./formatted-data/model_output_mentions.tbl')
     #dataset_citations
     parser.add_argument('--dataset_citations_path', type=str, default='../data/output/data_set_citations.json')
     parser.add_argument('--data_set_mentions_path', type=str, default='../data/output/data_set_mentions.json')
+    parser.add_argument('--output_format', type=str, default='json', choices=OUTPUT_FORMATS,
+                        help='json writes JSON arrays, jsonl JSON Lines files with a .jsonl extension (default: json)')
+    parser.add_argument('--compact', action='store_true',
+                        help='write the outputs without indentation')
+    parser.add_argument('--results_store', type=str, default='./formatted-data/results.sqlite',
+                        help='results store the predictions are added to and the outputs exported from')
+    parser.add_argument('--update', action='store_true',
+                        help='only replace the results of the publications in the tables, keeping the others in the store')
     args = parser.parse_args()
     return args
 
 args = get_args()
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(message)s', datefmt='%m-%d %H:%M')
 logging.info("test data(preprocessed): {}".format(args.test_preprocessed))
-test_annotated = []
-with open(args.test_preprocessed) as f:
-    lines = csv.reader(f)
-    next(lines)
-    for line in lines:
-        publication_id = int(line[0])
-        word_seq = ast.literal_eval(line[1])
-        label_seq = ast.literal_eval(line[2])
-        assert (len(word_seq) == len(label_seq))
-        found = False
-        mentions_words = []
-        dataset_id = 0
-        for w, l in zip(word_seq, label_seq):
-            if 'B' in l:
-                mentions_words.append(w)
-                found = True
-                dataset_id = l[2:]
-            elif l == 'I':
-                mentions_words.append(w)
-            else:
-                if found:
-                    test_annotated.append([mentions_words, publication_id, dataset_id, 1.0])
-                    found = False
-                    mentions_words = []
-        if found:
-            test_annotated.append([mentions_words, publication_id, dataset_id, 1.0])
-
-with open(args.unordered_output_path) as f:
-    lines = csv.reader(f)
-    next(lines)
-    for line in lines:
-        mentions_words = ast.literal_eval(line[0])
-        publication_id = int(line[1])
-        dataset_id = int(line[2])
-        score = float(line[3])
-        test_annotated.append([mentions_words, publication_id, dataset_id, score])
-
-dataset_citations_mentionlist_dict = dict()
-dataset_citations_scores_dict = dict()
-mentions_dict = dict()
-for mention_words, pub_id, dataset_id, score in test_annotated:
-    key = (pub_id, int(dataset_id))
-    key2 = (pub_id, list_to_string(mention_words))
-    if key in dataset_citations_mentionlist_dict:
-        dataset_citations_mentionlist_dict[key].append(list_to_string(mention_words))
-        dataset_citations_scores_dict[key] = [dataset_citations_scores_dict[key][0] + score,
-                                              dataset_citations_scores_dict[key][1] + 1]
+with ResultsStore(args.results_store) as store:
+    if args.update:
+        # the other publications keep their results
+        publication_ids = set(SentenceTable(args.test_preprocessed).column('publication_id').tolist())
+        publication_ids.update(SentenceTable(args.unordered_output_path).column('publication_id').tolist())
+        store.delete_publications(publication_ids, CITATION_TABLES)
     else:
-        dataset_citations_mentionlist_dict[key] = [list_to_string(mention_words)]
-        dataset_citations_scores_dict[key] = [score, 1]
-    if key2 in mentions_dict:
-        mentions_dict[key2] = [mentions_dict[key2][0] + score,
-                               mentions_dict[key2][1] + 1]
-    else:
-        mentions_dict[key2] = [score, 1]
-
-
-dataset_citations = []
-for key, mention_list in dataset_citations_mentionlist_dict.items():
-    citation_dict = dict()
-    score = dataset_citations_scores_dict[key][0] / dataset_citations_scores_dict[key][1]
-    pub_id = key[0]
-    dataset_id = key[1]
-    citation_dict['publication_id'] = pub_id
-    citation_dict['data_set_id'] = dataset_id
-    citation_dict['mention_list'] = list(set(mention_list))
-    citation_dict['score'] = round(score, 3)
-    dataset_citations.append(citation_dict)
-
-with open(args.dataset_citations_path, 'w') as outfile:
-    json.dump(dataset_citations, outfile, indent=4)
-
-dataset_mentions = []
-for key, score_info in mentions_dict.items():
-    men_dict = dict()
-    pub_id = key[0]
-    mention = key[1]
-    score = mentions_dict[key][0] / mentions_dict[key][1]
-    men_dict['publication_id'] = pub_id
-    men_dict['mention'] = mention
-    men_dict['score'] = round(score, 3)
-    dataset_mentions.append(men_dict)
-
-with open(args.data_set_mentions_path, 'w') as outfile:
-    json.dump(dataset_mentions, outfile, indent=4)
-
-
-
-
-
-
-
-
-
-
-
+        store.clear(CITATION_TABLES)
+    # every prediction is added to the score sum and count of its citation and of its mention:
+    # the mentions tagged in the test table (score 1.0), read as they always were, I labels before a B since the last
+    # mention included, then the ones the models found, with their raw scores
+    store.add_predictions(MentionRecords.from_labels(SentenceTable(args.test_preprocessed), inside_before_begin=True))
+    store.add_predictions(MentionRecords.from_output_table(SentenceTable(args.unordered_output_path)), model_scores=True)
+    store.export('citations', args.dataset_citations_path, args.output_format, args.compact)
+    store.export('mentions', args.data_set_mentions_path, args.output_format, args.compact)
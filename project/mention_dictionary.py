@@ -0,0 +1,208 @@
+import argparse
+import array
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+
+from text_util import NORMALIZE_VERSION, list_to_string, normalize_string, split_into_sentences
+from tokenizer import TOKENIZER_VERSION, word_tokenize, ensure_nltk_data
+
+
+# bump whenever compile_data_sets() or the file layout change, it invalidates the compiled dictionaries
+DICTIONARY_VERSION = 1
+MAGIC = b'RCCMDICT'
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='compile data_sets.json into the mention dictionary the stages load')
+    parser.add_argument('--data_sets_json_path', type=str, default='./formatted-data/data_sets.json',
+                        help='data_sets.json path')
+    parser.add_argument('--dictionary_path', type=str, default='./formatted-data/mention_dictionary.bin',
+                        help='compiled mention dictionary path')
+    args = parser.parse_args()
+    return args
+
+
+def encode_date(date):
+    """
+    The day number the stages compare dates by, data sets without a date are taken as of 1800-01-01.
+    """
+    date = date[:10]
+    if 'None' in date:
+        date = '1800-01-01'
+    return int(date[:4]) * 12 * 31 + int(date[5:7]) * 31 + int(date[8:10])
+
+
+def source_digest(data_sets_json_path):
+    digest = hashlib.sha1()
+    with open(data_sets_json_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compile_data_sets(data_sets_json_path):
+    """
+    :return: (date, year, data_set_id, [name_words, mention_words, ...]) of every data set, the newest first.
+    Pronoun-like mentions ('data', 'time') and mentions without words are dropped, the name is always kept.
+    """
+    from tqdm import tqdm
+    data_sets = []
+    with open(data_sets_json_path) as json_data_sets:
+        for data_set_info in tqdm(json.load(json_data_sets)):
+            data_set_id = data_set_info.get( "data_set_id", None )
+            name = data_set_info.get( "name", None )
+            date = data_set_info.get( "date", None )
+            # inference.py compares publication years against the year of the whole date string
+            year = int(('1800-01-01' if 'None' in date else date)[:4])
+            formatted_mention_list = [word_tokenize(normalize_string(name))]
+            for mention in data_set_info.get( "mention_list", None ):
+                mention = normalize_string(mention).strip()
+                mention = re.sub("\s\s+", " ", mention)
+                if all(c.islower() for c in mention) and len(mention.split()) <= 2:
+                    continue    # to avoid pronoun mentions like 'data', 'time'
+                words = []
+                for sentence in split_into_sentences(mention):
+                    words += word_tokenize(sentence)
+                words = [w for w in words if len(w)<15]
+                if len(words) > 0:
+                    formatted_mention_list.append(words)
+            data_sets.append((encode_date(date), year, data_set_id, formatted_mention_list))
+    data_sets.sort(key=lambda x: int(x[0]), reverse=True)
+    return data_sets
+
+
+def version_stamp(digest):
+    return {
+        'dictionary_version': DICTIONARY_VERSION,
+        'normalize_version': NORMALIZE_VERSION,
+        'tokenizer_version': TOKENIZER_VERSION,
+        'source_sha1': digest,
+    }
+
+
+def write_dictionary(dictionary_path, data_sets, digest):
+    """
+    Layout: MAGIC, the int64 header length and the json header (version stamp and counts),
+    then int64 (date, year, data_set_id, number of mentions) of every data set,
+    int64 (offset, length, number of words) of every mention and the mention words, '\n' separated utf-8.
+    Tokens never contain whitespace, normalize_string() keeps no control characters.
+    """
+    header = dict(version_stamp(digest), num_data_sets=len(data_sets),
+                  num_mentions=sum(len(mentions) for _, _, _, mentions in data_sets))
+    header = json.dumps(header).encode('utf-8')
+    header += b' ' * (-len(header) % 8)    # the int64 arrays stay aligned
+    data_set_records = array.array('q')
+    mention_records = array.array('q')
+    blob = bytearray()
+    for date, year, data_set_id, mentions in data_sets:
+        data_set_records.extend((date, year, data_set_id, len(mentions)))
+        for words in mentions:
+            data = '\n'.join(words).encode('utf-8')
+            mention_records.extend((len(blob), len(data), len(words)))
+            blob += data
+    with open(dictionary_path + '.tmp', 'wb') as dictionary_file:
+        dictionary_file.write(MAGIC)
+        array.array('q', [len(header)]).tofile(dictionary_file)
+        dictionary_file.write(header)
+        data_set_records.tofile(dictionary_file)
+        mention_records.tofile(dictionary_file)
+        dictionary_file.write(blob)
+    # write then rename, a stage loading the dictionary never sees a partial one
+    os.replace(dictionary_path + '.tmp', dictionary_path)
+
+
+class MentionDictionary(object):
+    """
+    Read-only view of a compiled mention dictionary, memory-mapped.
+    """
+    def __init__(self, dictionary_path):
+        with open(dictionary_path, 'rb') as dictionary_file:
+            self.data = mmap.mmap(dictionary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a mention dictionary".format(dictionary_path))
+        view = memoryview(self.data)
+        header_length = view[8:16].cast('q')[0]
+        self.header = json.loads(str(view[16:16 + header_length], 'utf-8'))
+        start = 16 + header_length
+        end = start + 8 * 4 * self.header['num_data_sets']
+        self.data_set_records = view[start:end].cast('q')
+        start, end = end, end + 8 * 3 * self.header['num_mentions']
+        self.mention_records = view[start:end].cast('q')
+        self.blob = view[end:]
+
+    def is_current(self, digest):
+        return all(self.header.get(key, None) == value for key, value in version_stamp(digest).items())
+
+    def data_sets(self):
+        """
+        :return: (date, year, data_set_id, [mention_words]) of every data set, as compile_data_sets() returned them
+        """
+        data_sets = []
+        records, mention_records, blob = self.data_set_records, self.mention_records, self.blob
+        mention = 0
+        for i in range(0, len(records), 4):
+            mentions = []
+            for j in range(3 * mention, 3 * (mention + records[i + 3]), 3):
+                offset, length, num_words = mention_records[j:j + 3]
+                mentions.append(str(blob[offset:offset + length], 'utf-8').split('\n') if num_words else [])
+            mention += records[i + 3]
+            data_sets.append((records[i], records[i + 1], records[i + 2], mentions))
+        return data_sets
+
+    def data_set_mention_info(self, max_mention_words=None):
+        """
+        :param max_mention_words: longer mentions are dropped, the name of a data set is always kept
+        :return: [date, data_set_id, [[mention_words, raw_mention]]] of every data set, the newest first
+        """
+        data_set_mention_info = []
+        for date, year, data_set_id, mentions in self.data_sets():
+            formatted_mention_list = [[mentions[0], list_to_string(mentions[0])]]
+            for words in mentions[1:]:
+                if max_mention_words is None or len(words) <= max_mention_words:
+                    formatted_mention_list.append([words, list_to_string(words)])
+            data_set_mention_info.append([date, data_set_id, formatted_mention_list])
+        return data_set_mention_info
+
+    def data_set_years(self):
+        """
+        :return: data_set_id -> year string
+        """
+        records = self.data_set_records
+        return {records[i + 2]: str(records[i + 1]) for i in range(0, len(records), 4)}
+
+
+def build_dictionary(data_sets_json_path, dictionary_path):
+    logging.info("Compiling {} into {}...".format(data_sets_json_path, dictionary_path))
+    ensure_nltk_data()
+    digest = source_digest(data_sets_json_path)
+    write_dictionary(dictionary_path, compile_data_sets(data_sets_json_path), digest)
+    return MentionDictionary(dictionary_path)
+
+
+def load_mention_dictionary(data_sets_json_path, dictionary_path):
+    """
+    The compiled dictionary of data_sets_json_path, compiled again first if it is missing
+    or was compiled from another data_sets.json or with other preprocessing versions.
+    """
+    if os.path.exists(dictionary_path):
+        try:
+            mention_dictionary = MentionDictionary(dictionary_path)
+        except ValueError:
+            mention_dictionary = None
+        if mention_dictionary is not None and mention_dictionary.is_current(source_digest(data_sets_json_path)):
+            return mention_dictionary
+    return build_dictionary(data_sets_json_path, dictionary_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    mention_dictionary = build_dictionary(args.data_sets_json_path, args.dictionary_path)
+    logging.info("Compiled {} data sets, {} mentions".format(
+        mention_dictionary.header['num_data_sets'], mention_dictionary.header['num_mentions']))
@@ -0,0 +1,439 @@
+import bisect
+import collections
+import itertools
+import math
+
+import numpy as np
+
+
+# MentionAutomaton merge orders: up to 2^20 mentions per data set and 2^20 data sets, dates below 2^23 days
+ORDER_SEQUENCE_STEP = 1 << 20
+ORDER_DATE_STEP = 1 << 40
+
+
+def replace_labels(raw_text, mention, raw_mention, begin_mark):
+    """
+    Labels of one mention the way encode_test() tags it: every occurrence replaced by <MT-B> <MT-I>.. markers,
+    words that are exactly a marker labeled.
+    """
+    substitute_pattern = '<MT-B>' + ' <MT-I>' * (len(mention)-1)
+    replaced_text = raw_text.replace(raw_mention, substitute_pattern)
+    return [begin_mark if w=='<MT-B>' else 'I' if w=='<MT-I>' else '_' for w in replaced_text.split()]
+
+
+class MentionAutomaton(object):
+    """
+    Aho-Corasick automaton over the raw mention strings of data_set_mention_info, built once per run,
+    finding every mention occurrence of a publication in one pass over its text.
+    label_sequence() returns exactly what encode_test() does: the automaton matches characters as str.replace() does,
+    inside words too, and per mention only the non-overlapping leftmost occurrences count. An occurrence labels
+    the words it covers entirely, B- on its first word and I on the others, and the labels of the mentions are
+    merged in the data_set_mention_info order (newest data set first).
+    label_codes() returns the labels as an int32 array, 0 for '_', 1 for 'I' and the code of the data set for B-,
+    label_names maps the codes back to the label strings.
+    Only the data sets older than the publication count. Every state knows the oldest data set below it, so the scan
+    for a publication never enters states of newer data sets only; it runs the automaton of the eligible data sets
+    without building one per date.
+    """
+    def __init__(self, data_set_mention_info):
+        # the data sets sorted by date, newest first, and their label codes
+        self.data_set_mention_info = []
+        # negated, so the dates are ascending for bisect
+        self.negated_dates = []
+        self.begin_codes = []
+        # trie states: transitions, failure link, ids of the mention strings ending here (through the failure links too)
+        # and the date of the oldest data set with a mention string through the state
+        self.goto = [dict()]
+        self.fail = [0]
+        self.out = [()]
+        self.min_dates = [None]
+        self.string_ids = dict()
+        self.string_states = []
+        self.string_lengths = []    # (number of characters, number of words)
+        self.string_min_dates = []
+        self.string_mentions = []   # (order, date, begin code) of the mentions with this raw string
+        # mentions whose raw string is not their words joined by single spaces, tagged by replace_labels(), by date
+        self.irregular_mentions = []
+        self.irregular_negated_dates = []
+        self.label_names = ['_', 'I']
+        self._add_data_sets(data_set_mention_info)
+
+    @staticmethod
+    def _order(date, sequence, mention_index):
+        """
+        Merge order of a mention as one int: the newest data set first, data sets of a date in the data_set_mention_info
+        order and their mentions in the mention_list order.
+        """
+        return -date * ORDER_DATE_STEP + sequence * ORDER_SEQUENCE_STEP + mention_index
+
+    def _add_data_sets(self, data_set_mention_info):
+        """
+        Insert the data sets of data_set_mention_info ([date, data_set_id, [[mention_words, raw_mention]]]) by date,
+        each taking the next label code, then compute the failure links.
+        """
+        for date, data_set_id, mention_list in data_set_mention_info:
+            sequence = len(self.begin_codes)
+            begin_code = len(self.label_names)
+            self.label_names.append('B-' + str(data_set_id))
+            position = bisect.bisect_right(self.negated_dates, -date)
+            self.negated_dates.insert(position, -date)
+            self.data_set_mention_info.insert(position, [date, data_set_id, mention_list])
+            self.begin_codes.insert(position, begin_code)
+            for mention_index, mention_info in enumerate(mention_list):
+                mention, raw_mention = mention_info[0], mention_info[1]
+                order = self._order(date, sequence, mention_index)
+                if not mention or raw_mention.split() != list(mention) or ' '.join(mention) != raw_mention:
+                    position = bisect.bisect_right(self.irregular_negated_dates, -date)
+                    self.irregular_negated_dates.insert(position, -date)
+                    self.irregular_mentions.insert(position, (order, date, begin_code, mention, raw_mention))
+                else:
+                    self._add_string(raw_mention, len(mention), date).append((order, date, begin_code))
+        self._build_failure_links()
+        return self
+
+    def _add_string(self, raw_mention, num_words, date):
+        state = 0
+        for c in raw_mention:
+            next_state = self.goto[state].get(c)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][c] = next_state
+                self.goto.append(dict())
+                self.fail.append(0)
+                self.out.append(())
+                self.min_dates.append(date)
+            state = next_state
+            self.min_dates[state] = min(self.min_dates[state], date)
+        if raw_mention not in self.string_ids:
+            self.string_ids[raw_mention] = len(self.string_lengths)
+            self.string_states.append(state)
+            self.string_lengths.append((len(raw_mention), num_words))
+            self.string_min_dates.append(date)
+            self.string_mentions.append([])
+        string_id = self.string_ids[raw_mention]
+        self.string_min_dates[string_id] = min(self.string_min_dates[string_id], date)
+        return self.string_mentions[string_id]
+
+    def _build_failure_links(self):
+        # new states can be the failure link of old ones, every link is computed again
+        self.out = [() for _ in self.goto]
+        for string_id, state in enumerate(self.string_states):
+            self.out[state] = (string_id,)
+        queue = list(self.goto[0].values())
+        for state in queue:    # breadth first, the queue grows while iterating
+            for c, next_state in self.goto[state].items():
+                fail_state = self.fail[state]
+                while fail_state and c not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(c, 0)
+                self.out[next_state] = self.out[next_state] + self.out[self.fail[next_state]]
+                queue.append(next_state)
+
+    def find(self, text, pub_date=None):
+        """
+        :param pub_date: only the mention strings of data sets older than pub_date are matched, all if None
+        :return: (end, string id) of every mention string occurrence in text, overlapping ones included, by end
+        """
+        goto, fail, out, min_dates, string_min_dates = self.goto, self.fail, self.out, self.min_dates, self.string_min_dates
+        matches = []
+        state = 0
+        if pub_date is None or not self.negated_dates or pub_date > -self.negated_dates[0]:
+            # every data set is older than the publication, nothing to skip
+            for end, c in enumerate(text, 1):
+                next_state = goto[state].get(c)
+                while next_state is None and state:
+                    state = fail[state]
+                    next_state = goto[state].get(c)
+                state = 0 if next_state is None else next_state
+                if out[state]:
+                    matches.extend((end, string_id) for string_id in out[state])
+            return matches
+        for end, c in enumerate(text, 1):
+            next_state = goto[state].get(c)
+            # a failure link can lead to a state of newer data sets only, whose transitions are skipped the same way
+            while (next_state is None or min_dates[next_state] >= pub_date) and state:
+                state = fail[state]
+                next_state = goto[state].get(c)
+            state = 0 if next_state is None or min_dates[next_state] >= pub_date else next_state
+            if out[state]:
+                matches.extend((end, string_id) for string_id in out[state] if string_min_dates[string_id] < pub_date)
+        return matches
+
+    def occurs(self, raw_text, pub_date):
+        """
+        :return: whether a mention of a data set older than pub_date occurs in raw_text at all, words or not,
+        or could label it otherwise (encode_test() labels words that look like its markers for every mention)
+        """
+        if '<MT-' in raw_text and bisect.bisect_right(self.negated_dates, -pub_date) < len(self.negated_dates):
+            return True
+        if self.find(raw_text, pub_date):
+            return True
+        eligible = bisect.bisect_right(self.irregular_negated_dates, -pub_date)
+        return any(mention[4] in raw_text for mention in self.irregular_mentions[eligible:])
+
+    def label_codes(self, raw_text, pub_date):
+        words = raw_text.split()
+        # order, word index and label code of every labeled word of every mention
+        orders, indices, codes = [], [], []
+        # encode_test() zips the labels of every mention with the ones so far, a mention replaced by fewer words
+        # than it has (only possible for the irregular ones) cuts the labels short
+        num_labels = len(words)
+        if ' '.join(words) != raw_text or '<MT-' in raw_text:
+            # words are not single space separated or look like markers themselves, tag every mention as encode_test() does
+            eligible = bisect.bisect_right(self.negated_dates, -pub_date)
+            order = 0
+            for begin_code, (date, data_set_id, mention_list) in zip(self.begin_codes[eligible:], self.data_set_mention_info[eligible:]):
+                for mention_info in mention_list:
+                    res = replace_labels(raw_text, mention_info[0], mention_info[1], '')
+                    for i, l in zip(range(len(words)), res):
+                        if l != '_':
+                            orders.append(order)
+                            indices.append(i)
+                            codes.append(1 if l == 'I' else begin_code)
+                    num_labels = min(num_labels, len(res))
+                    order += 1
+            return self._merge(orders, indices, codes, num_labels)
+        last_end = dict()
+        word_starts = None
+        for end, string_id in self.find(raw_text, pub_date):
+            mentions = [mention for mention in self.string_mentions[string_id] if mention[1] < pub_date]
+            length, num_words = self.string_lengths[string_id]
+            start = end - length
+            if start < last_end.get(string_id, 0):
+                continue
+            last_end[string_id] = end
+            if word_starts is None:
+                word_starts = list(itertools.accumulate([0] + [len(w) + 1 for w in words[:-1]]))
+            first = bisect.bisect_right(word_starts, start) - 1
+            last = first + num_words - 1
+            # words partially covered by the occurrence are glued to a marker, which leaves them unlabeled
+            covered = []
+            if start == word_starts[first] and (num_words > 1 or end == word_starts[first] + len(words[first])):
+                covered.append((first, None))
+            covered += [(i, 1) for i in range(first + 1, last)]
+            if num_words > 1 and end == word_starts[last] + len(words[last]):
+                covered.append((last, 1))
+            for order, date, begin_code in mentions:
+                for i, code in covered:
+                    orders.append(order)
+                    indices.append(i)
+                    codes.append(begin_code if code is None else code)
+        eligible = bisect.bisect_right(self.irregular_negated_dates, -pub_date)
+        for order, date, begin_code, mention, raw_mention in self.irregular_mentions[eligible:]:
+            res = replace_labels(raw_text, mention, raw_mention, '')
+            for i, l in zip(range(len(words)), res):
+                if l != '_':
+                    orders.append(order)
+                    indices.append(i)
+                    codes.append(1 if l == 'I' else begin_code)
+            num_labels = min(num_labels, len(res))
+        return self._merge(orders, indices, codes, num_labels)
+
+    def label_sequence(self, raw_text, pub_date):
+        label_names = self.label_names
+        return [label_names[code] for code in self.label_codes(raw_text, pub_date).tolist()]
+
+    @staticmethod
+    def _merge(orders, indices, codes, num_labels):
+        label_codes = np.zeros(num_labels, dtype=np.int32)
+        if not orders:
+            return label_codes
+        by_order = np.argsort(np.array(orders), kind='stable')
+        indices = np.array(indices)[by_order]
+        codes = np.array(codes, dtype=np.int32)[by_order]
+        in_range = indices < num_labels
+        indices, codes = indices[in_range], codes[in_range]
+        # merged mention by mention in order, a B- never overrides an earlier label and an I always wins:
+        # a word is I if any mention labels it I, otherwise it keeps the B- of the first mention
+        begins = codes > 1
+        begin_indices, first = np.unique(indices[begins], return_index=True)
+        label_codes[begin_indices] = codes[begins][first]
+        label_codes[indices[codes == 1]] = 1
+        return label_codes
+
+
+class MentionTrie(object):
+    """
+    Word trie over the mention lists of one publication ([[data_set_id, [mention_words]]] of its citation_dict entry).
+    encode() returns exactly what encode() of text_util does: every match at every position is found in one scan
+    per sentence, then applied mention by mention in the mention_list order. Like label_substring(), a match only
+    starts a B- on a word not labeled yet and always labels the rest of the mention I, and one word mentions
+    never match.
+    """
+    def __init__(self, mention_list):
+        # word -> [children, (order, number of words, begin_mark) of the mentions ending here]
+        self.root = dict()
+        # empty mentions match at the first word of a sentence
+        self.empty_mentions = []
+        order = 0
+        for data_set_id, mentions in mention_list:
+            begin_mark = 'B-' + str(data_set_id)
+            for mention in mentions:
+                if len(mention) == 0:
+                    self.empty_mentions.append((order, 0, begin_mark))
+                elif len(mention) > 1:    # label_substring() scans sentence[:0] for these
+                    children = self.root
+                    for word in mention:
+                        node = children.setdefault(word, [dict(), []])
+                        children = node[0]
+                    node[1].append((order, len(mention), begin_mark))
+                order += 1
+
+    def label_sentence(self, sentence):
+        matches = []
+        if sentence:
+            matches += [(order, 0, num_words, begin_mark) for order, num_words, begin_mark in self.empty_mentions]
+        root = self.root
+        for i in range(len(sentence)):
+            children = root
+            j = i
+            while j < len(sentence):
+                node = children.get(sentence[j])
+                if node is None:
+                    break
+                children = node[0]
+                matches += [(order, i, num_words, begin_mark) for order, num_words, begin_mark in node[1]]
+                j += 1
+        label_sequence = ['_' for _ in sentence]
+        found_cnt = 0
+        for order, i, num_words, begin_mark in sorted(matches, key=lambda match: match[:2]):
+            if label_sequence[i] == '_':
+                found_cnt += 1
+                label_sequence[i] = begin_mark
+            for j in range(i + 1, i + num_words):
+                label_sequence[j] = 'I'
+        return label_sequence, found_cnt
+
+    def encode(self, sentences):
+        label_sequence_list = []
+        found_cnt = 0
+        for sentence in sentences:
+            label_sequence, cnt = self.label_sentence(sentence)
+            found_cnt += cnt
+            label_sequence_list.append(label_sequence)
+        return label_sequence_list, found_cnt
+
+
+class FuzzyMentionIndex(object):
+    """
+    Approximate mention matching over the mention strings of data_set_mention_info, SimString style
+    (Okazaki and Tsujii, 2010): a string is the set of its character n-grams, padded with '$' (normalize_string()
+    never keeps one), and two strings match if the cosine similarity of their sets is at least threshold.
+    A string X can only match a string Y sharing threshold^2 * |Y| n-grams with it, counted through the postings
+    of the n-grams of X. find_spans() counts them once per sentence, a span of it only has the padding n-grams
+    more, and only compares its spans with the few mention strings left.
+    Spans start with a capitalized word or a number, as data set names do. Short strings are left to the exact
+    matching, their n-gram sets are too small to compare.
+    The begin codes are the label codes of a MentionAutomaton built with data_set_mention_info, or begin_codes.
+    """
+    def __init__(self, data_set_mention_info, threshold=0.8, n=3, min_chars=10, max_words=10, begin_codes=None):
+        self.threshold = threshold
+        self.n = n
+        self.min_chars = min_chars
+        self.max_words = max_words
+        self.postings = dict()  # n-gram -> ids of the strings with it
+        self.string_ids = dict()
+        self.string_features = []
+        self.string_mentions = []   # (date, begin code) of the data sets with this mention string, newest first
+        self.sizes = []             # (number of n-grams, id) of the strings, ascending
+        if begin_codes is None:
+            begin_codes = range(2, len(data_set_mention_info) + 2)
+        for begin_code, (date, data_set_id, mention_list) in zip(begin_codes, data_set_mention_info):
+            for mention_info in mention_list:
+                mention, raw_mention = mention_info[0], mention_info[1]
+                if len(raw_mention) < min_chars or len(mention) > max_words:
+                    continue
+                if raw_mention not in self.string_ids:
+                    features = self.features(raw_mention)
+                    string_id = len(self.string_features)
+                    self.string_ids[raw_mention] = string_id
+                    self.string_features.append(features)
+                    self.string_mentions.append([])
+                    for feature in features:
+                        self.postings.setdefault(feature, []).append(string_id)
+                    bisect.insort(self.sizes, (len(features), string_id))
+                mentions = self.string_mentions[self.string_ids[raw_mention]]
+                if not any(code == begin_code for _, code in mentions):
+                    mentions.append((date, begin_code))
+
+    def features(self, string):
+        padded = '$' * (self.n - 1) + string + '$' * (self.n - 1)
+        return {padded[i:i + self.n] for i in range(len(padded) - self.n + 1)}
+
+    def candidates(self, features, slack=0):
+        """
+        :return: ids of the mention strings Y sharing at least threshold^2 * |Y| - slack n-grams with features
+        """
+        overlaps = collections.Counter()
+        for feature in features:
+            posting = self.postings.get(feature, None)
+            if posting is not None:
+                overlaps.update(posting)
+        threshold_squared = self.threshold * self.threshold
+        string_features = self.string_features
+        string_ids = [string_id for string_id, overlap in overlaps.items()
+                      if overlap >= threshold_squared * len(string_features[string_id]) - slack - 1e-9]
+        # strings too small to need any shared n-gram are never counted
+        small = bisect.bisect_right(self.sizes, ((slack + 1e-9) / threshold_squared, math.inf))
+        string_ids.extend(string_id for _, string_id in self.sizes[:small] if string_id not in overlaps)
+        return string_ids
+
+    def similar(self, features, string_ids):
+        """
+        :return: (similarity, string id) of the mention strings of string_ids at least threshold similar to features
+        """
+        results = []
+        bound = self.threshold * self.threshold * len(features)
+        for string_id in string_ids:
+            other_features = self.string_features[string_id]
+            overlap = len(features & other_features)
+            # overlap / sqrt(|X| * |Y|) >= threshold, squared
+            if overlap * overlap >= bound * len(other_features) - 1e-9:
+                results.append((overlap / math.sqrt(len(features) * len(other_features)), string_id))
+        return results
+
+    def search(self, string):
+        """
+        :return: (similarity, string id) of every mention string at least threshold similar to string
+        """
+        features = self.features(string)
+        return self.similar(features, self.candidates(features))
+
+    def find_spans(self, sentence, pub_date):
+        """
+        :return: (start, number of words, begin code) of the best non-overlapping fuzzy matches in sentence,
+        of data sets older than pub_date
+        """
+        starts = [start for start, word in enumerate(sentence) if word[:1].isupper() or word[:1].isdigit()]
+        if not starts:
+            return []
+        # the n-grams of a span are n-grams of the sentence but the padded ones at both of its ends
+        candidates = sorted((len(self.string_features[string_id]), string_id)
+                            for string_id in self.candidates(self.features(' '.join(sentence)), 2 * (self.n - 1))
+                            if any(date < pub_date for date, _ in self.string_mentions[string_id]))
+        if not candidates:
+            return []
+        sizes = [size for size, _ in candidates]
+        string_ids = [string_id for _, string_id in candidates]
+        threshold_squared = self.threshold * self.threshold
+        hits = []
+        for start in starts:
+            for end in range(start + 1, min(start + self.max_words, len(sentence)) + 1):
+                string = ' '.join(sentence[start:end])
+                if len(string) < self.min_chars:
+                    continue
+                features = self.features(string)
+                # only strings of threshold^2 * |X| to |X| / threshold^2 n-grams can be similar enough
+                low = bisect.bisect_left(sizes, threshold_squared * len(features) - 1e-9)
+                high = bisect.bisect_right(sizes, len(features) / threshold_squared + 1e-9)
+                for similarity, string_id in self.similar(features, string_ids[low:high]):
+                    eligible = [code for date, code in self.string_mentions[string_id] if date < pub_date]
+                    hits.append((similarity, start, end - start, eligible[0]))
+        spans = []
+        taken = set()
+        # the most similar first, ties by position
+        for similarity, start, num_words, begin_code in sorted(hits, key=lambda hit: (-hit[0], hit[1], hit[2])):
+            if taken.isdisjoint(range(start, start + num_words)):
+                taken.update(range(start, start + num_words))
+                spans.append((start, num_words, begin_code))
+        return sorted(spans)
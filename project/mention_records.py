@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class MentionRecords(object):
+    """
+    Candidate mentions as a struct of arrays: the publication_id, data_set_id and score of every mention
+    and the [start, end) span of its words in one array of word codes (the sentence column of the table
+    it was found in, not copied), 40 bytes a mention instead of a list of lists and str.
+    Iteration gives the (publication_id, data_set_id, mention, score) tuples ResultsStore.add_predictions() takes.
+    """
+    def __init__(self, word_codes, words, publication_ids, starts, ends, data_set_ids=None, scores=None, labelled=None):
+        self.word_codes = word_codes
+        self.words = words
+        # bool per word code, the words of a span that are part of its mention, all of them if None
+        self.labelled = labelled
+        self.publication_ids = np.asarray(publication_ids, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        num_mentions = len(self.publication_ids)
+        self.data_set_ids = np.zeros(num_mentions, dtype=np.int64) if data_set_ids is None else np.asarray(data_set_ids, dtype=np.int64)
+        self.scores = np.zeros(num_mentions, dtype=np.float64) if scores is None else np.asarray(scores, dtype=np.float64)
+
+    @classmethod
+    def from_labels(cls, table, word_field='sentence', label_field='label_sequence', inside_before_begin=False):
+        """
+        The mentions labeled in a SentenceTable, in the order of the table, as the stages read them one label at a time:
+        a run of labels that are not '_' is a mention from its first B on. With inside_before_begin, as the citation output
+        reads the tagged tables, the I labels before a B since the last mention of the row are words of the mention too.
+        Tagged tables label '_', 'B-<data_set_id>' and 'I' (the data_set_id of a mention is the one of its last B),
+        the ones the labeler wrote its 0, 2 (B) and 1 (I) predictions. Their score is 1.0.
+        """
+        names = table.names[label_field]
+        kinds = np.array([2 if name == 2 or (isinstance(name, str) and 'B' in name) else
+                          1 if name == 1 or name == 'I' else 0 for name in names], dtype=np.int8)
+        name_data_set_ids = np.array([int(name[2:]) if isinstance(name, str) and 'B' in name else 0 for name in names],
+                                     dtype=np.int64)
+        offsets = table.offsets[label_field]
+        codes = table.values[label_field]
+        labelled = kinds[codes] > 0
+        begins = np.flatnonzero(kinds[codes] == 2)
+        begin_rows = np.searchsorted(offsets, begins, side='right') - 1
+        # a mention ends at the first '_' after its B, or at the end of the row
+        unlabelled = np.flatnonzero(~labelled)
+        begin_ends = np.minimum(np.append(unlabelled, len(codes))[np.searchsorted(unlabelled, begins)],
+                                offsets[begin_rows + 1])
+        # the B before the end of a mention are all of it, the last one gives the data_set_id
+        last = np.ones(len(begins), dtype=bool)
+        last[:-1] = begin_ends[1:] != begin_ends[:-1]
+        ends, rows, last_begins = begin_ends[last], begin_rows[last], begins[last]
+        if inside_before_begin:
+            # from the end of the mention before it in the row, words taken only where labelled
+            starts = offsets[rows]
+            same_row = np.zeros(len(rows), dtype=bool)
+            same_row[1:] = rows[1:] == rows[:-1]
+            starts[same_row] = ends[:-1][same_row[1:]]
+        else:
+            # from the first B of the run, every word of it labelled
+            first = np.ones(len(begins), dtype=bool)
+            first[1:] = last[:-1]
+            starts = begins[first]
+            labelled = None
+        return cls(table.values[word_field], table.words, table.column('publication_id')[rows], starts, ends,
+                   data_set_ids=name_data_set_ids[codes[last_begins]], scores=np.ones(len(ends)), labelled=labelled)
+
+    @classmethod
+    def from_output_table(cls, table):
+        """
+        The mentions of a table of mention, publication_id, dataset_id and score rows (the model output), one a row.
+        """
+        offsets = table.offsets['mention']
+        return cls(table.values['mention'], table.words, table.column('publication_id'), offsets[:-1], offsets[1:],
+                   data_set_ids=table.column('dataset_id'), scores=table.column('score'))
+
+    def __len__(self):
+        return len(self.publication_ids)
+
+    def mention_words(self, i):
+        words = self.words
+        codes = self.word_codes[self.starts[i]:self.ends[i]]
+        if self.labelled is not None:
+            codes = codes[self.labelled[self.starts[i]:self.ends[i]]]
+        return [words[code] for code in codes.tolist()]
+
+    def mention(self, i):
+        return ' '.join(self.mention_words(i))
+
+    def publication_years(self, metadata_index):
+        """
+        :return: int64 year of the publication of every mention, each publication looked up once
+        """
+        publication_ids, inverse = np.unique(self.publication_ids, return_inverse=True)
+        years = np.array([metadata_index.pub_year(publication_id) for publication_id in publication_ids.tolist()],
+                         dtype=np.int64)
+        return years[inverse]
+
+    def __iter__(self):
+        for i, (publication_id, data_set_id, score) in enumerate(zip(
+                self.publication_ids.tolist(), self.data_set_ids.tolist(), self.scores.tolist())):
+            yield publication_id, data_set_id, self.mention(i), score
+
+    def rows(self):
+        """
+        The records as the rows of a mention, publication_id, dataset_id and score table.
+        """
+        for i, (publication_id, data_set_id, score) in enumerate(zip(
+                self.publication_ids.tolist(), self.data_set_ids.tolist(), self.scores.tolist())):
+            yield {'mention': self.mention_words(i),
+                   'publication_id': publication_id,
+                   'dataset_id': data_set_id,
+                   'score': score}
+
+    def nbytes(self):
+        return (self.publication_ids.nbytes + self.starts.nbytes + self.ends.nbytes
+                + self.data_set_ids.nbytes + self.scores.nbytes)
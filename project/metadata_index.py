@@ -0,0 +1,222 @@
+import argparse
+import logging
+import os
+import sqlite3
+
+from file_stamps import source_stamps
+from json_stream import iter_json_array
+from mention_dictionary import encode_date
+
+
+# bump whenever the tables change, it invalidates the built indexes
+INDEX_VERSION = 1
+# publications whose unique_identifier has 'bbk' have no pub_date, the stages take them as of this date
+BBK_DATE = '2019-01-01'
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE publications (
+    publication_id INTEGER PRIMARY KEY,
+    unique_identifier TEXT,
+    text_file_name TEXT,
+    title TEXT,
+    pub_date TEXT,
+    date_code INTEGER,
+    year INTEGER
+);
+CREATE TABLE data_sets (
+    data_set_id INTEGER PRIMARY KEY,
+    name TEXT,
+    date TEXT,
+    date_code INTEGER,
+    year INTEGER
+);
+'''
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='index publications.json and data_sets.json into the metadata index the stages look up')
+    parser.add_argument('--publications_json_path', type=str, default='../data/input/publications.json',
+                        help='publications.json path')
+    parser.add_argument('--data_sets_json_path', type=str, default='./formatted-data/data_sets.json',
+                        help='data_sets.json path')
+    parser.add_argument('--index_path', type=str, default='./formatted-data/metadata.sqlite',
+                        help='metadata index path')
+    args = parser.parse_args()
+    return args
+
+
+def publication_date(publication_info):
+    """
+    :return: the pub_date of a publication, None for the publications without one ('bbk' in the unique_identifier)
+    """
+    unique_identifier = publication_info.get( "unique_identifier", None ) # id가 bbk로 시작하면 pub_date은 None임
+    if 'bbk' in unique_identifier:
+        return None
+    return publication_info.get( "pub_date", None )
+
+
+def _publication_rows(publications_json_path):
+    for publication_info in iter_json_array(publications_json_path):
+        pub_date = publication_date(publication_info)
+        yield (publication_info.get( "publication_id", None ),
+               publication_info.get( "unique_identifier", None ),
+               publication_info.get( "text_file_name", None ),
+               publication_info.get( "title", None ),
+               pub_date,
+               None if pub_date is None else encode_date(pub_date),
+               None if pub_date is None else int(pub_date[:4]))
+
+
+def _data_set_rows(data_sets_json_path):
+    for data_set_info in iter_json_array(data_sets_json_path):
+        date = data_set_info.get( "date", None )
+        # as compile_data_sets() dates them
+        yield (data_set_info.get( "data_set_id", None ),
+               data_set_info.get( "name", None ),
+               date,
+               encode_date(date),
+               int(('1800-01-01' if 'None' in date else date)[:4]))
+
+
+class MetadataIndex(object):
+    """
+    Point lookups of publication and data set metadata in a sqlite index,
+    in place of the dictionaries every stage made of publications.json and data_sets.json.
+    Dates are the day numbers encode_date() gives, the years ints.
+    """
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self.connection.row_factory = sqlite3.Row
+        try:
+            self.meta = dict(self.connection.execute('SELECT key, value FROM meta').fetchall())
+        except sqlite3.DatabaseError:
+            raise ValueError("{} is not a metadata index".format(index_path))
+
+    def is_current(self, source_paths):
+        return (self.meta.get('index_version', None) == str(INDEX_VERSION)
+                and self.meta.get('sources', None) == source_stamps(source_paths))
+
+    def _get(self, query, key):
+        return self.connection.execute(query, (key,)).fetchone()
+
+    def publication(self, publication_id):
+        """
+        :return: the publication's row as a dict, None if it is not indexed
+        """
+        row = self._get('SELECT * FROM publications WHERE publication_id = ?', publication_id)
+        return None if row is None else dict(row)
+
+    def pub_date(self, publication_id, bbk_date=BBK_DATE):
+        """
+        :return: the encoded pub_date, bbk_date for the publications without one, None if it is not indexed
+        """
+        row = self._get('SELECT date_code FROM publications WHERE publication_id = ?', publication_id)
+        if row is None:
+            return None
+        return encode_date(bbk_date) if row[0] is None else row[0]
+
+    def pub_year(self, publication_id, bbk_date=BBK_DATE):
+        row = self._get('SELECT year FROM publications WHERE publication_id = ?', publication_id)
+        if row is None:
+            return None
+        return int(bbk_date[:4]) if row[0] is None else row[0]
+
+    def pub_dates(self, bbk_date=BBK_DATE):
+        """
+        :return: a view to pass where a publication_id -> encoded pub_date dict was taken
+        """
+        return PubDates(self, bbk_date)
+
+    def data_set(self, data_set_id):
+        row = self._get('SELECT * FROM data_sets WHERE data_set_id = ?', data_set_id)
+        return None if row is None else dict(row)
+
+    def data_set_year(self, data_set_id):
+        row = self._get('SELECT year FROM data_sets WHERE data_set_id = ?', data_set_id)
+        return None if row is None else row[0]
+
+    def data_set_years(self):
+        """
+        :return: data_set_id -> year string, as MentionDictionary.data_set_years() gives it
+        """
+        return {data_set_id: str(year) for data_set_id, year in self.connection.execute('SELECT data_set_id, year FROM data_sets')}
+
+    def num_publications(self):
+        return self.connection.execute('SELECT COUNT(*) FROM publications').fetchone()[0]
+
+    def num_data_sets(self):
+        return self.connection.execute('SELECT COUNT(*) FROM data_sets').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class PubDates(object):
+    """
+    publication_id -> encoded pub_date, each looked up in the index when it is asked for.
+    """
+    def __init__(self, metadata_index, bbk_date=BBK_DATE):
+        self.metadata_index = metadata_index
+        self.bbk_date = bbk_date
+
+    def __getitem__(self, publication_id):
+        pub_date = self.metadata_index.pub_date(publication_id, self.bbk_date)
+        if pub_date is None:
+            raise KeyError(publication_id)
+        return pub_date
+
+    def __contains__(self, publication_id):
+        return self.metadata_index.pub_date(publication_id, self.bbk_date) is not None
+
+
+def build_metadata_index(publications_json_path, data_sets_json_path, index_path):
+    logging.info("Indexing {} and {} into {}...".format(publications_json_path, data_sets_json_path, index_path))
+    if os.path.exists(index_path + '.tmp'):
+        os.remove(index_path + '.tmp')
+    connection = sqlite3.connect(index_path + '.tmp')
+    # a partial index is never renamed into place, no journal needed
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.executescript(SCHEMA)
+    with connection:
+        # the later record of an id wins, as it did in the dicts
+        connection.executemany('INSERT OR REPLACE INTO publications VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               _publication_rows(publications_json_path))
+        connection.executemany('INSERT OR REPLACE INTO data_sets VALUES (?, ?, ?, ?, ?)',
+                               _data_set_rows(data_sets_json_path))
+        connection.executemany('INSERT INTO meta VALUES (?, ?)', [
+            ('index_version', str(INDEX_VERSION)),
+            ('sources', source_stamps([publications_json_path, data_sets_json_path])),
+        ])
+    connection.close()
+    os.replace(index_path + '.tmp', index_path)
+    return MetadataIndex(index_path)
+
+
+def open_metadata_index(publications_json_path, data_sets_json_path, index_path):
+    """
+    The metadata index of publications_json_path and data_sets_json_path, indexed again first if it is missing
+    or was built from other files or changed ones.
+    """
+    if os.path.exists(index_path):
+        try:
+            metadata_index = MetadataIndex(index_path)
+        except ValueError:
+            metadata_index = None
+        if metadata_index is not None:
+            if metadata_index.is_current([publications_json_path, data_sets_json_path]):
+                return metadata_index
+            metadata_index.close()
+    return build_metadata_index(publications_json_path, data_sets_json_path, index_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    metadata_index = build_metadata_index(args.publications_json_path, args.data_sets_json_path, args.index_path)
+    logging.info("Indexed {} publications, {} data sets".format(
+        metadata_index.num_publications(), metadata_index.num_data_sets()))
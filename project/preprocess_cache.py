@@ -0,0 +1,95 @@
+import collections
+import hashlib
+import logging
+import os
+import zlib
+
+from tokenizer import TOKENIZER_VERSION
+from text_util import NORMALIZE_VERSION
+
+
+class PreprocessCache(object):
+    """
+    Content addressed on-disk cache of tokenized publications.
+    An entry is keyed by the sha1 of the normalizer/tokenizer version stamp and the raw bytes of the text file,
+    so a changed file or a new preprocessing version simply misses. Entries hold the filtered sentences,
+    one line of space separated tokens per sentence (tokens never contain whitespace), zlib compressed;
+    the chopped raw text is those lines joined by spaces.
+    When the cache grows over max_bytes the least recently used entries are evicted.
+    """
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version_stamp = 'normalize-{} tokenize-{}'.format(NORMALIZE_VERSION, TOKENIZER_VERSION).encode('ascii')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # entry name -> size, least recently used first
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        for entry in sorted(os.scandir(cache_dir), key=lambda entry: entry.stat().st_mtime):
+            if entry.is_file() and entry.name.endswith('.bin'):
+                self.entries[entry.name] = entry.stat().st_size
+                self.total_bytes += entry.stat().st_size
+        self._evict()
+
+    def key(self, text_bytes):
+        """
+        :param text_bytes: raw contents of the publication text file
+        """
+        digest = hashlib.sha1(self.version_stamp)
+        digest.update(text_bytes)
+        return digest.hexdigest() + '.bin'
+
+    def get(self, key):
+        """
+        :return: [sentences, chopped_raw_text] of the publication, None on a miss
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        entry_path = os.path.join(self.cache_dir, key)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                text = zlib.decompress(entry_file.read()).decode('utf-8')
+            os.utime(entry_path)
+        except (OSError, zlib.error):
+            # removed or truncated behind our back, preprocess the publication again
+            self.total_bytes -= self.entries.pop(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        lines = text.split('\n') if text else []
+        return [[line.split(' ') for line in lines], ' '.join(lines)]
+
+    def put(self, key, sentences):
+        data = zlib.compress('\n'.join([' '.join(words) for words in sentences]).encode('utf-8'))
+        entry_path = os.path.join(self.cache_dir, key)
+        # write then rename, so an interrupted run never leaves a partial entry behind
+        with open(entry_path + '.tmp', 'wb') as entry_file:
+            entry_file.write(data)
+        os.replace(entry_path + '.tmp', entry_path)
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)
+        self.entries[key] = len(data)
+        self.total_bytes += len(data)
+        self._evict()
+
+    def _evict(self):
+        # the most recently used entry is kept even if it alone is over the bound
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            evicted_key, size = self.entries.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.cache_dir, evicted_key))
+            except OSError:
+                pass
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def log_stats(self):
+        lookups = self.hits + self.misses
+        logging.info("Preprocess cache: {} hits, {} misses ({:.1f}% hit rate), {} evicted, {} entries, {:.1f} MB".format(
+            self.hits, self.misses, 100.0 * self.hits / lookups if lookups else 0.0, self.evictions,
+            len(self.entries), self.total_bytes / 1024 ** 2))
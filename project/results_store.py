@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import sqlite3
+
+from json_output import OUTPUT_FORMATS, JsonWriter, output_file_path
+
+
+# bump whenever the tables change
+STORE_VERSION = 2
+
+# the rows keep the insertion order (rowid), the outputs are exported in the order the results were first found
+# model scores are kept raw, their sum and their best, and normalized by the best one of the store when exported
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS citations (
+    publication_id INTEGER NOT NULL,
+    data_set_id INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    model_score_sum REAL NOT NULL,
+    model_score_max REAL NOT NULL,
+    score_count INTEGER NOT NULL,
+    UNIQUE (publication_id, data_set_id)
+);
+CREATE INDEX IF NOT EXISTS citations_data_set_id ON citations (data_set_id);
+CREATE TABLE IF NOT EXISTS citation_mentions (
+    publication_id INTEGER NOT NULL,
+    data_set_id INTEGER NOT NULL,
+    mention TEXT NOT NULL,
+    UNIQUE (publication_id, data_set_id, mention)
+);
+CREATE TABLE IF NOT EXISTS mentions (
+    publication_id INTEGER NOT NULL,
+    mention TEXT NOT NULL,
+    score_sum REAL NOT NULL,
+    model_score_sum REAL NOT NULL,
+    model_score_max REAL NOT NULL,
+    score_count INTEGER NOT NULL,
+    UNIQUE (publication_id, mention)
+);
+CREATE TABLE IF NOT EXISTS fields (
+    publication_id INTEGER NOT NULL UNIQUE,
+    research_field TEXT,
+    score REAL
+);
+CREATE TABLE IF NOT EXISTS methods (
+    publication_id INTEGER NOT NULL UNIQUE,
+    method TEXT,
+    score REAL
+);
+'''
+CITATION_TABLES = ('citations', 'citation_mentions', 'mentions')
+FIELD_METHOD_TABLES = ('fields', 'methods')
+
+# output file name of every exported table
+OUTPUT_FILE_NAMES = {
+    'citations': 'data_set_citations.json',
+    'mentions': 'data_set_mentions.json',
+    'fields': 'research_fields.json',
+    'methods': 'methods.json',
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='export the output files from the results store, or query it')
+    parser.add_argument('--store_path', type=str, default='./formatted-data/results.sqlite',
+                        help='results store path')
+    parser.add_argument('--output_path', type=str, default='../data/output/',
+                        help='directory the output files are exported to')
+    parser.add_argument('--output_format', type=str, default='json', choices=OUTPUT_FORMATS,
+                        help='json writes JSON arrays, jsonl JSON Lines files with a .jsonl extension (default: json)')
+    parser.add_argument('--compact', action='store_true',
+                        help='write the outputs without indentation')
+    parser.add_argument('--publication_id', type=int, default=None,
+                        help='print the results of this publication instead of exporting')
+    parser.add_argument('--data_set_id', type=int, default=None,
+                        help='print the citations of this data set instead of exporting')
+    args = parser.parse_args()
+    return args
+
+
+class ResultsStore(object):
+    """
+    The citations, mentions, research fields and methods found, in a sqlite store.
+    Citations and mentions keep the sum and the count of the scores of their predictions,
+    so predictions are added (upserted) to what is stored and the score is their mean.
+    The scores of the model predictions are raw, divided by the best model score of the store when read,
+    so results merged from several runs are on the scale of a run over all of them.
+    The records the queries and exports give are the ones of the output files.
+    """
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.connection = sqlite3.connect(store_path)
+        try:
+            self.connection.executescript(SCHEMA)
+        except sqlite3.DatabaseError:
+            raise ValueError("{} is not a results store".format(store_path))
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('store_version', str(STORE_VERSION)))
+        version = self.connection.execute("SELECT value FROM meta WHERE key = 'store_version'").fetchone()[0]
+        if version != str(STORE_VERSION):
+            raise ValueError("{} is a results store of another version, remove it to make it again".format(store_path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def clear(self, tables):
+        with self.connection:
+            for table in tables:
+                self.connection.execute('DELETE FROM {}'.format(table))
+
+    def delete_publications(self, publication_ids, tables):
+        """
+        Drop the results of the publications, e.g. before the new predictions of the publications processed again are added.
+        """
+        publication_ids = [(publication_id,) for publication_id in publication_ids]
+        with self.connection:
+            for table in tables:
+                self.connection.executemany('DELETE FROM {} WHERE publication_id = ?'.format(table), publication_ids)
+
+    def replace_publications(self, other_store_path, publication_ids):
+        """
+        Drop the results of the publications and append every result of another store, in its order,
+        e.g. the store of the publications an incremental run processed again.
+        """
+        tables = CITATION_TABLES + FIELD_METHOD_TABLES
+        self.delete_publications(publication_ids, tables)
+        self.connection.execute('ATTACH DATABASE ? AS other', (other_store_path,))
+        try:
+            with self.connection:
+                for table in tables:
+                    self.connection.execute('INSERT INTO {0} SELECT * FROM other.{0} ORDER BY rowid'.format(table))
+        finally:
+            self.connection.execute('DETACH DATABASE other')
+
+    def _upsert(self, update, insert, update_parameters, insert_parameters):
+        # UPDATE then INSERT when no row matched: ON CONFLICT upserts need sqlite 3.24, Ubuntu 16.04 ships 3.11
+        if self.connection.execute(update, update_parameters).rowcount == 0:
+            self.connection.execute(insert, insert_parameters)
+
+    def add_predictions(self, predictions, model_scores=False):
+        """
+        :param predictions: iterable of (publication_id, data_set_id, mention, score), a prediction of a mention citing a data set
+        :param model_scores: the scores are the raw scores of the model, not normalized
+        """
+        with self.connection:
+            for publication_id, data_set_id, mention, score in predictions:
+                scores = (0.0, score, score) if model_scores else (score, 0.0, 0.0)
+                self._upsert('UPDATE citations SET score_sum = score_sum + ?, model_score_sum = model_score_sum + ?, '
+                             'model_score_max = MAX(model_score_max, ?), score_count = score_count + 1 '
+                             'WHERE publication_id = ? AND data_set_id = ?',
+                             'INSERT INTO citations VALUES (?, ?, ?, ?, ?, 1)',
+                             scores + (publication_id, data_set_id), (publication_id, data_set_id) + scores)
+                self.connection.execute('INSERT OR IGNORE INTO citation_mentions VALUES (?, ?, ?)',
+                                        (publication_id, data_set_id, mention))
+                self._upsert('UPDATE mentions SET score_sum = score_sum + ?, model_score_sum = model_score_sum + ?, '
+                             'model_score_max = MAX(model_score_max, ?), score_count = score_count + 1 '
+                             'WHERE publication_id = ? AND mention = ?',
+                             'INSERT INTO mentions VALUES (?, ?, ?, ?, ?, 1)',
+                             scores + (publication_id, mention), (publication_id, mention) + scores)
+
+    def set_field(self, publication_id, research_field, score):
+        with self.connection:
+            self._upsert('UPDATE fields SET research_field = ?, score = ? WHERE publication_id = ?',
+                         'INSERT INTO fields VALUES (?, ?, ?)',
+                         (research_field, score, publication_id), (publication_id, research_field, score))
+
+    def set_method(self, publication_id, method, score):
+        with self.connection:
+            self._upsert('UPDATE methods SET method = ?, score = ? WHERE publication_id = ?',
+                         'INSERT INTO methods VALUES (?, ?, ?)',
+                         (method, score, publication_id), (publication_id, method, score))
+
+    def best_model_score(self):
+        """
+        :return: the best raw model score of the store, the one the model scores are divided by; 1.0 without any
+        """
+        best, = self.connection.execute('SELECT MAX(model_score_max) FROM citations').fetchone()
+        return best or 1.0
+
+    def _scores(self, table, where, parameters, columns):
+        best = self.best_model_score()
+        cursor = self.connection.execute(
+            'SELECT {}, score_sum, model_score_sum, score_count FROM {} {} ORDER BY rowid'.format(columns, table, where),
+            parameters)
+        for row in cursor:
+            score_sum, model_score_sum, score_count = row[-3:]
+            yield row[:-3] + (round((score_sum + model_score_sum / best) / score_count, 3),)
+
+    def _citation_records(self, where='', parameters=()):
+        for publication_id, data_set_id, score in self._scores('citations', where, parameters, 'publication_id, data_set_id'):
+            mention_list = [mention for mention, in self.connection.execute(
+                'SELECT mention FROM citation_mentions WHERE publication_id = ? AND data_set_id = ? ORDER BY rowid',
+                (publication_id, data_set_id))]
+            yield {'publication_id': publication_id,
+                   'data_set_id': data_set_id,
+                   'mention_list': mention_list,
+                   'score': score}
+
+    def citations(self, publication_id=None, data_set_id=None):
+        """
+        :return: the data_set_citations.json records, of a publication or of a data set only if given
+        """
+        if publication_id is not None:
+            return self._citation_records('WHERE publication_id = ?', (publication_id,))
+        if data_set_id is not None:
+            return self._citation_records('WHERE data_set_id = ?', (data_set_id,))
+        return self._citation_records()
+
+    def mentions(self, publication_id=None):
+        """
+        :return: the data_set_mentions.json records, of a publication only if given
+        """
+        where, parameters = ('WHERE publication_id = ?', (publication_id,)) if publication_id is not None else ('', ())
+        for publication_id, mention, score in self._scores('mentions', where, parameters, 'publication_id, mention'):
+            yield {'publication_id': publication_id,
+                   'mention': mention,
+                   'score': score}
+
+    def publications_citing(self, data_set_id):
+        return [publication_id for publication_id, in self.connection.execute(
+            'SELECT publication_id FROM citations WHERE data_set_id = ? ORDER BY rowid', (data_set_id,))]
+
+    def _field_method_records(self, table, name, publication_id):
+        where, parameters = ('WHERE publication_id = ?', (publication_id,)) if publication_id is not None else ('', ())
+        cursor = self.connection.execute(
+            'SELECT publication_id, {}, score FROM {} {} ORDER BY rowid'.format(name, table, where), parameters)
+        for publication_id, value, score in cursor:
+            yield {'publication_id': publication_id, name: value, 'score': score}
+
+    def fields(self, publication_id=None):
+        return self._field_method_records('fields', 'research_field', publication_id)
+
+    def methods(self, publication_id=None):
+        return self._field_method_records('methods', 'method', publication_id)
+
+    def export(self, table, path, output_format='json', compact=False):
+        """
+        Write the records of a table (citations, mentions, fields or methods) into its output file.
+        :return: the path written
+        """
+        path = output_file_path(path, output_format)
+        with JsonWriter(path, output_format, compact) as outfile:
+            outfile.write_all(getattr(self, table)())
+        logging.info("Exported {} {} records into {}".format(outfile.num_records, table, path))
+        return path
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    with ResultsStore(args.store_path) as store:
+        if args.publication_id is not None:
+            for table in OUTPUT_FILE_NAMES:
+                for record in getattr(store, table)(args.publication_id):
+                    print(json.dumps(record))
+        elif args.data_set_id is not None:
+            for record in store.citations(data_set_id=args.data_set_id):
+                print(json.dumps(record))
+        else:
+            for table, output_file_name in OUTPUT_FILE_NAMES.items():
+                store.export(table, args.output_path + output_file_name, args.output_format, args.compact)
@@ -0,0 +1,238 @@
+import argparse
+import array
+import ast
+import csv
+import json
+import logging
+import mmap
+import os
+
+import numpy as np
+
+
+# bump whenever the file layout changes
+TABLE_VERSION = 1
+MAGIC = b'RCCTABLE'
+
+# how the columns of the intermediate files are stored, by name:
+# int and float are int64 / float64 per row, category an int32 code per row into names kept in the header,
+# words and labels int32 codes per token with int64 row offsets, into the word vocabulary / names kept in the header
+COLUMN_KINDS = {
+    'publication_id': 'int',
+    'dataset_id': 'int',
+    'score': 'float',
+    'labeled': 'category',
+    'sentence': 'words',
+    'mention': 'words',
+    'label_sequence': 'labels',
+}
+SEQUENCE_KINDS = ('words', 'labels')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='convert an intermediate csv file (python list reprs in its cells) into a sentence table')
+    parser.add_argument('--csv_path', type=str, required=True,
+                        help='csv file written by an earlier version of the stages, e.g. ./formatted-data/rcc_corpus_test.csv')
+    parser.add_argument('--table_path', type=str, default='',
+                        help='sentence table path (default: the csv path with a .tbl extension)')
+    args = parser.parse_args()
+    return args
+
+
+class TableWriter(object):
+    """
+    Writes the rows of an intermediate file, the dicts a csv.DictWriter of the same fieldnames would take,
+    into a sentence table once closed. Words and labels are interned while appending.
+    A labels column given names takes int arrays of codes into them too, mapped to the table codes as arrays.
+    """
+    def __init__(self, table_path, fieldnames, names=None):
+        self.table_path = table_path
+        self.fieldnames = list(fieldnames)
+        self.kinds = [COLUMN_KINDS[fieldname] for fieldname in self.fieldnames]
+        self.num_rows = 0
+        self.word_ids = dict()
+        self.name_ids = {fieldname: dict() for fieldname, kind in zip(self.fieldnames, self.kinds)
+                         if kind in ('category', 'labels')}
+        # table code of every code of the names given, per labels column
+        self.code_ids = {fieldname: np.array([self.name_ids[fieldname].setdefault(name, len(self.name_ids[fieldname]))
+                                              for name in column_names], dtype=np.int32)
+                         for fieldname, column_names in (names or dict()).items()}
+        self.values = []
+        self.offsets = []
+        for kind in self.kinds:
+            self.values.append(array.array({'int': 'q', 'float': 'd'}.get(kind, 'i')))
+            self.offsets.append(array.array('q', [0]) if kind in SEQUENCE_KINDS else None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def append(self, row):
+        for fieldname, kind, values, offsets in zip(self.fieldnames, self.kinds, self.values, self.offsets):
+            value = row[fieldname]
+            if kind == 'words':
+                ids = self.word_ids
+                values.extend([ids.setdefault(word, len(ids)) for word in value])
+            elif kind == 'labels' and isinstance(value, np.ndarray):
+                values.frombytes(self.code_ids[fieldname][value].tobytes())
+            elif kind == 'labels':
+                ids = self.name_ids[fieldname]
+                values.extend([ids.setdefault(label, len(ids)) for label in value])
+            elif kind == 'category':
+                ids = self.name_ids[fieldname]
+                values.append(ids.setdefault(value, len(ids)))
+            else:
+                values.append(value)
+            if offsets is not None:
+                offsets.append(len(values))
+        self.num_rows += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def close(self):
+        """
+        Layout: MAGIC, the int64 header length and the json header (counts, columns and their names),
+        then every column, the int64 row offsets first for words and labels, and the words, '\n' separated utf-8.
+        Every array starts 8 byte aligned.
+        """
+        header = {
+            'table_version': TABLE_VERSION,
+            'num_rows': self.num_rows,
+            'num_words': len(self.word_ids),
+            'columns': [[fieldname, kind, len(values)]
+                        for fieldname, kind, values in zip(self.fieldnames, self.kinds, self.values)],
+            'names': {fieldname: list(ids) for fieldname, ids in self.name_ids.items()},
+        }
+        header = json.dumps(header).encode('utf-8')
+        header += b' ' * (-len(header) % 8)
+        with open(self.table_path + '.tmp', 'wb') as table_file:
+            table_file.write(MAGIC)
+            array.array('q', [len(header)]).tofile(table_file)
+            table_file.write(header)
+            for values, offsets in zip(self.values, self.offsets):
+                if offsets is not None:
+                    offsets.tofile(table_file)
+                values.tofile(table_file)
+                table_file.write(b'\0' * (-len(values) * values.itemsize % 8))
+            # tokens never contain whitespace
+            table_file.write('\n'.join(self.word_ids).encode('utf-8'))
+        # write then rename, a stage reading the table never sees a partial one
+        os.replace(self.table_path + '.tmp', self.table_path)
+
+
+def write_table(table_path, fieldnames, rows, names=None):
+    with TableWriter(table_path, fieldnames, names) as writer:
+        writer.extend(rows)
+
+
+class SentenceTable(object):
+    """
+    Read-only view of a sentence table, memory-mapped. The columns are numpy arrays over the mapping:
+    codes() gives the int32 codes of a row of a words or labels column without decoding anything,
+    row() and iteration give the rows as the dicts they were written from.
+    """
+    def __init__(self, table_path):
+        with open(table_path, 'rb') as table_file:
+            self.data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a sentence table".format(table_path))
+        header_length = int(np.frombuffer(self.data, dtype=np.int64, count=1, offset=8)[0])
+        self.header = json.loads(str(self.data[16:16 + header_length], 'utf-8'))
+        if self.header['table_version'] != TABLE_VERSION:
+            raise ValueError("{} is a sentence table of another version, convert or write it again".format(table_path))
+        self.num_rows = self.header['num_rows']
+        self.fieldnames = []
+        self.kinds = dict()
+        self.offsets = dict()
+        self.values = dict()
+        start = 16 + header_length
+        for fieldname, kind, length in self.header['columns']:
+            self.fieldnames.append(fieldname)
+            self.kinds[fieldname] = kind
+            if kind in SEQUENCE_KINDS:
+                self.offsets[fieldname] = np.frombuffer(self.data, dtype=np.int64, count=self.num_rows + 1, offset=start)
+                start += 8 * (self.num_rows + 1)
+            dtype = {'int': np.int64, 'float': np.float64}.get(kind, np.int32)
+            self.values[fieldname] = np.frombuffer(self.data, dtype=dtype, count=length, offset=start)
+            start += length * np.dtype(dtype).itemsize
+            start += -start % 8
+        self.names = self.header['names']
+        blob = str(self.data[start:], 'utf-8')
+        self.words = blob.split('\n') if self.header['num_words'] else []
+
+    def __len__(self):
+        return self.num_rows
+
+    def codes(self, fieldname, i):
+        offsets = self.offsets[fieldname]
+        return self.values[fieldname][offsets[i]:offsets[i + 1]]
+
+    def column(self, fieldname):
+        """
+        :return: the values of an int, float or category column for every row, a words or labels column as its codes
+        """
+        if self.kinds[fieldname] == 'category':
+            names = self.names[fieldname]
+            return [names[code] for code in self.values[fieldname].tolist()]
+        return self.values[fieldname]
+
+    def _decoders(self):
+        decoders = []
+        for fieldname in self.fieldnames:
+            kind = self.kinds[fieldname]
+            names = self.words if kind == 'words' else self.names.get(fieldname, None)
+            decoders.append((fieldname, kind, self.values[fieldname], self.offsets.get(fieldname, None), names))
+        return decoders
+
+    @staticmethod
+    def _decode(decoders, i):
+        row = dict()
+        for fieldname, kind, values, offsets, names in decoders:
+            if offsets is not None:
+                row[fieldname] = [names[code] for code in values[offsets[i]:offsets[i + 1]].tolist()]
+            elif names is not None:
+                row[fieldname] = names[values[i]]
+            else:
+                row[fieldname] = values[i].item()
+        return row
+
+    def row(self, i):
+        return self._decode(self._decoders(), i)
+
+    def __getitem__(self, i):
+        return self.row(i)
+
+    def __iter__(self):
+        decoders = self._decoders()
+        for i in range(self.num_rows):
+            yield self._decode(decoders, i)
+
+
+def convert_csv(csv_path, table_path):
+    """
+    Write the rows of an intermediate csv file of an earlier version (python list reprs in its cells) into a table.
+    """
+    with open(csv_path) as f:
+        lines = csv.reader(f)
+        fieldnames = next(lines)
+        parsers = [{'int': int, 'float': float, 'category': str}.get(COLUMN_KINDS[fieldname], ast.literal_eval)
+                   for fieldname in fieldnames]
+        write_table(table_path, fieldnames,
+                    ({fieldname: parse(value) for fieldname, parse, value in zip(fieldnames, parsers, line)}
+                     for line in lines))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    table_path = args.table_path or os.path.splitext(args.csv_path)[0] + '.tbl'
+    logging.info("Converting {} into {}...".format(args.csv_path, table_path))
+    convert_csv(args.csv_path, table_path)
+    logging.info("Converted {} rows".format(len(SentenceTable(table_path))))
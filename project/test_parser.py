@@ -1,8 +1,13 @@
-from util import list_to_string, split_into_sentences, normalize_string, label_substring, encode, encode_test, extract_formatted_data, extract_formatted_data_test
+from text_util import list_to_string, split_into_sentences, normalize_string, label_substring, encode, encode_test, extract_formatted_data, extract_formatted_data_test, iter_tokenized_publications
+from preprocess_cache import PreprocessCache
+from mention_dictionary import load_mention_dictionary
+from mention_index import MentionAutomaton
+from sentence_table import SentenceTable, TableWriter, write_table
+from json_stream import iter_json_array
+from metadata_index import open_metadata_index
 import codecs
 import json
-import nltk
-from nltk.tokenize import word_tokenize
+from tokenizer import word_tokenize, ensure_nltk_data
 import re
 import csv
 import unicodedata
@@ -11,13 +16,14 @@ import pickle
 import argparse
 import logging
 import ast
+import collections
 import itertools
+import os
+import subprocess
+import sys
 
-from sklearn.model_selection import train_test_split
 from collections import Counter
 
-nltk.download('popular')
-
 def get_args():
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('--publication_txt_path_prefix', type=str, default='../data/input/files/text/',
@@ -26,117 +32,188 @@ def get_args():
                         help='test data path')
     parser.add_argument('--data_sets_json_path', type=str, default='./formatted-data/data_sets.json',
                         help='test data path')
-    parser.add_argument('--output_filename', type=str, default='rcc_corpus_test.csv',
+    parser.add_argument('--mention_dictionary', type=str, default='./formatted-data/mention_dictionary.bin',
+                        help='compiled mention dictionary, compiled from data_sets.json first if missing or out of date')
+    parser.add_argument('--metadata_index', type=str, default='./formatted-data/metadata.sqlite',
+                        help='publication and data set metadata index, indexed from the json files first if missing or out of date')
+    parser.add_argument('--fuzzy_threshold', type=float, default=0,
+                        help='label sentences without exact mentions by fuzzy matches at least this similar (cosine of '
+                             'character trigrams, e.g. 0.8) instead of leaving them to the labeling model, 0 to disable (default: 0)')
+    parser.add_argument('--output_filename', type=str, default='rcc_corpus_test.tbl',
                         help='ratio of labeled data')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes tokenizing publications (default: 1)')
+    parser.add_argument('--cache_dir', type=str, default='./formatted-data/preprocess-cache/',
+                        help='tokenized publication cache directory, empty to disable the cache')
+    parser.add_argument('--cache_max_mb', type=int, default=2048,
+                        help='size bound of the tokenized publication cache in MB (default: 2048)')
+    parser.add_argument('--corpus_store', type=str, default='',
+                        help='packed corpus store (see corpus_store.py) to read the texts from, the ones added since it was packed from their text files')
+    parser.add_argument('--rescan_new_data_sets', action='store_true',
+                        help='only tag the data sets the output table was not tagged with yet, patch the publications they '
+                             'occur in and run inference.py on them and make_citation_output.py again, instead of tagging everything')
+    parser.add_argument('--unordered_output_path', type=str, default='./formatted-data/model_output_mentions.tbl',
+                        help='model output of the output table, the rescan replaces the rows of the publications it patches')
     args = parser.parse_args()
     return args
 
 
-def test_set_parser(publication_txt_path_prefix, publications_json_path, data_sets_json_path, output_filename):
-    data_set_mention_info = []
-    pub_date_dict = dict()
-    logging.info("Loading data_sets.json file...")
-    # open the publications.json file
-    with open(data_sets_json_path) as json_data_sets:
-        # parse it as JSON
-        data_sets = json.load(json_data_sets)
-        # loop
-        for data_set_info in tqdm(data_sets, total=len(data_sets)):
-            data_set_id = data_set_info.get( "data_set_id", None )
-            name = data_set_info.get( "name", None )
-            name.encode('ascii','ignore')
-            date = data_set_info.get( "date", None )
-            date.encode('ascii','ignore')
-            date = date[:10]
-            if 'None' in date:
-                date = '1800-01-01'
-            date = int(date[:4]) * 12 * 31 + int(date[5:7]) * 31 + int(date[8:10])
-            mention_list = data_set_info.get( "mention_list", None )
-            formatted_mention_list = []
-            name = normalize_string(name)
-            name_words = word_tokenize(name)
-            formatted_mention_list.append([name_words, list_to_string((name_words))])
-            for mention in mention_list:
-                mention.encode('ascii','ignore')
-                mention = normalize_string(mention).strip()
-                mention = re.sub("\s\s+", " ", mention)
-                if all(c.islower() for c in mention) and len(mention.split()) <= 2:
-                    continue    # to avoid pronoun mentions like 'data', 'time'
-                sentences = split_into_sentences(mention)
-                words = []
-                for sentence in sentences:
-                    words += word_tokenize(sentence)
-                words = [w for w in words if len(w)<15]
-                if len(words) > 0  and len(words) <= 30:
-                    formatted_mention_list.append([words, list_to_string(words)])
-            data_set_mention_info.append([date, data_set_id, formatted_mention_list])
-    data_set_mention_info.sort(key=lambda x: int(x[0]), reverse=True)
+def read_data_sets(data_sets_json_path, dictionary_path):
+    """
+    :return: [date, data_set_id, [[mention_words, raw_mention]]] of every data set, the newest first,
+    from the compiled mention dictionary of data_sets.json (see mention_dictionary.py)
+    """
+    logging.info("Loading mention dictionary...")
+    return load_mention_dictionary(data_sets_json_path, dictionary_path).data_set_mention_info(max_mention_words=30)
+
+
+def tagged_data_sets_path(output_filepath):
+    # ids of the data sets an output table was tagged with, next to it
+    return output_filepath + '.data_sets.json'
+
+
+def write_tagged_data_sets(output_filepath, data_set_mention_info):
+    with open(tagged_data_sets_path(output_filepath) + '.tmp', 'w') as outfile:
+        json.dump([data_set_id for _, data_set_id, _ in data_set_mention_info], outfile)
+    os.replace(tagged_data_sets_path(output_filepath) + '.tmp', tagged_data_sets_path(output_filepath))
+
+
+# intermediate files of the publications a rescan patches
+RESCAN_PATH = './formatted-data/rescan/'
+
+FIELDNAMES = [
+    'publication_id',
+    'sentence',
+    'label_sequence',
+    'labeled']
+
+
+def test_set_parser(publication_txt_path_prefix, publications_json_path, data_sets_json_path, output_filename, workers=1,
+                    cache=None, store_path=None, dictionary_path='./formatted-data/mention_dictionary.bin', fuzzy_threshold=0,
+                    metadata_index_path='./formatted-data/metadata.sqlite'):
+    data_set_mention_info = read_data_sets(data_sets_json_path, dictionary_path)
     # set prefix to formatted publication txt files
     formatted_txt_path_prefix = "./formatted-data/"
-    # set path to publications.json
-    formatted_publications = dict()
-    logging.info("Tokenizing publications.json file...")
-    # open the publications.json file
-    with open(publications_json_path) as json_publication_file:
-        # parse it as JSON
-        publication_list = json.load(json_publication_file)
-        # loop over the elements in the list
-        for publication_info in tqdm(publication_list, total=len(publication_list)):
-            # get information on publication:
-            publication_id = publication_info.get( "publication_id", None )
-            title = publication_info.get( "title", None )
-            title.encode('ascii','ignore')
-            text_file_name = publication_info.get( "text_file_name", None )
-            unique_identifier = publication_info.get( "unique_identifier", None ) # id가 bbk로 시작하면 pub_date은 None임
-            if 'bbk' not in unique_identifier:
-                pub_date = publication_info.get( "pub_date", None )
-            else:
-                pub_date = '2019-01-01'
-            pub_date.encode('ascii', 'ignore')
-            pub_date = int(pub_date[:4]) * 12 * 31 + int(pub_date[5:7]) * 31 + int(pub_date[8:10])
-            # get raw text
-            raw_text = ''
-            txt_file_path = publication_txt_path_prefix + text_file_name
-            with open(txt_file_path) as txt_file:
-                for line in txt_file:
-                    stripped_line = line.strip()
-                    raw_text += ' ' + stripped_line
-                    if len(stripped_line.split()) <= 5:
-                        raw_text += '<stop>'    # marking for sentence boundary in split_into_sentences() function
-            raw_text.encode('ascii','ignore')
-            raw_text = normalize_string(raw_text)
-            # add to formatted_publications dictionary
-            formatted_text_list = []
-            chopped_raw_text = ''
-            sentences = split_into_sentences(raw_text)
-            for sentence in sentences:
-                words = word_tokenize(sentence)
-                words = [w for w in words if len(w)<15]
-                if len(words) >= 10 and len(words) <= 30:
-                    formatted_text_list.append(words)
-                    chopped_raw_text += ' ' + list_to_string(words)
-            formatted_publications[publication_id] = [formatted_text_list, chopped_raw_text.strip()]
-            pub_date_dict[publication_id] = pub_date
-    # tag mentions in publication text and write in csv file
+    pub_date_dict = open_metadata_index(publications_json_path, data_sets_json_path, metadata_index_path).pub_dates()
+    # the publications.json file is read as the publications are tokenized
+    publication_list = iter_json_array(publications_json_path)
+    # tag mentions in publication text and write in a sentence table
     output_filepath = formatted_txt_path_prefix + output_filename
-    with open(output_filepath, 'w') as csvfile:
-        fieldnames = [
-            'publication_id',
-            'sentence',
-            'label_sequence',
-            'labeled']
-        writer = csv.DictWriter(
-            csvfile,
-            fieldnames=fieldnames,
-            quoting=csv.QUOTE_ALL)
-        writer.writeheader()
-        logging.info("Tagging pre-found dataset mentions in publications...")
-        output = extract_formatted_data_test(formatted_publications, data_set_mention_info, pub_date_dict)
-        logging.info("Writing on new csv file...")
-        writer.writerows(output)
-
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s %(message)s',
-                    datefmt='%m-%d %H:%M')
-args = get_args()
-test_set_parser(args.publication_txt_path_prefix, args.publications_json_path, args.data_sets_json_path, args.output_filename)
+    logging.info("Tokenizing publications and tagging pre-found dataset mentions...")
+    formatted_publications = tqdm(iter_tokenized_publications(publication_list, publication_txt_path_prefix, workers,
+                                                              cache=cache, store_path=store_path),
+                                  unit='publications')
+    output, label_names = extract_formatted_data_test(formatted_publications, data_set_mention_info, pub_date_dict,
+                                                      fuzzy_threshold)
+    logging.info("Writing on new table...")
+    write_table(output_filepath, FIELDNAMES, output, names={'label_sequence': label_names})
+    write_tagged_data_sets(output_filepath, data_set_mention_info)
+    if cache is not None:
+        cache.log_stats()
+
+
+def patch_table(output_filepath, output, label_names):
+    """
+    Replace the rows of the publications of output (labeled with codes into label_names) in the table,
+    in place of their old rows.
+    """
+    patched_rows = collections.defaultdict(list)
+    for row in output:
+        patched_rows[row['publication_id']].append(row)
+    with TableWriter(output_filepath, FIELDNAMES, names={'label_sequence': label_names}) as writer:
+        for row in SentenceTable(output_filepath):
+            rows = patched_rows.get(row['publication_id'], None)
+            if rows is None:
+                writer.append(row)
+            elif rows:
+                writer.extend(rows)
+                rows.clear()    # the other old rows of the publication are dropped
+
+
+def patch_model_output(unordered_output_path, patched_output_path, publication_ids):
+    """
+    Replace the model output rows of the publications with the ones inference.py wrote for them into patched_output_path.
+    """
+    table = SentenceTable(unordered_output_path)
+    with TableWriter(unordered_output_path, table.fieldnames) as writer:
+        writer.extend(row for row in table if row['publication_id'] not in publication_ids)
+        writer.extend(SentenceTable(patched_output_path))
+
+
+def rescan_automata(data_set_mention_info, tagged_ids):
+    """
+    The automaton of the data sets not in tagged_ids, scanning for the publications to tag again, and the one tagging
+    them with every data set, built as a full run builds it so data sets of a date merge in the data_sets.json order.
+    """
+    new_data_sets = [data_set for data_set in data_set_mention_info if data_set[1] not in tagged_ids]
+    return MentionAutomaton(new_data_sets), MentionAutomaton(data_set_mention_info)
+
+
+def rescan_new_data_sets(publication_txt_path_prefix, publications_json_path, data_sets_json_path, output_filename,
+                         workers=1, cache=None, store_path=None, dictionary_path='./formatted-data/mention_dictionary.bin',
+                         fuzzy_threshold=0, metadata_index_path='./formatted-data/metadata.sqlite',
+                         unordered_output_path='./formatted-data/model_output_mentions.tbl'):
+    """
+    Tag the data sets added to data_sets.json since the output table was written without tagging everything again:
+    the publications (tokenized by the cache) are scanned for the mentions of the new data sets only, the ones they
+    occur in are tagged again with every data set and their rows patched in the table, inference.py labels their
+    sentences left unlabeled again (its rows of the sentences labeled now would count twice) and the citation outputs
+    are made again. Fuzzy matches of the new data sets are only looked for in the publications patched.
+    """
+    output_filepath = "./formatted-data/" + output_filename
+    if not os.path.exists(tagged_data_sets_path(output_filepath)):
+        raise ValueError("{} was not written by test_parser.py, run it without --rescan_new_data_sets".format(output_filepath))
+    with open(tagged_data_sets_path(output_filepath)) as json_tagged_data_sets:
+        tagged_ids = set(json.load(json_tagged_data_sets))
+    data_set_mention_info = read_data_sets(data_sets_json_path, dictionary_path)
+    new_data_sets = [data_set for data_set in data_set_mention_info if data_set[1] not in tagged_ids]
+    logging.info("{} new data sets".format(len(new_data_sets)))
+    if not new_data_sets:
+        return
+    pub_date_dict = open_metadata_index(publications_json_path, data_sets_json_path, metadata_index_path).pub_dates()
+    publication_list = iter_json_array(publications_json_path)
+    logging.info("Scanning publications for the new data sets...")
+    scan_automaton, mention_automaton = rescan_automata(data_set_mention_info, tagged_ids)
+    patched_publications = []
+    for publication_id, [sentences, raw_text] in tqdm(iter_tokenized_publications(publication_list, publication_txt_path_prefix,
+                                                                                 workers, cache=cache, store_path=store_path),
+                                                      unit='publications'):
+        if scan_automaton.occurs(raw_text, pub_date_dict[publication_id]):
+            patched_publications.append((publication_id, [sentences, raw_text]))
+    logging.info("Tagging the {} publications they occur in again...".format(len(patched_publications)))
+    output, label_names = extract_formatted_data_test(patched_publications, data_set_mention_info, pub_date_dict,
+                                                      fuzzy_threshold, mention_automaton)
+    patch_table(output_filepath, output, label_names)
+    if patched_publications:
+        logging.info("Running inference.py on them...")
+        os.makedirs(RESCAN_PATH, exist_ok=True)
+        write_table(RESCAN_PATH + 'rcc_corpus_test.tbl', FIELDNAMES, output, names={'label_sequence': label_names})
+        subprocess.run([sys.executable, './inference.py', '--pub_info_path', publications_json_path,
+                        '--data_sets_json_path', data_sets_json_path, '--metadata_index', metadata_index_path,
+                        '--test_preprocessed', RESCAN_PATH + 'rcc_corpus_test.tbl',
+                        '--not_found_test_path', RESCAN_PATH + 'rcc_test.tbl',
+                        '--unordered_output_path', RESCAN_PATH + 'model_output_mentions.tbl'], check=True)
+        patch_model_output(unordered_output_path, RESCAN_PATH + 'model_output_mentions.tbl',
+                           set(publication_id for publication_id, _ in patched_publications))
+    write_tagged_data_sets(output_filepath, data_set_mention_info)
+    if cache is not None:
+        cache.log_stats()
+    logging.info("Running make_citation_output.py...")
+    subprocess.run([sys.executable, './make_citation_output.py', '--test_preprocessed', output_filepath,
+                    '--unordered_output_path', unordered_output_path], check=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m-%d %H:%M')
+    args = get_args()
+    ensure_nltk_data()
+    cache = PreprocessCache(args.cache_dir, args.cache_max_mb * 1024 ** 2) if args.cache_dir else None
+    if args.rescan_new_data_sets:
+        rescan_new_data_sets(args.publication_txt_path_prefix, args.publications_json_path, args.data_sets_json_path,
+                             args.output_filename, args.workers, cache, args.corpus_store, args.mention_dictionary,
+                             args.fuzzy_threshold, args.metadata_index, args.unordered_output_path)
+        sys.exit(0)
+    test_set_parser(args.publication_txt_path_prefix, args.publications_json_path, args.data_sets_json_path, args.output_filename,
+                    args.workers, cache, args.corpus_store, args.mention_dictionary, args.fuzzy_threshold, args.metadata_index)
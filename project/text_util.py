@@ -0,0 +1,464 @@
+import codecs
+import collections
+import io
+import itertools
+import multiprocessing
+import re
+
+import numpy as np
+
+from corpus_store import open_store
+from json_stream import iter_json_array
+from mention_index import FuzzyMentionIndex, MentionAutomaton, MentionTrie
+from tokenizer import word_tokenize
+
+
+# bump whenever normalize_string(), sentence_spans() or the sentence filter of tokenize_publication() change,
+# it invalidates the preprocess cache
+NORMALIZE_VERSION = 1
+
+
+def list_to_string(list_tokens):
+    res = ''
+    first = True
+    for tok in list_tokens:
+        if first:
+            first = False
+        else:
+            res += ' '
+        res += tok
+    return res
+
+
+def split_into_sentences(text):
+    """
+    This function can split the entire text of Huckleberry Finn into sentences in about 0.1 seconds
+    and handles many of the more painful edge cases that make sentence parsing non-trivial
+    """
+    alphabets= "([A-Za-z])"
+    prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
+    suffixes = "(Inc|Ltd|Jr|Sr|Co)"
+    starters = "(Mr|Mrs|Ms|Dr|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
+    acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
+    websites = "[.](com|net|org|io|gov)"
+    digits = "([0-9]+)"
+    text = " " + text + "  "
+    text = text.replace("\n", " ")
+    text = re.sub("\s\s+", " ", text)
+    text = re.sub(prefixes, "\\1<prd>", text)
+    text = re.sub(websites, "<prd>\\1", text)
+    if "Ph.D" in text: text = text.replace("Ph.D.", "Ph<prd>D<prd>")
+    text = re.sub(digits + "[.]" + digits, "\\1<prd>\\2", text)
+    text = re.sub("\s" + alphabets + "[.] "," \\1<prd> ", text)
+    text = re.sub(acronyms+" "+starters,"\\1<stop> \\2", text)
+    text = re.sub(alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>\\3<prd>", text)
+    text = re.sub(alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>", text)
+    text = re.sub(" "+suffixes+"[.] "+starters, " \\1<stop> \\2", text)
+    text = re.sub(" "+suffixes+"[.]", " \\1<prd>", text)
+    text = re.sub(" " + alphabets + "[.]", " \\1<prd>", text)
+    if "”" in text: text = text.replace(".”", "”.")
+    if "\"" in text: text = text.replace(".\"", "\".")
+    if "!" in text: text = text.replace("!\"", "\"!")
+    if "?" in text: text = text.replace("?\"", "\"?")
+    text = text.replace(".", ".<stop>")
+    text = text.replace("?", "?<stop>")
+    text = text.replace("!", "!<stop>")
+    text = text.replace("<prd>", ".")
+    text = re.sub("\s\s+", " ", text)
+    sentences = text.split("<stop>")
+    #sentences = sentences[:-1]
+    sentences = [s.strip() for s in sentences]
+    return sentences
+
+
+_LETTERS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_UPPERCASE_LETTERS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_DIGITS = frozenset('0123456789')
+_TITLE_PREFIXES = ('Mr', 'St', 'Mrs', 'Ms', 'Dr')
+_WEBSITE_SUFFIXES = ('com', 'net', 'org', 'io', 'gov')
+_ABBREVIATIONS = ('Inc', 'Ltd', 'Jr', 'Sr', 'Co')
+_SENTENCE_STARTERS = re.compile(r"Mr|Mrs|Ms|Dr|(?:He|She|It|They|Their|Our|We|But|However|That|This)(?:\s|$)|Wherever")
+_SENTENCE_END = re.compile(r"[.?!]")
+_DIGIT_RUN = re.compile(r"[0-9]*")
+
+
+def _is_title_website_or_phd_period(text, i):
+    if text.endswith(_TITLE_PREFIXES, 0, i) or text.startswith(_WEBSITE_SUFFIXES, i + 1):
+        return True
+    if i >= 2 and text.startswith('Ph.D.', i - 2) and not text.startswith(_WEBSITE_SUFFIXES, i + 3):
+        return True
+    return i >= 4 and text.startswith('Ph.D.', i - 4)
+
+
+def _strip_span(text, start, end):
+    while start < end and text[start] == ' ':
+        start += 1
+    while end > start and text[end - 1] == ' ':
+        end -= 1
+    return start, end
+
+
+def sentence_spans(text):
+    """
+    Yield the (start, end) character spans of the sentences split_into_sentences() finds in text,
+    in one scan over the sentence-ending punctuation and without copying text.
+    text must be normalized by normalize_string(); then text[start:end] is exactly the sentence
+    split_into_sentences() returns, including its empty sentences.
+    """
+    length = len(text)
+    start = 0
+    digits_consumed_to = -1     # end of the digits eaten by the last 1.2 match
+    chain_end = -1              # last '.' of the current a.b.c. chain and its length
+    chain_length = 0
+    starter_consumed_space = -2     # space eaten by the last 'Co. He ' match
+    for match in _SENTENCE_END.finditer(text):
+        i = match.start()
+        if text[i] != '.':
+            yield _strip_span(text, start, i + 1)
+            start = i + 1
+            continue
+        before = text[i - 1] if i > 0 else ' '
+        after = text[i + 1] if i + 1 < length else ' '
+        # Mr. / .com / Ph.D.
+        protected = _is_title_website_or_phd_period(text, i)
+        # 1.2
+        if not protected and before in _DIGITS and after in _DIGITS and digits_consumed_to != i:
+            protected = True
+            digits_consumed_to = _DIGIT_RUN.match(text, i + 1).end()
+        # U.S. He
+        if (not protected and after == ' ' and before in _UPPERCASE_LETTERS and i >= 3 and text[i - 2] == '.'
+                and text[i - 3] in _UPPERCASE_LETTERS and not _is_title_website_or_phd_period(text, i - 2)
+                and _SENTENCE_STARTERS.match(text, i + 2)):
+            yield _strip_span(text, start, i + 1)
+            start = i + 1
+        # a.b.c. and a.b. keep every period but the last one of a chain of 1, 4, 7, ...
+        if not protected and before in _LETTERS and (after in _LETTERS or chain_end == i - 2):
+            chain_length = chain_length + 1 if chain_end == i - 2 else 1
+            chain_end = i
+            chain_continues = (after in _LETTERS and i + 2 < length and text[i + 2] == '.'
+                               and not _is_title_website_or_phd_period(text, i + 2))
+            protected = chain_continues or chain_length % 3 != 1
+        # Inc. He / Inc.
+        if not protected and text.endswith(_ABBREVIATIONS, 0, i):
+            for abbreviation in _ABBREVIATIONS:
+                if text.endswith(abbreviation, 0, i):
+                    space = i - len(abbreviation) - 1
+                    if space < 0 or text[space] == ' ':
+                        starter = None
+                        if after == ' ' and space != starter_consumed_space:
+                            starter = _SENTENCE_STARTERS.match(text, i + 2)
+                        if starter is None:
+                            protected = True
+                        else:
+                            if starter.group()[-1:].isspace():
+                                starter_consumed_space = starter.end() - 1
+                            yield _strip_span(text, start, i)
+                            start = i + 1
+                            protected = True
+                    break
+        # a.
+        if not protected and before in _LETTERS and (i < 2 or text[i - 2] == ' '):
+            protected = True
+        if not protected:
+            yield _strip_span(text, start, i + 1)
+            start = i + 1
+    yield _strip_span(text, start, length)
+
+
+# normalize_string() works on an ascii byte image of the text: every non-ascii character becomes
+# one \x01 byte (so character positions are kept), and the character-class filtering is a translate table.
+def _non_ascii_to_placeholder(error):
+    return '\x01' * (error.end - error.start), error.end
+
+
+codecs.register_error('rcc_placeholder', _non_ascii_to_placeholder)
+
+_ALLOWED_CHARS = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789()/;:#,.?!&=~-@\"' "
+_FILTER_TABLE = bytes(c if c in _ALLOWED_CHARS else ord(' ') for c in range(256))
+_HYPHEN_QUOTE_TABLE = bytes.maketrans(b'-"', b'  ')
+_PERCENT_TOKEN = re.compile(rb"(?<![^ ])[^ ]+%")
+_LINE_BREAK_HYPHEN = re.compile(rb"-(?<=\S-) +")
+_MULTI_SPACE = re.compile(rb"  +")
+_RANGE_PAREN = re.compile(rb"\((?![1-2][0-9][0-9][0-9] to [1-2][0-9][0-9][0-9]\))[^\)a-zA-Z]+to[^\)a-zA-Z]+\)") #(241234 to 124323)
+_IN_PAREN = re.compile(rb"\([0-9]+\.[0-9]+ in [0-9]+\.[0-9]+\)") #(4.3-1.2)
+_NUMBER_PAREN = re.compile(rb"\((?![1-2][0-9][0-9][0-9]\))(?![1-2][0-9][0-9][0-9] [^\)]+\))[0-9\.\,\+ ]+\)")
+_NUMBER = re.compile(rb" (?![1-2][0-9][0-9][0-9] )[0-9][0-9\.\,]+[0-9] ")
+_DECIMAL = re.compile(rb" [0-9]+\.[0-9]+")
+
+
+def normalize_string(text):
+    text = text.encode('ascii', 'rcc_placeholder')
+    if b'%' in text:
+        text = _PERCENT_TOKEN.sub(b' ', text)
+    text = text.replace(b'\\"', b' ')
+    text = text.translate(_FILTER_TABLE)
+    # remove hyphens; soft hyphens are already gone with the non-ascii characters
+    if b'-' in text:
+        text = _LINE_BREAK_HYPHEN.sub(b'', text)
+    # remove hyphens and quotes
+    text = _MULTI_SPACE.sub(b' ', text.translate(_HYPHEN_QUOTE_TABLE))
+    # etc
+    if b'(' in text:
+        if b'to' in text:
+            text = _RANGE_PAREN.sub(b' ', text)
+        if b' in ' in text:
+            text = _IN_PAREN.sub(b' ', text)
+        text = _NUMBER_PAREN.sub(b' ', text)
+    text = _NUMBER.sub(b' ', text)
+    text = _DECIMAL.sub(b' ', text)
+    text = _MULTI_SPACE.sub(b' ', text)
+    return text.decode('ascii')
+
+
+def _join_publication_lines(lines):
+    chunks = []
+    for line in lines:
+        stripped_line = line.strip()
+        chunks.append(' ')
+        chunks.append(stripped_line)
+        if len(stripped_line.split(None, 5)) <= 5:
+            chunks.append('<stop>')    # marking for sentence boundary in split_into_sentences() function
+    return ''.join(chunks)
+
+
+def read_publication_text(txt_file_path):
+    with open(txt_file_path) as txt_file:
+        return _join_publication_lines(txt_file)
+
+
+def read_publication_bytes(publication_id, txt_file_path, store_path=None):
+    """
+    Raw bytes of a publication text, from the packed corpus store at store_path if given (a zero-copy memoryview)
+    or from its text file, for the publications added since the store was packed too.
+    """
+    if store_path:
+        store = open_store(store_path)
+        if publication_id in store:
+            return store.get_bytes(publication_id)
+    with open(txt_file_path, 'rb') as txt_file:
+        return txt_file.read()
+
+
+def decode_publication_text(data):
+    # decoded and split into lines exactly as reading the text file does
+    return _join_publication_lines(io.TextIOWrapper(io.BytesIO(data)))
+
+
+def tokenize_publication(raw_text):
+    """
+    Normalize a publication text and tokenize its sentences.
+    :return: sentences: token lists of the 10 to 30 word sentences (tokens shorter than 15 characters)
+             chopped_raw_text: those sentences joined by spaces
+    """
+    text = normalize_string(raw_text)
+    sentences = []
+    for start, end in sentence_spans(text):
+        words = [w for w in word_tokenize(text[start:end]) if len(w) < 15]
+        if len(words) >= 10 and len(words) <= 30:
+            sentences.append(words)
+    return sentences, ' '.join([list_to_string(words) for words in sentences])
+
+
+def _read_job_text(publication_id, txt_file_path, store_path):
+    if store_path:
+        return decode_publication_text(read_publication_bytes(publication_id, txt_file_path, store_path))
+    return read_publication_text(txt_file_path)
+
+
+def _tokenize_publication_files(jobs):
+    return [(publication_id, list(tokenize_publication(_read_job_text(publication_id, txt_file_path, store_path))))
+            for publication_id, txt_file_path, store_path in jobs]
+
+
+def _lookup_cached_publications(jobs, cache):
+    """
+    :return: results: (publication_id, [sentences, chopped_raw_text]) of the cached jobs, None for the others
+             keys: cache keys of the jobs
+             missing_jobs: the jobs to tokenize
+    """
+    if cache is None:
+        return [None] * len(jobs), [None] * len(jobs), jobs
+    keys = [cache.key(read_publication_bytes(*job)) for job in jobs]
+    results = []
+    missing_jobs = []
+    for job, key in zip(jobs, keys):
+        cached = cache.get(key)
+        if cached is None:
+            missing_jobs.append(job)
+            results.append(None)
+        else:
+            results.append((job[0], cached))
+    return results, keys, missing_jobs
+
+
+def _merge_tokenized_publications(results, keys, tokenized, cache):
+    tokenized = iter(tokenized)
+    for i, key in enumerate(keys):
+        if results[i] is None:
+            results[i] = next(tokenized)
+            if cache is not None:
+                cache.put(key, results[i][1][0])
+    return results
+
+
+def iter_tokenized_publications(publication_list, publication_txt_path_prefix, workers=1, chunksize=16, cache=None,
+                                store_path=None):
+    """
+    Read, normalize and tokenize the publications one at a time.
+    Yields (publication_id, [sentences, chopped_raw_text]) in the order of publication_list,
+    any iterable of publication records: a publication is tokenized as soon as it is read from it.
+    With workers > 1 consecutive chunks of chunksize publications are tokenized by a process pool,
+    keeping at most 2 chunks per worker in flight; the results are still yielded in order.
+    With a PreprocessCache only the publications whose text (or the preprocessing version) changed are tokenized.
+    With a store_path the texts are read from that packed corpus store instead of the text files.
+    """
+    jobs = ((publication_info.get( "publication_id", None ),
+             publication_txt_path_prefix + publication_info.get( "text_file_name", None ),
+             store_path)
+            for publication_info in publication_list)
+    if workers <= 1:
+        for job in jobs:
+            results, keys, missing_jobs = _lookup_cached_publications([job], cache)
+            yield _merge_tokenized_publications(results, keys, _tokenize_publication_files(missing_jobs), cache)[0]
+        return
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque()
+        # publication_list may be read as it is iterated, the chunks are taken from it lazily
+        for chunk in iter(lambda: list(itertools.islice(jobs, chunksize)), []):
+            results, keys, missing_jobs = _lookup_cached_publications(chunk, cache)
+            pending.append((results, keys, pool.apply_async(_tokenize_publication_files, (missing_jobs,))))
+            if len(pending) >= 2 * workers:
+                results, keys, tokenized = pending.popleft()
+                yield from _merge_tokenized_publications(results, keys, tokenized.get(), cache)
+        while pending:
+            results, keys, tokenized = pending.popleft()
+            yield from _merge_tokenized_publications(results, keys, tokenized.get(), cache)
+
+
+def read_pub_json_files(args):
+    # metadata_index imports this module (through mention_dictionary)
+    from metadata_index import publication_date
+    pub_date_dict = dict()
+    for pub_info_path in [args.train_pub_info_path, args.test_pub_info_path]:
+        for publication_info in iter_json_array(pub_info_path):
+            pub_date = publication_date(publication_info) or '2019-00-00'
+            pub_date_dict[publication_info.get( "publication_id", None )] = int(pub_date[:4])
+    return pub_date_dict
+
+
+def label_substring(sentence, mention, label_sequence, data_set_id):
+    found_cnt = 0
+    for i, word in enumerate(sentence[:-len(mention) + 1]):
+        if all(x == y for x, y in zip(mention, sentence[i:i + len(mention)])):
+            if label_sequence[i] == '_':
+                found_cnt += 1
+                label_sequence[i] = 'B-' + str(data_set_id)                
+            for j in range(len(mention)-1):
+                label_sequence[i + j + 1] = 'I'
+    return label_sequence, found_cnt
+
+
+def encode(sentences, mention_list):
+    label_sequence_list = []
+    found_cnt = 0
+    for sentence in sentences:
+        label_sequence = ['_' for _ in sentence]
+        for data_set_id, mentions in mention_list:
+            for mention in mentions:
+                label_sequence, cnt = label_substring(sentence, mention, label_sequence, data_set_id)
+                found_cnt += cnt
+        label_sequence_list.append(label_sequence)
+    return label_sequence_list, found_cnt
+
+
+def encode_test(raw_text, data_set_mention_info, pub_date):
+    label_sequence = ['_' for _ in range(len(raw_text.split()))]
+    for date, data_set_id, mention_list in data_set_mention_info:   # date이 큰 것부터(최신부터) 들어오도록 정렬되어 있음
+        if date < pub_date:
+            for mention_info in mention_list:
+                mention, raw_mention = mention_info[0], mention_info[1]
+                substitute_pattern = '<MT-B>' + ' <MT-I>' * (len(mention)-1)
+                replaced_text = raw_text.replace(raw_mention, substitute_pattern)
+                begin_mark = 'B-' + str(data_set_id)
+                res = [begin_mark if w=='<MT-B>' else 'I' if w=='<MT-I>' else '_' for w in replaced_text.split()]
+                label_sequence = [prev_l if curr_l=='_' else curr_l if prev_l=='_' else 'I' if prev_l=='I' or curr_l=='I' else prev_l for prev_l, curr_l in zip(label_sequence, res)]
+    return label_sequence
+
+
+# formatted_publications: iterable of (publication_id, sentences), e.g. a dict's items()
+def extract_formatted_data(formatted_publications, citation_dict):
+    output = []
+    found_cnt = 0
+    for publication_id, sentences in formatted_publications:
+        if publication_id in citation_dict:
+            mention_list = citation_dict[publication_id] # [[data_set_id, formatted_mention_list]]
+            # labels what encode() does in one scan per sentence
+            label_sequence_list, cnt = MentionTrie(mention_list).encode(sentences)
+            found_cnt += cnt
+            for sentence, label_sequence in zip(sentences, label_sequence_list):
+                output.append({'publication_id': publication_id,
+                               'sentence': sentence,
+                               'label_sequence': label_sequence})
+        else:
+            for sentence in sentences:
+                label_sequence = ['_' for _ in sentence]
+                output.append({'publication_id': publication_id,
+                               'sentence': sentence,
+                               'label_sequence': label_sequence})
+    print("found mentions: ", end='')
+    print(found_cnt)
+    return output
+
+
+# formatted_publications: iterable of (publication_id, [sentences, raw_text]), see iter_tokenized_publications()
+# pub_date_dict: publication_id -> encoded pub_date, a dict or the MetadataIndex.pub_dates() view looking each one up
+# fuzzy_threshold: sentences without an exact mention are labeled by their fuzzy matches of at least that similarity
+# (see FuzzyMentionIndex), so inference does not run the labeling model on them; 0 to disable
+# mention_automaton: a MentionAutomaton of data_set_mention_info already built
+# returns the rows and the label names: the label_sequence of a row is an int32 array of codes into them,
+# written as they are by write_table(..., names={'label_sequence': label_names})
+def extract_formatted_data_test(formatted_publications, data_set_mention_info, pub_date_dict, fuzzy_threshold=0,
+                                mention_automaton=None):
+    output = []
+    found_cnt = 0
+    fuzzy_cnt = 0
+    # tags what encode_test() does in one pass over every publication
+    if mention_automaton is None:
+        mention_automaton = MentionAutomaton(data_set_mention_info)
+    fuzzy_index = None
+    if fuzzy_threshold > 0:
+        fuzzy_index = FuzzyMentionIndex(mention_automaton.data_set_mention_info, fuzzy_threshold,
+                                        begin_codes=mention_automaton.begin_codes)
+    # labels stay int codes (0 '_', 1 'I', B- above), the table writer maps them to its own codes
+    label_names = mention_automaton.label_names
+    for publication_id, [sentences, raw_text] in formatted_publications:
+        pub_date = pub_date_dict[publication_id]
+        label_codes = mention_automaton.label_codes(raw_text, pub_date)
+        found_cnt += int(np.count_nonzero(label_codes > 1))
+        startidx = 0
+        for sentence in sentences:
+            sub_label_codes = label_codes[startidx:startidx+len(sentence)]
+            startidx += len(sub_label_codes)
+            if sub_label_codes[0] == 1:
+                # a mention continued from the previous sentence
+                not_inside = np.flatnonzero(sub_label_codes != 1)
+                sub_label_codes[:not_inside[0] if len(not_inside) else len(sub_label_codes)] = 0
+            labeled = 'N'
+            if (sub_label_codes != sub_label_codes[0]).any():
+                labeled = 'Y'
+            elif fuzzy_index is not None:
+                for start, num_words, begin_code in fuzzy_index.find_spans(sentence, pub_date):
+                    sub_label_codes[start] = begin_code
+                    sub_label_codes[start + 1:start + num_words] = 1
+                    fuzzy_cnt += 1
+                    labeled = 'Y'
+            output.append({'publication_id': publication_id,
+                           'sentence': sentence,
+                           'label_sequence': sub_label_codes,
+                           'labeled': labeled})
+    print("found mentions: ", end='')
+    print(found_cnt)
+    if fuzzy_index is not None:
+        print("fuzzy mentions: ", end='')
+        print(fuzzy_cnt)
+    return output, label_names
@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class Vocabulary(object):
+    """
+    Corpus-wide interner of the words: every distinct word gets an int32 id, in the order the words were first interned.
+    """
+    def __init__(self, words=()):
+        self.words = []
+        self.word_ids = dict()
+        self.encode(words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def intern(self, word):
+        word_id = self.word_ids.get(word, None)
+        if word_id is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def encode(self, words):
+        return np.array([self.intern(word) for word in words], dtype=np.int32)
+
+    def decode(self, ids):
+        words = self.words
+        return [words[word_id] for word_id in np.asarray(ids).tolist()]
+
+
+class TokenSequences(object):
+    """
+    Sentences (or their label sequences) as one int32 array of ids and the int64 offsets of the rows in it,
+    4 bytes a token instead of a list of str. Rows are numpy views, take() selects or reorders rows without python lists.
+    """
+    def __init__(self, ids, offsets):
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_table(cls, table, fieldname, vocabulary):
+        """
+        The words of a SentenceTable column, their table codes mapped to the ids of vocabulary.
+        """
+        table_ids = vocabulary.encode(table.words)
+        return cls(table_ids[table.values[fieldname]], np.array(table.offsets[fieldname]))
+
+    @classmethod
+    def label_codes(cls, table, fieldname='label_sequence'):
+        """
+        The labels of a SentenceTable column as the models take them: 0 '_', 2 'B-', 1 'I'.
+        """
+        codes = np.array([0 if l == '_' else 2 if 'B' in l else 1 for l in table.names[fieldname]], dtype=np.int32)
+        return cls(codes[table.values[fieldname]], np.array(table.offsets[fieldname]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.lengths()[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # the position of every token of the rows taken, in the order taken
+        positions = np.repeat(self.offsets[:-1][rows] - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return TokenSequences(self.ids[positions], offsets)
+
+    def where(self, rows, other):
+        """
+        :param rows: bool per row, rows of other to take in place of these, of the same lengths
+        """
+        assert np.array_equal(self.offsets, other.offsets)
+        return TokenSequences(np.where(np.repeat(rows, self.lengths()), other.ids, self.ids), self.offsets)
+
+    def is_uniform(self):
+        """
+        :return: bool per row, whether all of its ids are the same (not for empty rows)
+        """
+        lengths = self.lengths()
+        uniform = np.zeros(len(self), dtype=bool)
+        non_empty = lengths > 0
+        if non_empty.any():
+            starts = self.offsets[:-1][non_empty]
+            uniform[non_empty] = np.minimum.reduceat(self.ids, starts) == np.maximum.reduceat(self.ids, starts)
+        return uniform
+
+    def unique(self):
+        return np.unique(self.ids)
+
+    def nbytes(self):
+        return self.ids.nbytes + self.offsets.nbytes
@@ -0,0 +1,102 @@
+import functools
+import re
+
+
+# bump whenever the tokens word_tokenize() returns change, it invalidates the preprocess cache
+TOKENIZER_VERSION = 2
+
+# a period Punkt could end a sentence at before the last token, where the Treebank final period rule would apply
+_PERIOD_BREAK = re.compile(r"\.(?:[)\";}\]*:@'({\[!?]|\s+\S)")
+# texts the fast path can not reproduce nltk.word_tokenize() on: quotes right after ? or ! (a sentence starting
+# with a quote is tokenized differently), the quotes the Treebank rules turn into `` and '' (", `, ''),
+# whitespace other than ' ', since the last tokens are re-joined with spaces, and anything not ascii
+_UNSUPPORTED = re.compile(r"[?!][)\";}\]*:@'({\[!?]*\s*[\"'`]|[\"`]|''|[\t\n\r\x0b\x0c\x1c-\x1f]|[^\x00-\x7f]")
+# characters the Treebank final period rule skips after the period
+_CLOSING_CHARS = ')]}>"\''
+_SENTINEL = ' a'
+# the common chunk shapes in the middle of a sentence: an optional opening parenthesis, a word or a dotted abbreviation
+# and an optional closing parenthesis or separator, which the Treebank rules split into at most three tokens
+_PLAIN_CHUNK = re.compile(r"(\(?)([A-Za-z0-9]+(?:\.[A-Za-z0-9]+)*\.?)([),;:]?)")
+# words the Treebank contraction rules split ('cannot' -> 'can', 'not')
+_CONTRACTION = re.compile(r"(?i)\b(?:cannot|gimme|gonna|gotta|lemme|wanna)\b")
+
+
+# importing nltk takes most of a second, it is only imported once something is actually tokenized
+@functools.lru_cache(maxsize=None)
+def _treebank_word_tokenizer():
+    from nltk.tokenize import NLTKWordTokenizer
+    return NLTKWordTokenizer()
+
+
+@functools.lru_cache(maxsize=1 << 17)
+def _treebank_tokens(chunk, prefix, suffix):
+    """
+    Tokenize one whitespace separated chunk as nltk does at its place in the sentence.
+    In the middle of a sentence the suffix is a sentinel word, dropped again from the tokens,
+    so the end anchored rules (final period, trailing colon) only fire where they would in the whole sentence.
+    """
+    if suffix == _SENTINEL:
+        match = _PLAIN_CHUNK.fullmatch(chunk)
+        if match is not None and _CONTRACTION.search(chunk) is None:
+            return tuple(token for token in match.groups() if token)
+    tokens = _treebank_word_tokenizer().tokenize(prefix + chunk + suffix)
+    if suffix == _SENTINEL:
+        tokens.pop()
+    return tuple(tokens)
+
+
+def _tokenize_line(text):
+    chunks = text.split()
+    if not chunks:
+        return ()
+    # the final period rule can reach over trailing closing brackets and quotes, keep them with the last word
+    last = len(chunks) - 1
+    while last > 0 and not chunks[last].strip(_CLOSING_CHARS):
+        last -= 1
+    # Punkt strips trailing whitespace from its sentences but keeps leading whitespace, which matters to starting quotes
+    first_prefix = ' ' if text[0] == ' ' else ''
+    if last == 0:
+        return _treebank_tokens(' '.join(chunks), first_prefix, '')
+    tokens = list(_treebank_tokens(chunks[0], first_prefix, _SENTINEL))
+    for chunk in chunks[1:last]:
+        tokens += _treebank_tokens(chunk, ' ', _SENTINEL)
+    tokens += _treebank_tokens(' '.join(chunks[last:]), ' ', '')
+    return tuple(tokens)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _tokenize_sentence(text):
+    import nltk
+    if _UNSUPPORTED.search(text) is not None:
+        return tuple(nltk.word_tokenize(text))
+    if _PERIOD_BREAK.search(text) is None:
+        return _tokenize_line(text)
+    tokens = []
+    for sentence in nltk.sent_tokenize(text):
+        tokens += _tokenize_line(sentence)
+    return tuple(tokens)
+
+
+def word_tokenize(text):
+    """
+    Drop-in replacement for nltk.word_tokenize() on normalize_string() output.
+    Sentences and their whitespace separated chunks are tokenized once and memoized, plain chunks by _PLAIN_CHUNK
+    and the rest by the nltk Treebank rules. Punkt only runs on texts with a period it could split at.
+    """
+    return list(_tokenize_sentence(text))
+
+
+def ensure_nltk_data():
+    """
+    Download the nltk data word_tokenize() needs (Punkt) only if it is not installed yet.
+    """
+    import nltk
+    try:
+        nltk.sent_tokenize('Is the Punkt model installed? It is.')
+    except LookupError:
+        nltk.download('popular')
+
+
+def clear_cache():
+    _tokenize_sentence.cache_clear()
+    _treebank_tokens.cache_clear()
@@ -5,7 +5,7 @@ from util import evaluate
 from models import CNN_Text
 from util import list_to_string, evaluate_clf_cnn, normalize_string, split_into_sentences
 import torch.nn.functional as F
-from nltk.tokenize import word_tokenize
+from tokenizer import word_tokenize
 
 import torch
 import torch.nn as nn
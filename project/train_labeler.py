@@ -3,6 +3,8 @@ from util import get_vocab, embed_indexed_sequence, \
 from util import TextDatasetWithGloveElmoSuffix as TextDataset
 from util import evaluate
 from models import RNNSequenceModel
+from sentence_table import SentenceTable
+from token_sequences import TokenSequences, Vocabulary
 from util import list_to_string, evaluate_clf_cnn, normalize_string, split_into_sentences
 import torch.nn.functional as F
 from nltk.tokenize import word_tokenize
@@ -21,6 +23,7 @@ import csv
 import ast
 import json
 import h5py
+import numpy as np
 from tqdm import tqdm
 from allennlp.commands.elmo import ElmoEmbedder
 from sklearn.model_selection import train_test_split
@@ -31,6 +34,8 @@ def get_args():
 											help='test data path')
 	parser.add_argument('--glove_path', type=str, default='./glove/glove840B300d.txt',
 											help='glove path (default: ./glove/glove840B300d.txt)')
+	parser.add_argument('--glove_store', type=str, default='./glove/glove840B300d.bin',
+											help='glove store path, converted from glove_path when missing or stale (default: ./glove/glove840B300d.bin)')
 	parser.add_argument('--tag_file_path', type=str, default='./formatted-data/datsetIds', 
 											help='tagfile path (default: ./formatted-data/datsetIds)')
 	parser.add_argument('--batch_size', type=int, default=128,
@@ -40,9 +45,9 @@ def get_args():
 	parser.add_argument('--lr', type=float, default=0.01)
 	parser.add_argument('--num_epochs', type=int, default=1)
 	parser.add_argument('--log_interval', type=int, default=100)
-	parser.add_argument('--train_preprocessed', type=str, default='./formatted-data/rcc_corpus_train.csv',
+	parser.add_argument('--train_preprocessed', type=str, default='./formatted-data/rcc_corpus_train.tbl',
 											help='processed test data path')
-	parser.add_argument('--train_bruteforced', type=str, default='./formatted-data/rcc_corpus_train_by_bruteforce.csv',
+	parser.add_argument('--train_bruteforced', type=str, default='./formatted-data/rcc_corpus_train_by_bruteforce.tbl',
 											help='processed test data path')
 	parser.add_argument('--hidden_size', type=int, default=300)
 	args = parser.parse_args()
@@ -58,47 +63,30 @@ using_GPU = torch.cuda.is_available()
 args = get_args()
 
 logging.info("Loading parsed train data from {}".format(args.train_preprocessed))
-raw_train_rcc = []
-with open(args.train_preprocessed) as f:	# rcc_corpus_train.csv
-	lines = csv.reader(f)
-	next(lines)
-	for line in lines:
-		publication_id = int(line[0])
-		word_seq = ast.literal_eval(line[1])
-		label_seq = ast.literal_eval(line[2])
-		label_seq = [0 if l=='_' else 2 if 'B' in l else 1 for l in label_seq] 
-		assert (len(word_seq) == len(label_seq))
-		labeled = 'Y'
-		if len(set(label_seq)) == 1:
-			labeled = 'N'
-		raw_train_rcc.append([publication_id, word_seq, label_seq, labeled])
+# the sentences are int32 word ids of vocabulary and the labels int32 codes, decoded only when they are embedded
+vocabulary = Vocabulary()
+train_table = SentenceTable(args.train_preprocessed)	# rcc_corpus_train.tbl
+train_sentences = TokenSequences.from_table(train_table, 'sentence', vocabulary)
+train_labels = TokenSequences.label_codes(train_table)
+assert (np.array_equal(train_sentences.lengths(), train_labels.lengths()))
+# sentences whose labels are all the same have no mention
+train_labeled = ~train_labels.is_uniform()
 
 logging.info("Loading parsed train-bruteforced data from {}".format(args.train_bruteforced))
-raw_train_bruteforce_rcc = []
-with open(args.train_bruteforced) as f:	# rcc_corpus_train_by_bruteforce.csv
-	lines = csv.reader(f)
-	next(lines)
-	for line in lines:
-		publication_id = int(line[0])
-		word_seq = ast.literal_eval(line[1])
-		label_seq = ast.literal_eval(line[2])
-		label_seq = [0 if l=='_' else 2 if 'B' in l else 1 for l in label_seq] 
-		labeled = line[3]
-		assert (len(word_seq) == len(label_seq))
-		raw_train_bruteforce_rcc.append([publication_id, word_seq, label_seq, labeled])
-
-train_rcc = []
-for raw_sent, raw_sent_brute in zip(raw_train_rcc, raw_train_bruteforce_rcc):
-	pub_id = raw_sent[0]
-	word_seq = raw_sent[1]
-	label_seq = raw_sent[2]
-	if raw_sent[3] == 'N' and raw_sent_brute[3] == 'Y':
-		label_seq = raw_sent_brute[2]
-	assert (len(word_seq) == len(label_seq))
-	train_rcc.append([word_seq, label_seq, pub_id])
-
-vocab = get_vocab(train_rcc)
-word2idx, idx2word = get_word2idx_idx2word(vocab)
+bruteforce_table = SentenceTable(args.train_bruteforced)	# rcc_corpus_train_by_bruteforce.tbl
+bruteforce_labels = TokenSequences.label_codes(bruteforce_table)
+assert (np.array_equal(np.diff(bruteforce_table.offsets['sentence']), bruteforce_labels.lengths()))
+bruteforce_labeled = np.array(bruteforce_table.column('labeled')) == 'Y'
+
+# the sentences without a mention take the labels the brute force found in them
+num_rows = min(len(train_sentences), len(bruteforce_labels))
+rows = np.arange(num_rows)
+train_sentences = train_sentences.take(rows)
+train_labels = train_labels.take(rows).where(~train_labeled[:num_rows] & bruteforce_labeled[:num_rows], bruteforce_labels.take(rows))
+logging.info("{} tokens in {} MB of word ids".format(len(train_sentences.ids), train_sentences.nbytes() // 1024 ** 2))
+
+vocab = get_vocab(train_sentences)
+word2idx, idx2word = get_word2idx_idx2word(vocab, vocabulary)
 logging.info("Loading glove embeddings")
 glove_embeddings = get_embedding_matrix(word2idx, idx2word, args, normalization=False)
 
@@ -117,7 +105,9 @@ else:
 #  embedded_rcc = pickle.load(infile)
 
 import random
-random.shuffle(train_rcc)
+# the same permutation random.shuffle() made of the list of examples
+train_order = list(range(len(train_sentences)))
+random.shuffle(train_order)
 device = torch.device("cuda:0" if torch.cuda.is_available() else 'cpu')
 
 RNN_Seq = RNNSequenceModel(3, 300 + 1024 + 4, hidden_size=args.hidden_size, num_layers=1, bidir=True)
@@ -145,13 +135,11 @@ prev_loss = best_val_loss
 logging.info("*" * 50)
 logging.info(RNN_Seq)
 logging.info("*" * 50)
-sentences = [example[0] for example in train_rcc]
-label_seqs = [example[1] for example in train_rcc]
+sentences = train_sentences.take(train_order)
+label_seqs = train_labels.take(train_order)
 
-thousand_folds = []
-fold_size = int(len(train_rcc) / 1000)
-for i in range(1000):
-	thousand_folds.append((sentences[i * fold_size:(i + 1) * fold_size], label_seqs[i * fold_size:(i + 1) * fold_size]))
+# folds are row ranges of the shuffled sentences
+fold_size = int(len(train_sentences) / 1000)
 
 losses = []
 accuracies = []
@@ -172,16 +160,13 @@ try:
 		for i in range(1000):
 			logging.info("1000 fold validation turn change...")
 			first_in_fold = True
-			training_sentences = []
-			training_labels = []
-			for j in range(1000):
-				if j != i:
-					training_sentences.extend(thousand_folds[j][0])
-					training_labels.extend(thousand_folds[j][1])
-			training_dataset_rcc = TextDataset(training_sentences, training_labels, word2idx, glove_embeddings, elmo)
-			val_dataset_rcc = TextDataset(thousand_folds[i][0], thousand_folds[i][1], word2idx, glove_embeddings, elmo)
-			train_dataloader_rcc = DataLoader(dataset=training_dataset_rcc, batch_size=args.batch_size, shuffle=True, collate_fn=TextDataset.collate_fn)
-			val_dataloader_rcc = DataLoader(dataset=val_dataset_rcc, batch_size=args.batch_size, shuffle=False, collate_fn=TextDataset.collate_fn)
+			training_rows = np.concatenate((np.arange(0, i * fold_size), np.arange((i + 1) * fold_size, 1000 * fold_size)))
+			val_rows = np.arange(i * fold_size, (i + 1) * fold_size)
+			training_dataset_rcc = TextDataset(sentences.take(training_rows), label_seqs.take(training_rows), word2idx, glove_embeddings, elmo, vocabulary)
+			val_dataset_rcc = TextDataset(sentences.take(val_rows), label_seqs.take(val_rows), word2idx, glove_embeddings, elmo, vocabulary)
+			# the loaders take the rows, a batch of them is embedded at once
+			train_dataloader_rcc = DataLoader(dataset=range(len(training_dataset_rcc)), batch_size=args.batch_size, shuffle=True, collate_fn=training_dataset_rcc.collate_indexes)
+			val_dataloader_rcc = DataLoader(dataset=range(len(val_dataset_rcc)), batch_size=args.batch_size, shuffle=False, collate_fn=val_dataset_rcc.collate_indexes)
 			epoch_base += args.num_epochs
 			for epoch in range(args.num_epochs):
 				logging.info("Starting epoch {}".format(epoch + 1 + epoch_base))
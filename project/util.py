@@ -2,216 +2,29 @@ from tqdm import tqdm
 import torch
 import numpy as np
 import mmap
+import itertools
 import ast
 import csv
-import re
 from torch.utils.data import Dataset
 import torch.nn as nn
 from torch.autograd import Variable
 import logging
-from allennlp.commands.elmo import ElmoEmbedder
+# the text helpers live in text_util, which the preprocessing scripts import without torch
+from text_util import NORMALIZE_VERSION, list_to_string, split_into_sentences, sentence_spans, normalize_string, \
+    read_publication_text, read_publication_bytes, decode_publication_text, tokenize_publication, \
+    iter_tokenized_publications, read_pub_json_files, label_substring, encode, encode_test, \
+    extract_formatted_data, extract_formatted_data_test
 import json
 import torch.nn.functional as F
+from glove_store import open_glove_store
+from sentence_table import SentenceTable
+from token_sequences import TokenSequences, Vocabulary
 
 
-def list_to_string(list_tokens):
-    res = ''
-    first = True
-    for tok in list_tokens:
-        if first:
-            first = False
-        else:
-            res += ' '
-        res += tok
-    return res
-
-
-def split_into_sentences(text):
-    """
-    This function can split the entire text of Huckleberry Finn into sentences in about 0.1 seconds
-    and handles many of the more painful edge cases that make sentence parsing non-trivial
-    """
-    alphabets= "([A-Za-z])"
-    prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
-    suffixes = "(Inc|Ltd|Jr|Sr|Co)"
-    starters = "(Mr|Mrs|Ms|Dr|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
-    acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
-    websites = "[.](com|net|org|io|gov)"
-    digits = "([0-9]+)"
-    text = " " + text + "  "
-    text = text.replace("\n", " ")
-    text = re.sub("\s\s+", " ", text)
-    text = re.sub(prefixes, "\\1<prd>", text)
-    text = re.sub(websites, "<prd>\\1", text)
-    if "Ph.D" in text: text = text.replace("Ph.D.", "Ph<prd>D<prd>")
-    text = re.sub(digits + "[.]" + digits, "\\1<prd>\\2", text)
-    text = re.sub("\s" + alphabets + "[.] "," \\1<prd> ", text)
-    text = re.sub(acronyms+" "+starters,"\\1<stop> \\2", text)
-    text = re.sub(alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>\\3<prd>", text)
-    text = re.sub(alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>", text)
-    text = re.sub(" "+suffixes+"[.] "+starters, " \\1<stop> \\2", text)
-    text = re.sub(" "+suffixes+"[.]", " \\1<prd>", text)
-    text = re.sub(" " + alphabets + "[.]", " \\1<prd>", text)
-    if "”" in text: text = text.replace(".”", "”.")
-    if "\"" in text: text = text.replace(".\"", "\".")
-    if "!" in text: text = text.replace("!\"", "\"!")
-    if "?" in text: text = text.replace("?\"", "\"?")
-    text = text.replace(".", ".<stop>")
-    text = text.replace("?", "?<stop>")
-    text = text.replace("!", "!<stop>")
-    text = text.replace("<prd>", ".")
-    text = re.sub("\s\s+", " ", text)
-    sentences = text.split("<stop>")
-    #sentences = sentences[:-1]
-    sentences = [s.strip() for s in sentences]
-    return sentences
-
-
-def normalize_string(text):
-    text = re.sub("[^ ]+%", ' ', text)
-    text = re.sub('\\\\\\\"', ' ', text)
-    text = re.sub(r"[^a-zA-Z0-9()/;:#,.?!&=~\-@\"\' ]+", ' ', text)
-    text = re.sub("\s\s+", " ", text)
-    # remove hyphens
-    text = re.sub('\xad', '-', text)
-    text = re.sub('\u00ad', '-', text)
-    text = re.sub('\N{SOFT HYPHEN}', '-', text)
-    text = re.sub(r'([^\s])- ', "\\1", text)
-    text = re.sub(r'\-', ' ', text)
-    text = re.sub("\s\s+", " ", text)
-    # remove quotes
-    text = re.sub('\"', ' ', text)
-    text = re.sub("\s\s+", " ", text)
-    # etc
-    text = re.sub(r"(?!\([1-2][0-9][0-9][0-9] to [1-2][0-9][0-9][0-9]\))\([^\)a-zA-Z]+to[^\)a-zA-Z]+\)", ' ', text) #(241234 to 124323)
-    text = re.sub(r"\([0-9]+\.[0-9]+ in [0-9]+\.[0-9]+\)", ' ', text) #(4.3-1.2)
-    text = re.sub(r"(?!\([1-2][0-9][0-9][0-9]\))(?!\([1-2][0-9][0-9][0-9] [^\)]+\))\([0-9\.\,\+ ]+\)", ' ', text)
-    text = re.sub(r"(?! [1-2][0-9][0-9][0-9] ) [0-9][0-9\.\,]+[0-9] ", ' ', text)
-    text = re.sub(r" [0-9]+\.[0-9]+", ' ', text)
-    text = re.sub("\s\s+", " ", text)
-    return text
-
-
-def read_pub_json_files(args):
-    pub_date_dict = dict()
-    with open(args.train_pub_info_path) as json_publication_file:
-        publication_list = json.load(json_publication_file)
-        for publication_info in publication_list:
-            publication_id = publication_info.get( "publication_id", None )
-            unique_identifier = publication_info.get( "unique_identifier", None ) # id가 bbk로 시작하면 pub_date은 None임
-            if 'bbk' not in unique_identifier:
-                pub_date = publication_info.get( "pub_date", None )
-            else:
-                pub_date = '2019-00-00'
-            pub_date.encode('ascii', 'ignore')
-            pub_date = int(pub_date[:4])
-            pub_date_dict[publication_id] = pub_date
-
-    with open(args.test_pub_info_path) as json_publication_file:
-        publication_list = json.load(json_publication_file)
-        for publication_info in publication_list:
-            publication_id = publication_info.get( "publication_id", None )
-            unique_identifier = publication_info.get( "unique_identifier", None ) # id가 bbk로 시작하면 pub_date은 None임
-            if 'bbk' not in unique_identifier:
-                pub_date = publication_info.get( "pub_date", None )
-            else:
-                pub_date = '2019-00-00'
-            pub_date.encode('ascii', 'ignore')
-            pub_date = int(pub_date[:4])
-            pub_date_dict[publication_id] = pub_date
-    return pub_date_dict
-
-
-def label_substring(sentence, mention, label_sequence, data_set_id):
-    found_cnt = 0
-    for i, word in enumerate(sentence[:-len(mention) + 1]):
-        if all(x == y for x, y in zip(mention, sentence[i:i + len(mention)])):
-            if label_sequence[i] is '_':
-                found_cnt += 1
-                label_sequence[i] = 'B-' + str(data_set_id)                
-            for j in range(len(mention)-1):
-                label_sequence[i + j + 1] = 'I'
-    return label_sequence, found_cnt
-
-
-def encode(sentences, mention_list):
-    label_sequence_list = []
-    found_cnt = 0
-    for sentence in sentences:
-        label_sequence = ['_' for _ in sentence]
-        for data_set_id, mentions in mention_list:
-            for mention in mentions:
-                label_sequence, cnt = label_substring(sentence, mention, label_sequence, data_set_id)
-                found_cnt += cnt
-        label_sequence_list.append(label_sequence)
-    return label_sequence_list, found_cnt
-
-
-def encode_test(raw_text, data_set_mention_info, pub_date):
-    label_sequence = ['_' for _ in range(len(raw_text.split()))]
-    for date, data_set_id, mention_list in data_set_mention_info:   # date이 큰 것부터(최신부터) 들어오도록 정렬되어 있음
-        if date < pub_date:
-            for mention_info in mention_list:
-                mention, raw_mention = mention_info[0], mention_info[1]
-                substitute_pattern = '<MT-B>' + ' <MT-I>' * (len(mention)-1)
-                replaced_text = raw_text.replace(raw_mention, substitute_pattern)
-                begin_mark = 'B-' + str(data_set_id)
-                res = [begin_mark if w=='<MT-B>' else 'I' if w=='<MT-I>' else '_' for w in replaced_text.split()]
-                label_sequence = [prev_l if curr_l=='_' else curr_l if prev_l=='_' else 'I' if prev_l=='I' or curr_l=='I' else prev_l for prev_l, curr_l in zip(label_sequence, res)]
-    return label_sequence
-
-
-def extract_formatted_data(formatted_publications, citation_dict):
-    output = []
-    found_cnt = 0
-    for publication_id, sentences in tqdm(formatted_publications.items(), total=len(formatted_publications)):
-        if publication_id in citation_dict:
-            mention_list = citation_dict[publication_id] # [[data_set_id, formatted_mention_list]]
-            label_sequence_list, cnt = encode(sentences, mention_list)
-            found_cnt += cnt
-            for sentence, label_sequence in zip(sentences, label_sequence_list):
-                output.append({'publication_id': publication_id,
-                               'sentence': sentence,
-                               'label_sequence': label_sequence})
-        else:
-            for sentence in sentences:
-                label_sequence = ['_' for _ in sentence]
-                output.append({'publication_id': publication_id,
-                               'sentence': sentence,
-                               'label_sequence': label_sequence})
-    print("found mentions: ", end='')
-    print(found_cnt)
-    return output
-
-
-def extract_formatted_data_test(formatted_publications, data_set_mention_info, pub_date_dict):
-    output = []
-    found_cnt = 0
-    for publication_id, [sentences, raw_text] in tqdm(formatted_publications.items(), total=len(formatted_publications)):
-        label_sequence = encode_test(raw_text, data_set_mention_info, pub_date_dict[publication_id])
-        startidx = 0
-        for sentence in sentences:
-            sub_label_sequence = label_sequence[startidx:startidx+len(sentence)]
-            startidx += len(sub_label_sequence)
-            if sub_label_sequence[0] == 'I':
-                for i, l in enumerate(sub_label_sequence):
-                    if l == 'I':
-                        sub_label_sequence[i] = '_'
-                    else:
-                        break
-            labeled = 'N'
-            if len(set(sub_label_sequence)) != 1:
-                labeled = 'Y'
-            output.append({'publication_id': publication_id,
-                           'sentence': sentence,
-                           'label_sequence': sub_label_sequence,
-                           'labeled': labeled})
-        for l in label_sequence:
-            if 'B' in l:
-                found_cnt += 1
-    print("found mentions: ", end='')
-    print(found_cnt)
-    return output
+ELMO_DIM = 1024
+# sentences ELMo embeds at a time, and sentences read at once and sorted by length, so that a batch pads to similar lengths
+ELMO_BATCH_SIZE = 64
+ELMO_BUCKET_SIZE = 64 * 32
 
 
 # Misc helper functions
@@ -245,24 +58,20 @@ def index_sequence(item2idx, seq):
 
 def get_embedding_matrix(word2idx, idx2word, args, normalization=False):
     embedding_dim = 300
-    glove_vectors = {}
-    with open(args.glove_path) as glove_file:
-        for line in tqdm(glove_file, total=get_num_lines(args.glove_path)):
-            split_line = line.rstrip().split()
-            word = split_line[0]
-            if len(split_line) != (embedding_dim + 1) or word not in word2idx:
-                continue
-            assert (len(split_line) == embedding_dim + 1)
-            vector = np.array([float(x) for x in split_line[1:]], dtype="float32")
-            if normalization:
-                vector = vector / np.linalg.norm(vector)
-            assert len(vector) == embedding_dim
-            glove_vectors[word] = vector
-
-    logging.info("Number of pre-trained word vectors loaded: {}".format(len(glove_vectors)))
-
-    # Calculate mean and stdev of embeddings
-    all_embeddings = np.array(list(glove_vectors.values()))
+    # the vectors of the vocabulary are gathered from the memory-mapped store, the text file is converted only once
+    glove_store = open_glove_store(args.glove_path, args.glove_store)
+    assert glove_store.embedding_dim == embedding_dim
+    vocab_size = len(word2idx)
+    rows = glove_store.rows([idx2word[i] for i in range(vocab_size)])
+    found = np.flatnonzero(rows != -1)
+    glove_vectors = glove_store.vectors[rows[found]]
+    if normalization:
+        glove_vectors = glove_vectors / np.linalg.norm(glove_vectors, axis=1, keepdims=True)
+
+    logging.info("Number of pre-trained word vectors loaded: {}".format(len(found)))
+
+    # Calculate mean and stdev of embeddings, in the order of the glove file
+    all_embeddings = glove_vectors[np.argsort(rows[found])]
     embeddings_mean = float(np.mean(all_embeddings))
     embeddings_stdev = float(np.std(all_embeddings))
     logging.info("Embeddings mean: {}".format(embeddings_mean))
@@ -270,14 +79,10 @@ def get_embedding_matrix(word2idx, idx2word, args, normalization=False):
 
     # Randomly initialize an embedding matrix of (vocab_size, embedding_dim) shape
     # with a similar distribution as the pretrained embeddings for words in vocab.
-    vocab_size = len(word2idx)
     embedding_matrix = torch.FloatTensor(vocab_size, embedding_dim).normal_(embeddings_mean, embeddings_stdev)
-    # Go through the embedding matrix and replace the random vector with a
-    # pretrained one if available. Start iteration at 2 since 0, 1 are PAD, UNK
-    for i in range(2, vocab_size):
-        word = idx2word[i]
-        if word in glove_vectors:
-            embedding_matrix[i] = torch.FloatTensor(glove_vectors[word])
+    # Replace the random vectors with the pretrained ones where available. Not for 0, 1 since they are PAD, UNK
+    pretrained = found >= 2
+    embedding_matrix[torch.from_numpy(found[pretrained])] = torch.from_numpy(glove_vectors[pretrained])
     if normalization:
         for i in range(vocab_size):
             embedding_matrix[i] = embedding_matrix[i] / float(np.linalg.norm(embedding_matrix[i]))
@@ -287,21 +92,32 @@ def get_embedding_matrix(word2idx, idx2word, args, normalization=False):
 
 
 def get_vocab(raw_dataset):
-    vocab = []
-    for example in raw_dataset:
-        vocab.extend(example[0])
-    vocab = set(vocab)
+    """
+
+    :param raw_dataset: TokenSequences of the sentences, or examples whose first item is the list of words
+    :return: the sorted ids of the words of the sentences (int32 array), or the set of the words
+    """
+    if isinstance(raw_dataset, TokenSequences):
+        vocab = raw_dataset.unique()
+    else:
+        vocab = []
+        for example in raw_dataset:
+            vocab.extend(example[0])
+        vocab = set(vocab)
     logging.info("vocab size: {}".format(len(vocab)))
     return vocab
 
 
-def get_word2idx_idx2word(vocab):
+def get_word2idx_idx2word(vocab, vocabulary=None):
     """
 
-    :param vocab: a set of strings: vocabulary
+    :param vocab: a set of strings: vocabulary, or an array of word ids of vocabulary (see get_vocab())
+    :param vocabulary: the Vocabulary the ids of vocab are of
     :return: word2idx: string to an int
              idx2word: int to a string
     """
+    if vocabulary is not None:
+        vocab = vocabulary.decode(vocab)
     word2idx = {"<PAD>": 0, "<UNK>": 1}
     idx2word = {0: "<PAD>", 1: "<UNK>"}
     for word in vocab:
@@ -311,7 +127,8 @@ def get_word2idx_idx2word(vocab):
     return word2idx, idx2word
 
 
-def embed_indexed_sequence(words, word2idx, glove_embeddings, elmo_embedder):
+def embed_indexed_sequence(words, word2idx, glove_embeddings, elmo_embedder, elmo_vectors=None):
+    # elmo_vectors: the ELMo vectors of words when they were embedded in a batch already (see iter_elmo_vectors())
     indexed_sequence = [word2idx.get(x, 1) for x in words]
     # glove_part has shape: (seq_len, glove_dim)
     glove_part = glove_embeddings(Variable(torch.LongTensor(indexed_sequence)))
@@ -329,8 +146,8 @@ def embed_indexed_sequence(words, word2idx, glove_embeddings, elmo_embedder):
             #torch.LongTensor(indexed_sequence)
     # 2. embed the sequence by elmo vectors
     if elmo_embedder is not None:
-        elmo_part = elmo_embedder.embed_sentence(words)[2]
-        assert (elmo_part.shape == (len(words), 1024))
+        elmo_part = elmo_embedder.embed_sentence(words)[2] if elmo_vectors is None else elmo_vectors
+        assert (elmo_part.shape == (len(words), ELMO_DIM))
     if elmo_embedder is None:
         result = glove_part.data
     else:  # elmo != None, pos = None
@@ -339,6 +156,50 @@ def embed_indexed_sequence(words, word2idx, glove_embeddings, elmo_embedder):
     return result
 
 
+def embed_elmo_batch(batch, elmo_embedder):
+    # the top layer vectors of the sentences of batch, none of them empty, in one run of the char-CNN and the biLM
+    activations, mask = elmo_embedder.batch_to_embeddings(batch)
+    top_layer = activations[:, 2].detach().cpu().numpy()
+    return [top_layer[i, :len(words)] for i, words in enumerate(batch)]
+
+
+def iter_elmo_vectors(sentences, elmo_embedder, batch_size=ELMO_BATCH_SIZE, bucket_size=ELMO_BUCKET_SIZE):
+    """
+    The ELMo vectors of every sentence (list of words) in the order given, the (len(words), 1024) top layer
+    elmo_embedder.embed_sentence(words)[2] is, but embedded batch_size sentences at a time:
+    bucket_size sentences are read at once and sorted by length, a batch pads only to the longest of similar ones.
+    ELMo keeps states between batches (see ElmoEmbedder), the vectors differ a little from the ones of
+    one sentence at a time, as those differ between runs.
+    """
+    sentences = iter(sentences)
+    while True:
+        bucket = list(itertools.islice(sentences, bucket_size))
+        if not bucket:
+            return
+        # the empty sentences are not embedded, as embed_sentence() does not
+        vectors = [np.zeros((0, ELMO_DIM)) for _ in bucket]
+        order = sorted((i for i, words in enumerate(bucket) if words), key=lambda i: len(bucket[i]))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            for i, batch_vectors in zip(batch, embed_elmo_batch([bucket[i] for i in batch], elmo_embedder)):
+                vectors[i] = batch_vectors
+        yield from vectors
+
+
+def iter_embedded_sequences(sentences, word2idx, glove_embeddings, elmo_embedder, batch_size=ELMO_BATCH_SIZE,
+                            bucket_size=ELMO_BUCKET_SIZE):
+    """
+    embed_indexed_sequence() of every sentence in the order given, their ELMo vectors embedded in batches (see iter_elmo_vectors()).
+    """
+    if elmo_embedder is None:
+        for words in sentences:
+            yield embed_indexed_sequence(words, word2idx, glove_embeddings, elmo_embedder)
+        return
+    sentences, elmo_sentences = itertools.tee(sentences)
+    for words, elmo_vectors in zip(sentences, iter_elmo_vectors(elmo_sentences, elmo_embedder, batch_size, bucket_size)):
+        yield embed_indexed_sequence(words, word2idx, glove_embeddings, elmo_embedder, elmo_vectors)
+
+
 def evaluate(evaluation_dataloader, model, criterion, using_GPU):
     model.eval()
 
@@ -547,16 +408,11 @@ def write_predictions(raw_dataset, evaluation_dataloader, model, using_GPU, rawd
     assert (len(predictions) == len(raw_dataset))
 
     # read original data
-    data = []
-    with open(rawdata_filename) as f:
-        lines = csv.reader(f)
-        for line in lines:
-            data.append(line)
+    data = list(SentenceTable(rawdata_filename))
 
     # append predictions to the original data
-    data[0].append('label_sequence')
     for i in range(len(predictions)):
-        data[i + 1].append(predictions[i])
+        data[i]['label_sequence'] = predictions[i]
     return data
 
 
@@ -570,7 +426,7 @@ def print_info(matrix):
 
 # Make sure to subclass torch.utils.data.Dataset
 class TextDatasetWithGloveElmoSuffix(Dataset):
-    def __init__(self, text, labels, word2idx, glove_embeddings, elmo):
+    def __init__(self, text, labels, word2idx, glove_embeddings, elmo, vocabulary=None):
         if len(text) != len(labels):
             raise ValueError("Differing number of sentences and labels!")
         # A list of numpy arrays, where each inner numpy arrays is sequence_length * embed_dim
@@ -584,16 +440,46 @@ class TextDatasetWithGloveElmoSuffix(Dataset):
         self.word2idx = word2idx
         self.glove = glove_embeddings
         self.elmo = elmo
+        # text and labels are TokenSequences of word ids of vocabulary and of label codes when given
+        self.vocabulary = vocabulary
 
-    def __getitem__(self, idx):
+    def _words_and_labels(self, idx):
         example_text = self.text[idx]
-        example_text = embed_indexed_sequence(example_text, self.word2idx, self.glove, self.elmo)
         example_label_seq = self.labels[idx]
+        if self.vocabulary is not None:
+            example_text = self.vocabulary.decode(example_text)
+            example_label_seq = example_label_seq.tolist()
+        return example_text, example_label_seq
+
+    @staticmethod
+    def _example(example_text, example_label_seq):
         # Truncate the sequence if necessary
         example_length = example_text.shape[0]
         assert (example_length == len(example_label_seq))
         return example_text, example_length, example_label_seq
 
+    def __getitem__(self, idx):
+        example_text, example_label_seq = self._words_and_labels(idx)
+        example_text = embed_indexed_sequence(example_text, self.word2idx, self.glove, self.elmo)
+        return self._example(example_text, example_label_seq)
+
+    def __getitems__(self, indexes):
+        """
+        The examples of indexes, their ELMo vectors embedded together in batches sorted by length.
+        """
+        examples = [self._words_and_labels(idx) for idx in indexes]
+        embedded = iter_embedded_sequences((example_text for example_text, _ in examples), self.word2idx, self.glove,
+                                           self.elmo, bucket_size=len(examples))
+        return [self._example(example_text, example_label_seq)
+                for example_text, (_, example_label_seq) in zip(embedded, examples)]
+
+    def collate_indexes(self, indexes):
+        """
+        collate_fn of a DataLoader over range(len(dataset)): the batch of the examples of the indexes it took,
+        embedded together, where a DataLoader over the dataset embeds its examples one at a time.
+        """
+        return self.collate_fn(self.__getitems__(indexes))
+
     def __len__(self):
         """
         Return the number of examples in the Dataset.